@@ -0,0 +1,64 @@
+from __future__ import print_function
+from __future__ import unicode_literals
+import datetime
+import json
+import pytz
+import timeit
+
+from scorched import javabin
+from scorched.response import SolrResponse
+
+# decoding benchmark, no running solr is needed
+
+
+def build(n):
+    docs = []
+    for i in range(n):
+        doc = {'author_t': 'George R.R. Martin',
+               'cat': ['book', 'paperback'],
+               'date_dt': datetime.datetime(2014, 3, 11, 10, 49, 0, 747000,
+                                            tzinfo=pytz.utc),
+               'genre_s': 'fantasy',
+               'id': '%s' % i,
+               'inStock': True,
+               'name': 'A fisch of Thrones',
+               'price': 7.99,
+               'sequence_i': i,
+               'series_t': 'A Song of Ice and Fire'}
+        docs.append(doc)
+    return docs
+
+
+def as_json(docs):
+    docs = [dict(d, date_dt=d['date_dt'].strftime('%Y-%m-%dT%H:%M:%S.%fZ'))
+            for d in docs]
+    return json.dumps({'responseHeader': {'status': 0, 'QTime': 1},
+                       'response': {'numFound': len(docs), 'start': 0,
+                                    'docs': docs}})
+
+
+def as_javabin(docs):
+    return javabin.dumps(javabin.NamedList([
+        ('responseHeader', {'status': 0, 'QTime': 1}),
+        ('response', javabin.DocumentList(docs))]))
+
+
+def run(n, repeat=5):
+    docs = build(n)
+    text = as_json(docs)
+    data = as_javabin(docs)
+    datefields = ('_dt',)
+    t_json = min(timeit.repeat(
+        lambda: SolrResponse.from_json(text, datefields),
+        number=1, repeat=repeat))
+    t_javabin = min(timeit.repeat(
+        lambda: SolrResponse.from_javabin(data, datefields),
+        number=1, repeat=repeat))
+    print("%6s docs: json %7.1fms (%7s bytes)  javabin %7.1fms "
+          "(%7s bytes)" % (n, t_json * 1000, len(text.encode('utf-8')),
+                           t_javabin * 1000, len(data)))
+
+
+if __name__ == '__main__':
+    for n in (10, 100, 1000, 10000):
+        run(n)
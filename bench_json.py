@@ -0,0 +1,74 @@
+from __future__ import print_function
+from __future__ import unicode_literals
+import datetime
+import json
+import pytz
+import timeit
+
+from scorched import fields
+from scorched.jsoncodec import CODECS
+from scorched.response import SolrResponse
+
+# json codec benchmark, no running solr is needed
+
+
+def build(n):
+    docs = []
+    for i in range(n):
+        doc = {'author_t': 'George R.R. Martin',
+               'cat': ['book', 'paperback'],
+               'date_dt': datetime.datetime(2014, 3, 11, 10, 49, 0, 747000,
+                                            tzinfo=pytz.utc),
+               'genre_s': 'fantasy',
+               'id': '%s' % i,
+               'inStock': True,
+               'name': 'A fisch of Thrones',
+               'price': 7.99,
+               'sequence_i': i,
+               'series_t': 'A Song of Ice and Fire',
+               'summary_t': None}
+        docs.append(doc)
+    return docs
+
+
+def as_json(docs):
+    docs = [dict(fields.drop_none(d), date_dt=fields.format_datetime(
+        d['date_dt'])) for d in docs]
+    return json.dumps({'responseHeader': {'status': 0, 'QTime': 1},
+                       'response': {'numFound': len(docs), 'start': 0,
+                                    'docs': docs}}).encode('utf-8')
+
+
+def installed():
+    codecs = []
+    for name in sorted(CODECS):
+        try:
+            codecs.append(CODECS[name]())
+        except ImportError:
+            print("%s is not installed" % name)
+    return codecs
+
+
+def run(n, codecs, repeat=5):
+    docs = build(n)
+    body = as_json(docs)
+    datefields = ('_dt',)
+    for codec in codecs:
+        t_loads = min(timeit.repeat(
+            lambda: codec.loads(body), number=1, repeat=repeat))
+        t_response = min(timeit.repeat(
+            lambda: SolrResponse.from_json(body, datefields,
+                                           loads=codec.loads),
+            number=1, repeat=repeat))
+        t_dumps = min(timeit.repeat(
+            lambda: codec.dumps([fields.drop_none(d) for d in docs]),
+            number=1, repeat=repeat))
+        print("%6s docs %-6s: loads %7.1fms  response %7.1fms  "
+              "update %7.1fms" % (n, codec.name, t_loads * 1000,
+                                  t_response * 1000, t_dumps * 1000))
+
+
+if __name__ == '__main__':
+    codecs = installed()
+    for n in (10, 100, 1000, 10000):
+        run(n, codecs)
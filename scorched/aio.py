@@ -0,0 +1,655 @@
+"""
+asyncio interface to solr.
+
+:class:`AsyncSolrInterface` mirrors :class:`scorched.SolrInterface` but
+every method that talks to solr is a coroutine. Query building and response
+parsing are shared with the synchronous interface; only the transport
+differs. The transport is pluggable, by default aiohttp is used.
+
+::
+
+    >>> si = AsyncSolrInterface("http://localhost:8983/solr/")
+    >>> res = await si.query(genre_s="fantasy").execute()
+    >>> await si.close()
+"""
+from __future__ import unicode_literals
+import asyncio
+import concurrent.futures
+import json
+import requests
+import time
+import scorched.compat
+import scorched.connection
+import scorched.exc
+import scorched.fields
+import scorched.jsoncodec
+import scorched.search
+import scorched.singleflight
+
+from scorched.compat import str
+
+
+class TransportResponse(object):
+    """
+    Minimal response object returned by async transports. It offers the
+    subset of :class:`requests.Response` scorched relies on.
+    """
+
+    def __init__(self, status_code, content, headers=None,
+                 encoding='utf-8'):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AiohttpTransport(object):
+    """
+    Default transport based on an ``aiohttp.ClientSession``. Connection
+    failures are raised as :class:`requests.exceptions.ConnectionError` so
+    the retry handling is the same as for the synchronous connection.
+    """
+
+    def __init__(self, session=None):
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError(
+                "AiohttpTransport needs aiohttp, install it or pass another "
+                "transport to AsyncSolrInterface")
+        self._aiohttp = aiohttp
+        self._session = session
+        self._own_session = session is None
+
+    @property
+    def session(self):
+        # the session must be created inside a running event loop
+        if self._session is None:
+            self._session = self._aiohttp.ClientSession()
+        return self._session
+
+    async def request(self, method, url, data=None, headers=None,
+                      timeout=None, **kwargs):
+        if timeout is not None:
+            if isinstance(timeout, tuple):
+                kwargs['timeout'] = self._aiohttp.ClientTimeout(
+                    sock_connect=timeout[0], sock_read=timeout[1])
+            else:
+                kwargs['timeout'] = self._aiohttp.ClientTimeout(total=timeout)
+        try:
+            async with self.session.request(
+                    method, url, data=data, headers=headers,
+                    **kwargs) as response:
+                content = await response.read()
+                return TransportResponse(
+                    response.status, content,
+                    requests.structures.CaseInsensitiveDict(response.headers),
+                    response.charset or 'utf-8')
+        except self._aiohttp.ClientConnectionError as e:
+            raise requests.exceptions.ConnectionError(e)
+
+    async def close(self):
+        if self._own_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class AsyncSingleFlight(scorched.singleflight.SingleFlight):
+    """
+    :class:`scorched.singleflight.SingleFlight` for coroutines of one event
+    loop. Followers also repeat the request if the leader was cancelled.
+    """
+
+    async def do(self, key, func, deadline=None):
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                return await self._lead(key, func)
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    raise scorched.exc.DeadlineExceeded("Deadline exceeded")
+            try:
+                # the shield keeps a follower timing out from cancelling
+                # the request of the leader
+                result = await asyncio.wait_for(asyncio.shield(future),
+                                                timeout)
+            except asyncio.TimeoutError:
+                raise scorched.exc.DeadlineExceeded("Deadline exceeded")
+            except BaseException as e:
+                if future.cancelled() or self.retriable(e):
+                    continue
+                raise
+            self.coalesced += 1
+            return result
+
+    async def _lead(self, key, func):
+        future = self._calls[key] = asyncio.get_event_loop().create_future()
+        self.leaders += 1
+        try:
+            result = await func()
+        except BaseException as e:
+            self.leader_failures += 1
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # the exception is reported by raising it here, not by the
+                # future
+                future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+
+class AsyncSolrConnection(scorched.connection.SolrConnection):
+    single_flight_class = AsyncSingleFlight
+    # seconds a health probe waits for the event loop and the replica
+    ping_timeout = 10
+
+    def __init__(self, url, transport, mode, retry_timeout,
+                 max_length_get_url, **kwargs):
+        """
+        :param url: url to solr
+        :type url: str
+        :param transport: transport with a coroutine ``request`` method
+        :type transport: AiohttpTransport
+        :param mode: mode (readable, writable) solr
+        :type mode: str
+        :param retry_timeout: timeout until retry
+        :type retry_timeout: int
+        :param max_length_get_url: max length until switch to post
+        :type max_length_get_url: int
+        :param kwargs: optional -- further options of
+                       :class:`scorched.connection.SolrConnection`
+        :type kwargs: dict
+        """
+        super(AsyncSolrConnection, self).__init__(
+            url, transport, mode, retry_timeout, max_length_get_url, **kwargs)
+        # event loop of the last request, health probes are sent through it
+        self._loop = None
+
+    async def request(self, method, url, idempotent=None, deadline=None,
+                      **kwargs):
+        if idempotent is None:
+            idempotent = method in ('GET', 'HEAD')
+        self._loop = asyncio.get_event_loop()
+        if self.timeout is not None:
+            kwargs['timeout'] = self.timeout
+        breaker = self.circuit_breaker_for(url)
+        attempt = 0
+        while True:
+            attempt += 1
+            remaining = None
+            if deadline is not None:
+                # raises DeadlineExceeded if nothing is left
+                self.timeout_for(deadline)
+                remaining = deadline - time.time()
+            trial = None
+            if breaker is not None:
+                trial = breaker.before_request()
+            try:
+                response = await asyncio.wait_for(
+                    self.http_connection.request(method, url, **kwargs),
+                    remaining)
+            except asyncio.TimeoutError:
+                self._record_attempt(breaker)
+                raise scorched.exc.DeadlineExceeded("Deadline exceeded")
+            except requests.exceptions.RequestException as e:
+                self._record_attempt(breaker)
+                delay = self._retry_delay(attempt, idempotent, deadline,
+                                          exception=e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            else:
+                self._record_attempt(breaker, response)
+            finally:
+                # e.g. a cancelled task must not block the half open circuit
+                if trial is not None:
+                    breaker.release_trial(trial)
+            self.transfer_stats.record_received(response)
+            delay = self._retry_delay(attempt, idempotent, deadline,
+                                      response=response)
+            if delay is None:
+                return response
+            await asyncio.sleep(delay)
+
+    def ping(self, node):
+        # probes run in the health check thread, the request is handed to
+        # the event loop the transport belongs to
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            return False
+        future = asyncio.run_coroutine_threadsafe(
+            self.http_connection.request(
+                'GET', node.url + self.ping_path, timeout=5), loop)
+        try:
+            response = future.result(self.ping_timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            return False
+        return response.status_code == 200
+
+    async def _read_request(self, build, deadline=None):
+        if self.replicas is None:
+            method, url, kwargs = build(self.url)
+            return await self.request(method, url, idempotent=True,
+                                      deadline=deadline, **kwargs)
+        tried = []
+        while True:
+            node = self.replicas.select(exclude=tried)
+            method, url, kwargs = build(node.url)
+            start = time.time()
+            try:
+                response = await self.request(method, url, idempotent=True,
+                                              deadline=deadline, **kwargs)
+            except BaseException as e:
+                # cancellation included, the node must be released
+                if not self._fail_over(node, tried, start, deadline, error=e):
+                    raise
+                continue
+            # the body of a transport response is already read
+            if not self._fail_over(node, tried, start, deadline,
+                                   response=response):
+                return response
+
+    async def update(self, update_doc, **kwargs):
+        method, url, kwargs = self._update_request(update_doc, **kwargs)
+        response = await self.request(method, url, **kwargs)
+        if response.status_code != 200:
+            raise self.update_error(response)
+        self._record_update(update_doc, kwargs['data'])
+
+    async def select(self, params, deadline=None, parse=None):
+        if self.single_flight is None:
+            return await self._select(params, deadline, parse)
+        return await self.single_flight.do(
+            (scorched.connection.search_key(params), parse is None),
+            lambda: self._select(params, deadline, parse),
+            deadline=deadline)
+
+    async def _select(self, params, deadline, parse):
+        validated = []
+
+        def build(base_url):
+            method, url, kwargs = self._select_request(list(params), base_url)
+            return method, url, self._conditional(
+                method, url, kwargs, validated)
+        response = await self._read_request(build, deadline=deadline)
+        return self._validated_response(response, params, parse, validated)
+
+    async def mlt(self, params, content=None, deadline=None, raw=False):
+        response = await self._read_request(
+            lambda base_url: self._mlt_request(
+                list(params), content=content, base_url=base_url),
+            deadline=deadline)
+        if response.status_code != 200:
+            raise scorched.exc.SolrError(response.content)
+        return self.response_body(response, params, raw=raw)
+
+    async def get(self, params, deadline=None):
+        method, url, kwargs = self._get_request(list(params))
+        response = await self.request(method, url, idempotent=True,
+                                      deadline=deadline, **kwargs)
+        if response.status_code != 200:
+            raise scorched.exc.SolrError(response)
+        return response.content
+
+
+class AsyncSolrInterface(scorched.connection.SolrInterface):
+    # in effect until a coroutine loaded the schema
+    _schema_codecs = scorched.fields.FieldCodecs({})
+    _schema_datefields = ()
+    _schema_unique_key = 'id'
+    _schema_loop = None
+    _schema_async_lock = None
+
+    def __init__(self, url, transport=None, mode='', retry_timeout=-1,
+                 max_length_get_url=scorched.connection.MAX_LENGTH_GET_URL,
+                 schema=None, deadline=None, response_format='json',
+                 cache=None, schema_cache=None, json_codec='json', **kwargs):
+        """
+        :param url: url to solr
+        :type url: str
+        :param transport: optional -- transport with a coroutine ``request``
+                          method, defaults to :class:`AiohttpTransport`
+        :type transport: object
+        :param mode: optional -- mode (readable, writable) solr
+        :type mode: str
+        :param retry_timeout: optional -- timeout until retry
+        :type retry_timeout: int
+        :param max_length_get_url: optional -- max length until switch to post
+        :type max_length_get_url: int
+        :param schema: optional -- schema dict, fetched on first use otherwise
+        :type schema: dict
+        :param deadline: optional -- default deadline of searches in seconds
+        :type deadline: float
+        :param response_format: optional -- ``json`` or ``javabin``
+        :type response_format: str
+        :param cache: optional -- cache of search responses
+        :type cache: scorched.cache.ResultCache
+        :param schema_cache: optional -- local file the fetched schema is
+                             persisted in
+        :type schema_cache: scorched.cache.SchemaCache
+        :param json_codec: optional -- see :class:`scorched.SolrInterface`
+        :type json_codec: str or object
+        :param kwargs: optional -- further connection options as accepted by
+                       :class:`scorched.SolrInterface`, e.g. ``retry_policy``
+                       or ``timeout``
+        :type kwargs: dict
+        """
+        if transport is None:
+            transport = AiohttpTransport()
+        self.transport = transport
+        self.conn = AsyncSolrConnection(
+            url, transport, mode, retry_timeout, max_length_get_url, **kwargs)
+        self.deadline = deadline
+        self.response_format = response_format
+        self.json_codec = scorched.jsoncodec.get_codec(json_codec)
+        self.cache = cache
+        self.schema_cache = schema_cache
+        self._schema = None
+        if schema is not None:
+            self._set_schema(schema)
+
+    def _require_schema(self):
+        # coroutines await _ensure_schema, until then the defaults apply
+        pass
+
+    async def init_schema(self):
+        url = scorched.compat.urljoin(self.conn.url, self.remote_schema_file)
+        entry = self._stored_schema(url)
+        if entry is not None and self.schema_cache.fresh(entry):
+            return entry['schema']
+        try:
+            response = await self.conn.request(
+                'GET', url, headers=self._schema_validators(entry))
+        except requests.exceptions.RequestException as e:
+            return self._stale_schema(entry, e)
+        return self._schema_from_response(response, url, entry)
+
+    async def _ensure_schema(self):
+        if self._schema is not None:
+            return
+        # concurrent coroutines wait for the first one fetching the schema
+        async with self._schema_fetch_lock():
+            if self._schema is None:
+                self._set_schema(await self.init_schema())
+
+    def _schema_fetch_lock(self):
+        # an asyncio lock belongs to one event loop
+        loop = asyncio.get_event_loop()
+        if self._schema_loop is not loop:
+            self._schema_loop = loop
+            self._schema_async_lock = asyncio.Lock()
+        return self._schema_async_lock
+
+    async def close(self):
+        """
+        Close the transport if it supports closing.
+        """
+        close = getattr(self.transport, 'close', None)
+        if close is not None:
+            await close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def schema_field(self, name):
+        """
+        Coroutine version of :meth:`scorched.SolrInterface.schema_field`.
+        """
+        await self._ensure_schema()
+        return self._schema_field(name)
+
+    async def has_docvalues(self, name):
+        """
+        Coroutine version of :meth:`scorched.SolrInterface.has_docvalues`.
+        """
+        await self._ensure_schema()
+        return super(AsyncSolrInterface, self).has_docvalues(name)
+
+    def export(self, *args, **kwargs):
+        raise scorched.exc.NotSupportedError(
+            "export is not supported by AsyncSolrInterface, use "
+            "iter_cursor()")
+
+    async def add(self, docs, chunk=100, workers=None, max_in_flight=None,
+                  stream=False, batcher=None, **kwargs):
+        """
+        :param docs: documents to be added
+        :type docs: dict
+        :param chunk: optional -- size of chunks in witch the add command
+        schould be splitted
+        :type chunk: int
+        :param kwargs: optinal -- additional arguments
+        :type kwargs: dict
+
+        Add a document or a list of document to solr. The chunks are sent
+        one after the other, ``workers``, ``max_in_flight``, ``stream`` and
+        ``batcher`` of :meth:`scorched.SolrInterface.add` are not supported.
+        """
+        if workers or max_in_flight or stream or batcher is not None:
+            raise scorched.exc.NotSupportedError(
+                "workers, max_in_flight, stream and batcher are not "
+                "supported by AsyncSolrInterface.add")
+        # date strings are converted by the field codecs of the schema
+        await self._ensure_schema()
+        for update_message in self._add_messages(docs, chunk):
+            await self.conn.update(update_message, **kwargs)
+        self._invalidate_after(kwargs)
+
+    async def update_fields(self, id, **kwargs):
+        """
+        See :meth:`scorched.SolrInterface.update_fields`.
+        """
+        await self._ensure_schema()
+        await super(AsyncSolrInterface, self).update_fields(id, **kwargs)
+
+    async def update_fields_many(self, updates, **kwargs):
+        """
+        See :meth:`scorched.SolrInterface.update_fields_many`.
+        """
+        await self._ensure_schema()
+        await super(AsyncSolrInterface, self).update_fields_many(
+            updates, **kwargs)
+
+    async def delete_by_query(self, query, **kwargs):
+        delete_message = self.json_codec.dumps(
+            {"delete": {"query": str(query)}})
+        await self.conn.update(delete_message, **kwargs)
+        self.invalidate_cache()
+
+    async def delete_by_ids(self, ids, **kwargs):
+        delete_message = self.json_codec.dumps({"delete": ids})
+        await self.conn.update(delete_message, **kwargs)
+        self.invalidate_cache()
+
+    async def commit(self, waitSearcher=None, expungeDeletes=None,
+                     softCommit=None):
+        await self.conn.update('{"commit": {}}', commit=True,
+                               waitSearcher=waitSearcher,
+                               expungeDeletes=expungeDeletes,
+                               softCommit=softCommit)
+        self.invalidate_cache()
+
+    async def optimize(self, waitSearcher=None, maxSegments=None):
+        await self.conn.update('{"optimize": {}}', optimize=True,
+                               waitSearcher=waitSearcher,
+                               maxSegments=maxSegments)
+        self.invalidate_cache()
+
+    async def rollback(self):
+        await self.conn.update('{"rollback": {}}')
+        self.invalidate_cache()
+
+    async def delete_all(self):
+        await self.delete_by_query(self.Q(**{"*": "*"}))
+
+    async def search(self, deadline=None, cache_ttl=None, **kwargs):
+        """
+        :returns: SolrResponse  -- A solr response object.
+
+        Search solr
+        """
+        deadline, kwargs = self._deadline(deadline, kwargs)
+        wt, kwargs = self._response_format(kwargs)
+        await self._ensure_schema()
+        params = scorched.search.params_from_dict(**kwargs)
+        key = self._cache_key(cache_ttl, 'select', params)
+        ret, generation = self._cached(key)
+        if ret is None:
+            ret, size = await self.conn.select(params, deadline=deadline,
+                                               parse=self._parser(wt))
+            self._store(key, ret, size, cache_ttl, generation)
+        return ret
+
+    async def search_many(self, searches, max_concurrency=8, deadline=None,
+                          return_exceptions=True):
+        """
+        Coroutine version of :meth:`scorched.SolrInterface.search_many`.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        deadline_at = None
+        if deadline is not None:
+            deadline_at = time.time() + deadline
+
+        async def run(search):
+            async with semaphore:
+                return await self._execute_before(search, deadline_at)
+        return await asyncio.gather(
+            *[run(search) for search in searches],
+            return_exceptions=return_exceptions)
+
+    async def get(self, ids, fields=None, chunk=100, max_concurrency=4,
+                  deadline=None):
+        """
+        Coroutine version of :meth:`scorched.SolrInterface.get`.
+        """
+        await self._ensure_schema()
+        if deadline is None:
+            deadline = self.deadline
+        if deadline is not None:
+            deadline = time.time() + deadline
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run(params):
+            async with semaphore:
+                return await self.conn.get(params, deadline=deadline)
+        return self._got_docs(await asyncio.gather(
+            *[run(params) for params in self._get_params(ids, fields, chunk)],
+            return_exceptions=True))
+
+    def query(self, *args, **kwargs):
+        """
+        :returns: AsyncSolrSearch -- A solrsearch.
+
+        Build a solr query
+        """
+        q = AsyncSolrSearch(self)
+        if len(args) + len(kwargs) > 0:
+            return q.query(*args, **kwargs)
+        else:
+            return q
+
+    async def mlt_search(self, content=None, deadline=None, cache_ttl=None,
+                         **kwargs):
+        """
+        Mlt search solr
+        """
+        deadline, kwargs = self._deadline(deadline, kwargs)
+        wt, kwargs = self._response_format(kwargs)
+        await self._ensure_schema()
+        params = scorched.search.params_from_dict(**kwargs)
+        key = self._cache_key(cache_ttl, 'mlt', params, content)
+        ret, generation = self._cached(key)
+        if ret is None:
+            body = await self.conn.mlt(params, content=content,
+                                       deadline=deadline, raw=True)
+            ret = self._parse_response(body, wt)
+            self._store(key, ret, len(body), cache_ttl, generation)
+        return ret
+
+    def mlt_query(self, fields, content=None, content_charset=None,
+                  url=None, query_fields=None, **kwargs):
+        q = AsyncMltSolrSearch(
+            self, content=content, content_charset=content_charset, url=url)
+        return q.mlt(fields=fields, query_fields=query_fields, **kwargs)
+
+
+class AsyncSolrSearch(scorched.search.SolrSearch):
+    """
+    :class:`scorched.search.SolrSearch` executed by coroutines. Streaming
+    and exporting need a blocking connection and are not supported, use
+    :meth:`iter_cursor` to walk through large result sets.
+    """
+
+    async def execute(self, constructor=None):
+        ret = await self.interface.search(
+            deadline=self.time_limiter.seconds, cache_ttl=self.cacher.ttl,
+            **self.options())
+        if constructor:
+            ret = self.constructor(ret, constructor)
+        return ret
+
+    async def cursor_pages(self, page_size=100, constructor=None):
+        await self.interface._ensure_schema()
+        search = self._cursor_search(page_size)
+        options = search._cursor_options()
+        cursor = '*'
+        while True:
+            ret = await self.interface.search(
+                deadline=search.time_limiter.seconds, cursorMark=cursor,
+                cache_ttl=0, **options)
+            if constructor:
+                ret = self.constructor(ret, constructor)
+            yield ret
+            if ret.nextCursorMark in (None, cursor):
+                return
+            cursor = ret.nextCursorMark
+
+    async def iter_cursor(self, page_size=100, constructor=None):
+        async for page in self.cursor_pages(page_size, constructor):
+            for doc in page.result.docs:
+                yield doc
+
+    def _not_supported(self, name):
+        raise scorched.exc.NotSupportedError(
+            "%s is not supported by AsyncSolrSearch, use iter_cursor()"
+            % name)
+
+    def stream(self, constructor=None):
+        self._not_supported('stream')
+
+    def export(self, *args, **kwargs):
+        self._not_supported('export')
+
+    def parallel_export(self, *args, **kwargs):
+        self._not_supported('parallel_export')
+
+
+class AsyncMltSolrSearch(scorched.search.MltSolrSearch):
+
+    async def execute(self, constructor=None):
+        ret = await self.interface.mlt_search(
+            content=self.content, deadline=self.time_limiter.seconds,
+            cache_ttl=self.cacher.ttl, **self.options())
+        if constructor:
+            ret = self.constructor(ret, constructor)
+        return ret
@@ -0,0 +1,257 @@
+from __future__ import unicode_literals
+import collections
+import json
+import os
+import tempfile
+import threading
+import time
+import warnings
+
+
+class ResultCache(object):
+    """
+    LRU cache of parsed search responses.
+
+    Entries are keyed on the canonical parameters of a search and expire
+    after ``ttl`` seconds. The cache is bounded by the number of entries and
+    optionally by the summed size of the response bodies; the least recently
+    used entries are evicted first. Cached responses are shared between
+    callers and must not be modified.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=None, ttl=60):
+        """
+        :param max_entries: optional -- maximal number of cached responses
+        :type max_entries: int
+        :param max_bytes: optional -- maximal summed size of the cached
+                          response bodies
+        :type max_bytes: int
+        :param ttl: optional -- seconds a response is served from the cache
+        :type ttl: float
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # incremented by clear(), responses requested before are not stored
+        self.generation = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        :returns: the cached response or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, size, expires = entry
+                if expires > time.time():
+                    # move to the most recently used end
+                    del self._entries[key]
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def set(self, key, value, size=0, ttl=None, generation=None):
+        """
+        :param key: canonical parameters of the search
+        :type key: tuple
+        :param value: parsed response
+        :type value: SolrResponse
+        :param size: optional -- size of the response body in bytes
+        :type size: int
+        :param ttl: optional -- overrides the ``ttl`` of the cache
+        :type ttl: float
+        :param generation: optional -- :attr:`generation` when the search
+                           was sent, the response is dropped if the cache
+                           was cleared since
+        :type generation: int
+        """
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0 or (self.max_bytes is not None and size > self.max_bytes):
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.time() + ttl)
+            self.size += size
+            while (len(self._entries) > self.max_entries or
+                   (self.max_bytes is not None and
+                    self.size > self.max_bytes)):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        value, size, expires = self._entries.pop(key)
+        self.size -= size
+
+    def clear(self):
+        """
+        Drop all entries, e.g. after the index changed.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.generation += 1
+
+    def stats(self):
+        """
+        :returns: dict -- hits, misses, evictions, entries and bytes
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self.size}
+
+    def __repr__(self):
+        return "ResultCache(entries=%s, hits=%s, misses=%s, evictions=%s)" % (
+            len(self._entries), self.hits, self.misses, self.evictions)
+
+
+class ValidatorCache(ResultCache):
+    """
+    LRU store of the ``ETag`` and ``Last-Modified`` validators of search
+    urls together with the responses they validate.
+
+    Entries never expire: every search is sent to solr, but with
+    ``If-None-Match`` and ``If-Modified-Since`` headers. Solr answers
+    ``304 Not Modified`` without a body as long as the index did not change
+    and the remembered response is returned. Solr has to have http caching
+    enabled (``<httpCaching never304="false">`` in solrconfig.xml).
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=None):
+        """
+        :param max_entries: optional -- maximal number of remembered urls
+        :type max_entries: int
+        :param max_bytes: optional -- maximal summed size of the remembered
+                          response bodies
+        :type max_bytes: int
+        """
+        super(ValidatorCache, self).__init__(
+            max_entries=max_entries, max_bytes=max_bytes, ttl=float('inf'))
+        self.not_modified = 0
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self):
+        """
+        :returns: dict -- hits (requests sent with validators), misses,
+                  not_modified, evictions, entries and bytes
+        """
+        ret = super(ValidatorCache, self).stats()
+        ret['not_modified'] = self.not_modified
+        return ret
+
+    def __repr__(self):
+        return ("ValidatorCache(entries=%s, hits=%s, not_modified=%s, "
+                "evictions=%s)" % (len(self._entries), self.hits,
+                                   self.not_modified, self.evictions))
+
+
+class SchemaCache(object):
+    """
+    Schemas persisted in a local json file, keyed by the schema url.
+
+    Processes sharing the file use a cached schema without asking solr
+    while it is younger than ``max_age``. Older entries are revalidated with
+    a conditional request (``If-None-Match`` and ``If-Modified-Since``) and
+    serve as fallback while solr is unavailable.
+    """
+
+    def __init__(self, path, max_age=None):
+        """
+        :param path: json file the schemas are stored in, created if missing
+        :type path: str
+        :param max_age: optional -- seconds a stored schema is used without
+                        revalidating it, ``None`` always revalidates
+        :type max_age: float
+        """
+        self.path = path
+        self.max_age = max_age
+
+    def _read(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def get(self, url):
+        """
+        :param url: url the schema was fetched from
+        :type url: str
+        :returns: dict -- ``schema``, ``etag``, ``last_modified`` and
+                  ``fetched`` of the stored entry or None
+        """
+        entry = self._read().get(url)
+        if not isinstance(entry, dict) or 'schema' not in entry:
+            return None
+        return entry
+
+    def set(self, url, schema, etag=None, last_modified=None):
+        """
+        :param url: url the schema was fetched from
+        :type url: str
+        :param schema: the schema
+        :type schema: dict
+        :param etag: optional -- ``ETag`` header of the schema response
+        :type etag: str
+        :param last_modified: optional -- ``Last-Modified`` header of the
+                              schema response
+        :type last_modified: str
+
+        The file is replaced atomically, readers never see a partial file.
+        A file which can't be written only causes a warning.
+        """
+        data = self._read()
+        data[url] = {'schema': schema, 'etag': etag,
+                     'last_modified': last_modified, 'fetched': time.time()}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(json.dumps(data).encode('utf-8'))
+                getattr(os, 'replace', os.rename)(tmp, self.path)
+            except Exception:
+                os.unlink(tmp)
+                raise
+        except (IOError, OSError) as e:
+            warnings.warn("Couldn't write schema cache %s: %s" % (
+                self.path, e))
+
+    def fresh(self, entry):
+        """
+        :returns: bool -- whether ``entry`` is used without revalidating it
+        """
+        return (self.max_age is not None and
+                time.time() - entry.get('fetched', 0) < self.max_age)
+
+    def validators(self, entry):
+        """
+        :returns: dict -- conditional request headers for ``entry``
+        """
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
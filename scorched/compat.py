@@ -8,12 +8,14 @@ is_py3 = (_ver[0] == 3)
 if is_py2:  # pragma: no cover
     from urllib import (quote, unquote, quote_plus, unquote_plus, urlencode,
                         getproxies, proxy_bypass)
-    from urlparse import urlparse, urlunparse, urljoin, urlsplit, urldefrag
+    from urlparse import (urlparse, urlunparse, urljoin, urlsplit, urldefrag,
+                          parse_qsl)
     from urllib2 import parse_http_list
     import cookielib
     from Cookie import Morsel
     from StringIO import StringIO
     from httplib import IncompleteRead
+    import Queue as queue
 
     builtin_str = str
     bytes = str
@@ -25,12 +27,13 @@ if is_py2:  # pragma: no cover
 elif is_py3:  # pragma: no cover
     from urllib.parse import (urlparse, urlunparse, urljoin, urlsplit,
                               urlencode, quote, unquote, quote_plus,
-                              unquote_plus, urldefrag)
+                              unquote_plus, urldefrag, parse_qsl)
     from urllib.request import parse_http_list, getproxies, proxy_bypass
     from http import cookiejar as cookielib
     from http.cookies import Morsel
     from io import StringIO
     from http.client import IncompleteRead
+    import queue
 
     builtin_str = str
     str = str
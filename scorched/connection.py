@@ -1,14 +1,20 @@
 from __future__ import unicode_literals
 import itertools
-import json
 import requests
-import scorched.dates
+import scorched.fields
+import scorched.indexing
+import scorched.jsoncodec
+import scorched.replicas
+import scorched.retry
 import scorched.response
 import scorched.search
+import scorched.singleflight
 import scorched.exc
 import scorched.compat
+import threading
 import time
 import warnings
+import zlib
 
 from scorched.compat import str
 
@@ -16,58 +22,491 @@ MAX_LENGTH_GET_URL = 2048
 # Jetty default is 4096; Tomcat default is 8192; picking 2048 to be
 # conservative.
 
+# keyword arguments of update_fields
+ATOMIC_OPERATIONS = ('set', 'inc', 'add', 'add_distinct', 'remove',
+                     'removeregex')
+
 
 def is_iter(val):
     return isinstance(val, (tuple, list))
 
 
+def search_key(params):
+    """
+    :returns: tuple -- ``params`` without ``timeAllowed``, which follows
+              from the time left until the deadline and is different for
+              nearly every search asking for the same results
+    """
+    return tuple((name, value) for name, value in params
+                 if name != 'timeAllowed')
+
+
+def concurrently(func, items, max_concurrency, name="scorched-worker"):
+    """
+    :returns: list -- ``func`` applied to each of ``items`` by up to
+              ``max_concurrency`` threads, in the order of ``items``, with
+              the exception in place of the result of failed calls
+    """
+    items = list(items)
+    results = [None] * len(items)
+    pending = iter(range(len(items)))
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            with lock:
+                index = next(pending, None)
+            if index is None:
+                return
+            try:
+                results[index] = func(items[index])
+            except Exception as e:
+                results[index] = e
+
+    workers = [threading.Thread(target=work, name=name)
+               for _ in range(min(max_concurrency, len(items)))]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def create_session(pool_connections=10, pool_maxsize=10, pool_block=False,
+                   keep_alive=True):
+    """
+    :param pool_connections: optional -- number of host pools to cache
+    :type pool_connections: int
+    :param pool_maxsize: optional -- maximum number of connections kept per
+                         host pool
+    :type pool_maxsize: int
+    :param pool_block: optional -- block when the pool is exhausted instead
+                       of opening (and afterwards discarding) extra
+                       connections
+    :type pool_block: bool
+    :param keep_alive: optional -- reuse connections between requests
+    :type keep_alive: bool
+    :returns: requests.Session
+
+    Create a session with a sized connection pool. A single session can be
+    shared by several ``SolrInterface`` instances, e.g. one per core.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+        pool_block=pool_block)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def compress(body, encoding):
+    """
+    :param body: request body
+    :type body: bytes
+    :param encoding: ``gzip`` or ``deflate``
+    :type encoding: str
+    :returns: bytes -- the compressed body
+    """
+    if encoding == 'gzip':
+        wbits = 16 + zlib.MAX_WBITS
+    elif encoding == 'deflate':
+        wbits = zlib.MAX_WBITS
+    else:
+        raise ValueError("Unsupported content encoding %s" % encoding)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, wbits)
+    return compressor.compress(body) + compressor.flush()
+
+
+def compress_stream(chunks, encoding):
+    """
+    :param chunks: request body in pieces
+    :type chunks: iterable of bytes
+    :param encoding: ``gzip`` or ``deflate``
+    :type encoding: str
+    :returns: iterator over the compressed body
+    """
+    if encoding not in ('gzip', 'deflate'):
+        raise ValueError("Unsupported content encoding %s" % encoding)
+    wbits = zlib.MAX_WBITS + (16 if encoding == 'gzip' else 0)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, wbits)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class TransferStats(object):
+    """
+    Bytes on the wire versus bytes before compression, in both directions.
+
+    Requests are recorded from many threads (e.g. ``search_many`` or
+    concurrent adds), the counters are only changed under a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.bytes_sent = 0
+        self.bytes_sent_uncompressed = 0
+        self.bytes_received = 0
+        self.bytes_received_uncompressed = 0
+
+    def record_sent(self, wire, uncompressed):
+        with self._lock:
+            self.bytes_sent += wire
+            self.bytes_sent_uncompressed += uncompressed
+
+    def record_received(self, response):
+        content = getattr(response, 'content', None)
+        if not isinstance(content, bytes):
+            return
+        self.record_streamed(response, len(content))
+
+    def record_streamed(self, response, size):
+        """
+        :param response: response whose body was read
+        :type response: requests.Response
+        :param size: length of the decoded body
+        :type size: int
+        """
+        wire = None
+        if response.headers.get('Content-Encoding'):
+            # bytes read from the socket before decoding
+            tell = getattr(getattr(response, 'raw', None), 'tell', None)
+            if tell is not None:
+                wire = tell()
+            elif response.headers.get('Content-Length'):
+                wire = int(response.headers['Content-Length'])
+        if wire is None:
+            wire = size
+        with self._lock:
+            self.bytes_received += wire
+            self.bytes_received_uncompressed += size
+
+    def saved(self):
+        """
+        :returns: int -- bytes compression kept off the wire
+        """
+        with self._lock:
+            return (self.bytes_sent_uncompressed - self.bytes_sent +
+                    self.bytes_received_uncompressed - self.bytes_received)
+
+    def __repr__(self):
+        return ("TransferStats(sent=%s/%s, received=%s/%s)" % (
+            self.bytes_sent, self.bytes_sent_uncompressed,
+            self.bytes_received, self.bytes_received_uncompressed))
+
+
 class SolrConnection(object):
     readable = True
     writeable = True
+    single_flight_class = scorched.singleflight.SingleFlight
 
     def __init__(self, url, http_connection, mode, retry_timeout,
-                 max_length_get_url):
+                 max_length_get_url, pool_connections=10, pool_maxsize=10,
+                 pool_block=False, keep_alive=True, writer_url=None,
+                 health_check_interval=10, retry_policy=None,
+                 circuit_breaker=None, timeout=None, compress_updates=None,
+                 compression_threshold=1024, accept_encoding=None,
+                 validator_cache=None, coalesce=False):
         """
-        :param url: url to solr
-        :type url: str
-        :param http_connection: already existing connection TODO
-        :type http_connection: requests connection
+        :param url: url to solr or a list of urls of replicas serving the
+                    same index
+        :type url: str or list
+        :param http_connection: already existing connection, if ``None`` a
+                                new session is created with the pool
+                                settings below
+        :type http_connection: requests.Session
         :param mode: mode (readable, writable) solr
         :type mode: str
         :param retry_timeout: timeout until retry
         :type retry_timeout: int
         :param max_length_get_url: max length until switch to post
         :type max_length_get_url: int
+        :param pool_connections: optional -- see :func:`create_session`
+        :type pool_connections: int
+        :param pool_maxsize: optional -- see :func:`create_session`
+        :type pool_maxsize: int
+        :param pool_block: optional -- see :func:`create_session`
+        :type pool_block: bool
+        :param keep_alive: optional -- see :func:`create_session`
+        :type keep_alive: bool
+        :param writer_url: optional -- url receiving the update requests if
+                           ``url`` is a list of replicas, defaults to the
+                           first replica
+        :type writer_url: str
+        :param health_check_interval: optional -- seconds between probes of
+                                      ejected replicas
+        :type health_check_interval: float
+        :param retry_policy: optional -- policy for retrying failed requests,
+                             replaces ``retry_timeout``
+        :type retry_policy: scorched.retry.RetryPolicy
+        :param circuit_breaker: optional -- template of the per node circuit
+                                breaker
+        :type circuit_breaker: scorched.retry.CircuitBreaker
+        :param timeout: optional -- socket timeout in seconds of every
+                        request, either one number or a (connect, read)
+                        tuple
+        :type timeout: float or tuple
+        :param compress_updates: optional -- ``gzip`` or ``deflate`` to
+                                 compress update bodies, solr has to accept
+                                 compressed requests (e.g. jetty's
+                                 GzipHandler with inflation enabled)
+        :type compress_updates: str
+        :param compression_threshold: optional -- update bodies smaller than
+                                      this many bytes are sent uncompressed
+        :type compression_threshold: int
+        :param accept_encoding: optional -- ``Accept-Encoding`` sent with
+                                searches, e.g. ``gzip``
+        :type accept_encoding: str
+        :param validator_cache: optional -- remembers ``ETag`` and
+                                ``Last-Modified`` of searches to send them
+                                as conditional requests
+        :type validator_cache: scorched.cache.ValidatorCache
+        :param coalesce: optional -- let identical searches running at the
+                         same time share one request, see
+                         :class:`scorched.singleflight.SingleFlight`
+        :type coalesce: bool
         """
-        self.http_connection = requests.Session()
+        if http_connection is None:
+            http_connection = create_session(
+                pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                pool_block=pool_block, keep_alive=keep_alive)
+        self.http_connection = http_connection
         if mode == 'r':
             self.writeable = False
         elif mode == 'w':
             self.readable = False
+        if is_iter(url):
+            self.replicas = scorched.replicas.ReplicaSet(
+                url, check_interval=health_check_interval, probe=self.ping)
+            url = writer_url or url[0]
+        else:
+            self.replicas = None
         self.url = url.rstrip("/") + "/"
         self.update_url = self.url + "update/json"
         self.select_url = self.url + "select/"
         self.mlt_url = self.url + "mlt/"
+        self.export_url = self.url + "export"
+        self.ping_path = "admin/ping?wt=json"
+        self.stream_chunk_size = 64 * 1024
         self.retry_timeout = retry_timeout
+        if retry_policy is None:
+            retry_policy = scorched.retry.RetryPolicy.from_retry_timeout(
+                retry_timeout)
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.circuit_breakers = {}
+        self.timeout = timeout
+        self.compress_updates = compress_updates
+        self.compression_threshold = compression_threshold
+        self.accept_encoding = accept_encoding
+        self.validator_cache = validator_cache
+        self.single_flight = None
+        if coalesce:
+            self.single_flight = self.single_flight_class()
+        self.transfer_stats = TransferStats()
         self.max_length_get_url = max_length_get_url
 
-    def request(self, *args, **kwargs):
+    def request(self, method, url, idempotent=None, deadline=None,
+                retry=True, **kwargs):
         """
-        :param args: arguments
-        :type args: tuple
-        :param kwargs: key word arguments
+        :param method: http method
+        :type method: str
+        :param url: url
+        :type url: str
+        :param idempotent: optional -- whether the request can be repeated
+                           safely, defaults to ``True`` for GET and HEAD
+        :type idempotent: bool
+        :param deadline: optional -- point in time (``time.time()``) after
+                         which the request is given up
+        :type deadline: float
+        :param retry: optional -- ``False`` sends the request once, e.g.
+                      for a body which can't be read twice
+        :type retry: bool
+        :param kwargs: key word arguments passed to the http connection
         :type kwargs: dict
+        :returns: requests.Response
 
-        .. todo::
-            Make this api more explicit!
+        Every request to solr passes here. Failed requests are repeated
+        according to the :class:`scorched.retry.RetryPolicy`, requests to a
+        node with an open circuit breaker fail immediately. No attempt and
+        no backoff reaches past the ``deadline``.
         """
+        if idempotent is None:
+            idempotent = method in ('GET', 'HEAD')
+        breaker = self.circuit_breaker_for(url)
+        attempt = 0
+        while True:
+            attempt += 1
+            kwargs['timeout'] = self.timeout_for(deadline)
+            trial = None
+            if breaker is not None:
+                trial = breaker.before_request()
+            try:
+                response = self.http_connection.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self._record_attempt(breaker)
+                if not retry:
+                    raise
+                delay = self._retry_delay(attempt, idempotent, deadline,
+                                          exception=e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            else:
+                self._record_attempt(breaker, response)
+            finally:
+                # any other exception must not block the half open circuit
+                if trial is not None:
+                    breaker.release_trial(trial)
+            if not kwargs.get('stream'):
+                # reading the content of a streamed response would load it
+                self.transfer_stats.record_received(response)
+            if not retry:
+                return response
+            delay = self._retry_delay(attempt, idempotent, deadline,
+                                      response=response)
+            if delay is None:
+                return response
+            # a streamed response holds its pooled connection until closed
+            response.close()
+            time.sleep(delay)
+
+    def _record_attempt(self, breaker, response=None):
+        # an attempt without a response raised a request exception
+        if breaker is None:
+            return
+        if response is None or response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    def _retry_delay(self, attempt, idempotent, deadline, exception=None,
+                     response=None):
+        """
+        :returns: float -- seconds to wait before repeating the failed
+                  attempt, None if it is not repeated
+        """
+        delay = self.retry_policy.backoff_for(
+            attempt, idempotent, exception=exception, response=response)
+        if delay is None or not self.in_time(deadline, delay):
+            return None
+        return delay
+
+    def timeout_for(self, deadline):
+        """
+        :param deadline: point in time (``time.time()``) or None
+        :type deadline: float
+        :returns: the socket timeout of the next attempt
+
+        The configured timeout shortened to what is left until ``deadline``.
+        """
+        if deadline is None:
+            return self.timeout
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise scorched.exc.DeadlineExceeded("Deadline exceeded")
+        if self.timeout is None:
+            return remaining
+        if is_iter(self.timeout):
+            return tuple(min(t, remaining) for t in self.timeout)
+        return min(self.timeout, remaining)
+
+    def in_time(self, deadline, delay):
+        return deadline is None or time.time() + delay < deadline
+
+    def circuit_breaker_for(self, url):
+        """
+        :returns: scorched.retry.CircuitBreaker -- the breaker of the node
+                  serving ``url`` or None if circuit breaking is disabled
+        """
+        if self.circuit_breaker is None:
+            return None
+        node = scorched.compat.urlsplit(url).netloc
         try:
-            return self.http_connection.request(*args, **kwargs)
-        except requests.exceptions.ConnectionError:
-            if self.retry_timeout < 0:
-                raise
-            time.sleep(self.retry_timeout)
-            return self.http_connection.request(*args, **kwargs)
+            return self.circuit_breakers[node]
+        except KeyError:
+            return self.circuit_breakers.setdefault(
+                node, self.circuit_breaker.clone())
+
+    def ping(self, node):
+        """
+        :param node: replica to probe
+        :type node: scorched.replicas.Node
+        :returns: bool -- whether the replica answers its ping handler
+
+        Health probe used to re-admit ejected replicas.
+        """
+        response = self.http_connection.request(
+            'GET', node.url + self.ping_path, timeout=5)
+        return response.status_code == 200
+
+    def _read_request(self, build, deadline=None):
+        """
+        :param build: callable taking a base url and returning method, url
+                      and request arguments
+        :type build: callable
+        :param deadline: optional -- point in time of the deadline
+        :type deadline: float
+        :returns: requests.Response
+
+        Send a read request. With replicas the request goes to the replica
+        chosen by the :class:`scorched.replicas.ReplicaSet` and fails over
+        to the next one on connection errors, timeouts and server errors
+        (5xx). The server error of the last replica tried is returned.
+        """
+        if self.replicas is None:
+            method, url, kwargs = build(self.url)
+            return self.request(method, url, idempotent=True,
+                                deadline=deadline, **kwargs)
+        tried = []
+        while True:
+            node = self.replicas.select(exclude=tried)
+            method, url, kwargs = build(node.url)
+            start = time.time()
+            try:
+                response = self.request(method, url, idempotent=True,
+                                        deadline=deadline, **kwargs)
+            except Exception as e:
+                if not self._fail_over(node, tried, start, deadline, error=e):
+                    raise
+                continue
+            if not self._fail_over(node, tried, start, deadline,
+                                   response=response):
+                return response
+            # a streamed response holds its pooled connection until closed
+            response.close()
+
+    def _fail_over(self, node, tried, start, deadline, error=None,
+                   response=None):
+        """
+        Report the outcome of a read sent to the replica ``node`` at
+        ``start``, either the exception ``error`` or ``response``.
+
+        :returns: bool -- whether the read is sent to another replica
+        """
+        if isinstance(error, requests.exceptions.ConnectionError):
+            self.replicas.release(node, failed=True)
+        elif isinstance(error, requests.exceptions.Timeout):
+            # a hanging replica is ejected like an unreachable one
+            self.replicas.release(node, time.time() - start, failed=True)
+        elif error is not None:
+            self.replicas.release(node)
+            return False
+        else:
+            # the retry policy has already repeated the read on this node
+            failed = response.status_code >= 500
+            self.replicas.release(node, time.time() - start, failed=failed)
+            if not failed:
+                return False
+        tried.append(node)
+        return len(tried) < len(self.replicas) and self.in_time(deadline, 0)
 
     def update(self, update_doc, **kwargs):
         """
@@ -76,17 +515,77 @@ class SolrConnection(object):
 
         Send json to solr
         """
+        method, url, kwargs = self._update_request(update_doc, **kwargs)
+        response = self.request(method, url, **kwargs)
+        if response.status_code != 200:
+            raise self.update_error(response)
+        self._record_update(update_doc, kwargs['data'])
+
+    def update_stream(self, chunks, **kwargs):
+        """
+        :param chunks: the json update message in pieces
+        :type chunks: iterable of bytes
+        :param kwargs: optional -- see :meth:`url_for_update`
+        :type kwargs: dict
+
+        Send an update message while it is produced, with chunked transfer
+        encoding. As the body can't be produced twice the request is never
+        retried.
+        """
+        if not self.writeable:
+            raise TypeError("This Solr instance is only for reading")
+        sizes = {'wire': 0, 'uncompressed': 0}
+
+        def count(chunks, key):
+            for chunk in chunks:
+                sizes[key] += len(chunk)
+                yield chunk
+        body = count(chunks, 'uncompressed')
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+        if self.compress_updates:
+            body = compress_stream(body, self.compress_updates)
+            headers['Content-Encoding'] = self.compress_updates
+        response = self.request('POST', self.url_for_update(**kwargs),
+                                retry=False, data=count(body, 'wire'),
+                                headers=headers)
+        if response.status_code != 200:
+            raise self.update_error(response)
+        self.transfer_stats.record_sent(sizes['wire'], sizes['uncompressed'])
+
+    def update_error(self, response):
+        """
+        :returns: SolrError -- the exception for a failed update response
+        """
+        if response.status_code == 409:
+            return scorched.exc.VersionConflict(response)
+        return scorched.exc.SolrError(response)
+
+    def _record_update(self, update_doc, body):
+        if not body:
+            return
+        if not isinstance(update_doc, bytes):
+            update_doc = update_doc.encode('utf-8')
+        self.transfer_stats.record_sent(len(body), len(update_doc))
+
+    def _update_request(self, update_doc, **kwargs):
+        """
+        Build method, url and request arguments of an update request.
+        """
         if not self.writeable:
             raise TypeError("This Solr instance is only for reading")
         body = update_doc
         if body:
             headers = {"Content-Type": "application/json; charset=utf-8"}
+            if self.compress_updates:
+                if not isinstance(body, bytes):
+                    body = body.encode('utf-8')
+                if len(body) >= self.compression_threshold:
+                    body = compress(body, self.compress_updates)
+                    headers['Content-Encoding'] = self.compress_updates
         else:
             headers = {}
         url = self.url_for_update(**kwargs)
-        response = self.request('POST', url, data=body, headers=headers)
-        if response.status_code != 200:
-            raise scorched.exc.SolrError(response)
+        return 'POST', url, {'data': body, 'headers': headers}
 
     def url_for_update(self, commit=None, commitWithin=None, softCommit=None,
                        optimize=None, waitSearcher=None, expungeDeletes=None,
@@ -156,25 +655,203 @@ class SolrConnection(object):
         else:
             return self.update_url
 
-    def select(self, params):
+    def select(self, params, deadline=None, stream=False, parse=None):
         """
         :param params: LuceneQuery converted to a dictionary with search
                        queries
         :type params: dict
-        :returns: json -- json string
+        :param deadline: optional -- point in time (``time.time()``) after
+                         which the search is given up
+        :type deadline: float
+        :param stream: optional -- return the body in chunks as it arrives
+        :type stream: bool
+        :param parse: optional -- callable turning the body into the
+                      returned response
+        :type parse: callable
+        :returns: json -- json string, javabin bytes if ``wt`` is
+                  ``javabin``, an iterator over byte chunks or what
+                  ``parse`` returns
 
         We perform here a search on the `select` handler of solr.
+
+        With a ``validator_cache`` GET requests carry the validators of the
+        last response for the same url and a ``304 Not Modified`` returns
+        that response again without parsing it. With ``coalesce`` identical
+        searches in flight wait for the first one and share its result,
+        searches differing only in ``timeAllowed`` count as identical.
+        """
+        if stream or self.single_flight is None:
+            return self._select(params, deadline, stream, parse)
+        return self.single_flight.do(
+            (search_key(params), parse is None),
+            lambda: self._select(params, deadline, stream, parse),
+            deadline=deadline)
+
+    def _select(self, params, deadline, stream, parse):
+        validated = []
+
+        def build(base_url):
+            method, url, kwargs = self._select_request(list(params), base_url)
+            if stream:
+                kwargs['stream'] = True
+            else:
+                kwargs = self._conditional(method, url, kwargs, validated)
+            return method, url, kwargs
+        response = self._read_request(build, deadline=deadline)
+        if stream:
+            if response.status_code != 200:
+                raise scorched.exc.SolrError(response)
+            return self.iter_chunks(response)
+        return self._validated_response(response, params, parse, validated)
+
+    def _conditional(self, method, url, kwargs, validated):
+        """
+        Add the validators remembered for ``url`` to the request arguments.
+        ``validated`` receives the url and the remembered entry.
+        """
+        if method != 'GET' or self.validator_cache is None:
+            del validated[:]
+            return kwargs
+        entry = self.validator_cache.get(url)
+        validated[:] = [url, entry]
+        if entry is not None:
+            etag, last_modified, value = entry
+            headers = dict(kwargs.get('headers', {}))
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+            kwargs['headers'] = headers
+        return kwargs
+
+    def _validated_response(self, response, params, parse, validated):
+        """
+        :returns: the parsed body of ``response`` or the remembered response
+                  if solr answered ``304 Not Modified``
+        """
+        if (response.status_code == 304 and validated and
+                validated[1] is not None):
+            self.validator_cache.record_not_modified()
+            return validated[1][2]
+        if response.status_code != 200:
+            raise scorched.exc.SolrError(response)
+        # parsers read the bytes, without decoding them to text first
+        body = self.response_body(response, params, raw=parse is not None)
+        ret = body if parse is None else parse(body)
+        if validated:
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if etag or last_modified:
+                self.validator_cache.set(
+                    validated[0], (etag, last_modified, ret), len(body))
+        return ret
+
+    def response_body(self, response, params, raw=False):
+        """
+        :returns: the body as bytes for ``wt=javabin`` or if ``raw`` is
+                  set, as text otherwise
+        """
+        if raw or ('wt', b'javabin') in params:
+            return response.content
+        return response.text
+
+    def iter_chunks(self, response):
+        """
+        :param response: response requested with ``stream=True``
+        :type response: requests.Response
+
+        Yield the body of ``response`` in chunks of ``stream_chunk_size``
+        bytes and release the connection afterwards.
+        """
+        size = 0
+        try:
+            for chunk in response.iter_content(self.stream_chunk_size):
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.transfer_stats.record_streamed(response, size)
+            response.close()
+
+    def export(self, params, deadline=None, base_url=None):
+        """
+        :param params: LuceneQuery converted to a dictionary with search
+                       queries, ``fl`` and ``sort`` are required
+        :type params: dict
+        :param deadline: optional -- point in time (``time.time()``) after
+                         which the export is given up
+        :type deadline: float
+        :param base_url: optional -- url of the core to export from, e.g. a
+                         single shard, instead of the configured ones
+        :type base_url: str
+        :returns: iterator over the byte chunks of the json body
+
+        Stream the complete sorted result set from the `export` handler.
+        """
+        def build(base_url):
+            method, url, kwargs = self._select_request(
+                list(params), base_url, handler="export")
+            kwargs['stream'] = True
+            return method, url, kwargs
+        if base_url is None:
+            response = self._read_request(build, deadline=deadline)
+        else:
+            method, url, kwargs = build(base_url.rstrip("/") + "/")
+            response = self.request(method, url, idempotent=True,
+                                    deadline=deadline, **kwargs)
+        if response.status_code != 200:
+            raise scorched.exc.SolrError(response)
+        return self.iter_chunks(response)
+
+    def get(self, params, deadline=None):
+        """
+        :param params: parameters of the real-time get handler, e.g.
+                       ``ids`` and ``fl``
+        :type params: list
+        :param deadline: optional -- point in time (``time.time()``) after
+                         which the request is given up
+        :type deadline: float
+        :returns: bytes -- the json body
+
+        Fetch documents by id from the `get` handler. It is asked on the
+        core receiving the updates, so documents not committed yet are
+        returned as well.
+        """
+        method, url, kwargs = self._get_request(list(params))
+        response = self.request(method, url, idempotent=True,
+                                deadline=deadline, **kwargs)
+        if response.status_code != 200:
+            raise scorched.exc.SolrError(response)
+        return response.content
+
+    def _get_request(self, params):
+        """
+        Build method, url and request arguments of a real-time get request.
+        The `get` handler of the writer is used by connections in write mode
+        as well.
+        """
+        return self._query_request(params, self.url + "get")
+
+    def _select_request(self, params, base_url=None, handler="select/"):
+        """
+        Build method, url and request arguments of a select request.
         """
         if not self.readable:
             raise TypeError("This Solr instance is only for writing")
-        params.append(('wt', 'json'))
+        select_url = self.url + handler
+        if base_url is not None:
+            select_url = base_url + handler
+        return self._query_request(params, select_url)
+
+    def _query_request(self, params, select_url):
+        if 'wt' not in dict(params):
+            params.append(('wt', 'json'))
         qs = scorched.compat.urlencode(params)
-        url = "%s?%s" % (self.select_url, qs)
+        url = "%s?%s" % (select_url, qs)
         if len(url) > self.max_length_get_url:
             warnings.warn(
                 "Long query URL encountered - POSTing instead of "
                 "GETting. This query will not be cached at the HTTP layer")
-            url = self.select_url
+            url = select_url
             method = 'POST'
             kwargs = {
                 'data': qs,
@@ -183,120 +860,508 @@ class SolrConnection(object):
         else:
             method = 'GET'
             kwargs = {}
-        response = self.request(method, url, **kwargs)
-        if response.status_code != 200:
-            raise scorched.exc.SolrError(response)
-        return response.text
+        return method, url, self._accept_encoding(kwargs)
 
-    def mlt(self, params, content=None):
+    def _accept_encoding(self, kwargs):
+        if self.accept_encoding is not None:
+            headers = dict(kwargs.get('headers', {}))
+            headers['Accept-Encoding'] = self.accept_encoding
+            kwargs['headers'] = headers
+        return kwargs
+
+    def mlt(self, params, content=None, deadline=None, raw=False):
         """
         Perform a MoreLikeThis query using the content specified
         There may be no content if stream.url is specified in the params.
+        With ``raw`` the body is returned as bytes.
+        """
+        response = self._read_request(
+            lambda base_url: self._mlt_request(
+                list(params), content=content, base_url=base_url),
+            deadline=deadline)
+        if response.status_code != 200:
+            raise scorched.exc.SolrError(response.content)
+        return self.response_body(response, params, raw=raw)
+
+    def _mlt_request(self, params, content=None, base_url=None):
+        """
+        Build method, url and request arguments of a MoreLikeThis request.
         """
         if not self.readable:
             raise TypeError("This Solr instance is only for writing")
-        params.append(('wt', 'json'))
+        mlt_url = self.mlt_url
+        if base_url is not None:
+            mlt_url = base_url + "mlt/"
+        if 'wt' not in dict(params):
+            params.append(('wt', 'json'))
         qs = scorched.compat.urlencode(params)
-        base_url = "%s?%s" % (self.mlt_url, qs)
+        query_url = "%s?%s" % (mlt_url, qs)
         method = 'GET'
         kwargs = {}
         if content is None:
-            url = base_url
+            url = query_url
         else:
             get_url = "%s&stream.body=%s" % (
-                base_url, scorched.compat.quote_plus(content))
+                query_url, scorched.compat.quote_plus(content))
             if len(get_url) <= self.max_length_get_url:
                 url = get_url
             else:
-                url = base_url
+                url = query_url
                 method = 'POST'
                 kwargs = {
                     'data': content,
                     'headers': {"Content-Type": "text/plain; charset=utf-8"}}
-        response = self.request(method, url, **kwargs)
-        if response.status_code != 200:
-            raise scorched.exc.SolrError(response.content)
-        return response.text
+        return method, url, self._accept_encoding(kwargs)
 
 
 class SolrInterface(object):
     remote_schema_file = "schema?wt=json"
 
     def __init__(self, url, http_connection=None, mode='',
-                 retry_timeout=-1, max_length_get_url=MAX_LENGTH_GET_URL):
+                 retry_timeout=-1, max_length_get_url=MAX_LENGTH_GET_URL,
+                 pool_connections=10, pool_maxsize=10, pool_block=False,
+                 keep_alive=True, writer_url=None, health_check_interval=10,
+                 retry_policy=None, circuit_breaker=None, timeout=None,
+                 deadline=None, compress_updates=None,
+                 compression_threshold=1024, accept_encoding=None,
+                 response_format='json', cache=None, validator_cache=None,
+                 coalesce=False, schema=None, schema_cache=None,
+                 json_codec='json'):
         """
-        :param url: url to solr
-        :type url: str
-        :param http_connection: optional -- already existing connection TODO
-        :type http_connection: requests connection
+        :param url: url to solr or a list of urls of replicas serving the
+                    same index
+        :type url: str or list
+        :param http_connection: optional -- already existing connection, e.g.
+                                a session from :func:`create_session` shared
+                                between interfaces
+        :type http_connection: requests.Session
         :param mode: optional -- mode (readable, writable) solr
         :type mode: str
         :param retry_timeout: optional -- timeout until retry
         :type retry_timeout: int
         :param max_length_get_url: optional -- max length until switch to post
         :type max_length_get_url: int
+        :param pool_connections: optional -- see :func:`create_session`
+        :type pool_connections: int
+        :param pool_maxsize: optional -- see :func:`create_session`
+        :type pool_maxsize: int
+        :param pool_block: optional -- see :func:`create_session`
+        :type pool_block: bool
+        :param keep_alive: optional -- see :func:`create_session`
+        :type keep_alive: bool
+        :param writer_url: optional -- url receiving the update requests if
+                           ``url`` is a list of replicas, defaults to the
+                           first replica
+        :type writer_url: str
+        :param health_check_interval: optional -- seconds between probes of
+                                      ejected replicas
+        :type health_check_interval: float
+        :param retry_policy: optional -- policy for retrying failed requests,
+                             replaces ``retry_timeout``
+        :type retry_policy: scorched.retry.RetryPolicy
+        :param circuit_breaker: optional -- template of the per node circuit
+                                breaker
+        :type circuit_breaker: scorched.retry.CircuitBreaker
+        :param timeout: optional -- socket timeout in seconds of every
+                        request, either one number or a (connect, read)
+                        tuple
+        :type timeout: float or tuple
+        :param deadline: optional -- default deadline of searches in seconds,
+                         see :meth:`scorched.search.SolrSearch.deadline`
+        :type deadline: float
+        :param compress_updates: optional -- ``gzip`` or ``deflate`` to
+                                 compress update bodies
+        :type compress_updates: str
+        :param compression_threshold: optional -- update bodies smaller than
+                                      this many bytes are sent uncompressed
+        :type compression_threshold: int
+        :param accept_encoding: optional -- ``Accept-Encoding`` sent with
+                                searches, e.g. ``gzip``
+        :type accept_encoding: str
+        :param response_format: optional -- ``json`` or ``javabin``, the
+                                format solr answers searches in
+        :type response_format: str
+        :param cache: optional -- cache of search responses, invalidated by
+                      commits, deletes and rollbacks sent through this
+                      interface
+        :type cache: scorched.cache.ResultCache
+        :param validator_cache: optional -- send searches as conditional
+                                requests and reuse the last response on
+                                ``304 Not Modified``
+        :type validator_cache: scorched.cache.ValidatorCache
+        :param coalesce: optional -- identical searches running at the same
+                         time share one request and its parsed response
+        :type coalesce: bool
+        :param schema: optional -- schema dict as returned by the schema
+                       api, fetched from solr on first use otherwise
+        :type schema: dict
+        :param schema_cache: optional -- local file the fetched schema is
+                             persisted in
+        :type schema_cache: scorched.cache.SchemaCache
+        :param json_codec: optional -- ``json``, ``orjson``, ``ujson``,
+                           ``auto`` (the fastest installed) or a codec
+                           writing update messages and parsing json
+                           responses, see :func:`scorched.jsoncodec.get_codec`
+        :type json_codec: str or object
+
+        The pool settings are ignored if ``http_connection`` is given.
+        Searches are balanced over the replicas by latency, see
+        :class:`scorched.replicas.ReplicaSet`.
         """
 
         self.conn = SolrConnection(
-            url, http_connection, mode, retry_timeout, max_length_get_url)
-        self.schema = self.init_schema()
+            url, http_connection, mode, retry_timeout, max_length_get_url,
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+            pool_block=pool_block, keep_alive=keep_alive,
+            writer_url=writer_url,
+            health_check_interval=health_check_interval,
+            retry_policy=retry_policy, circuit_breaker=circuit_breaker,
+            timeout=timeout, compress_updates=compress_updates,
+            compression_threshold=compression_threshold,
+            accept_encoding=accept_encoding, validator_cache=validator_cache,
+            coalesce=coalesce)
+        self.deadline = deadline
+        self.response_format = response_format
+        self.json_codec = scorched.jsoncodec.get_codec(json_codec)
+        self.cache = cache
+        self.schema_cache = schema_cache
+        self._schema = None
+        self._schema_lock = threading.Lock()
+        if schema is not None:
+            self._set_schema(schema)
+
+    @property
+    def schema(self):
+        """
+        The schema of the core, fetched on first use.
+        """
+        self._require_schema()
+        return self._schema
+
+    @schema.setter
+    def schema(self, schema):
+        self._set_schema(schema)
+
+    @property
+    def field_codecs(self):
+        """
+        :class:`scorched.fields.FieldCodecs` compiled from the schema.
+        """
+        self._require_schema()
+        return self._schema_codecs
+
+    @property
+    def _datefields(self):
+        self._require_schema()
+        return self._schema_datefields
+
+    @property
+    def unique_key(self):
+        self._require_schema()
+        return self._schema_unique_key
+
+    def _require_schema(self):
+        if self._schema is None:
+            with self._schema_lock:
+                if self._schema is None:
+                    self._set_schema(self.init_schema())
+
+    def _set_schema(self, schema):
+        self._schema = schema
+        self._schema_codecs = scorched.fields.FieldCodecs(schema)
         # we need tuples for endswith
-        self._datefields = tuple(self._extract_datefields(self.schema))
+        self._schema_datefields = tuple(self._schema_codecs.datefields())
+        self._schema_unique_key = schema.get('uniqueKey', 'id')
 
     def init_schema(self):
-        response = self.conn.request(
-            'GET', scorched.compat.urljoin(self.conn.url,
-                                           self.remote_schema_file))
+        url = scorched.compat.urljoin(self.conn.url, self.remote_schema_file)
+        entry = self._stored_schema(url)
+        if entry is not None and self.schema_cache.fresh(entry):
+            return entry['schema']
+        try:
+            response = self.conn.request(
+                'GET', url, headers=self._schema_validators(entry))
+        except requests.exceptions.RequestException as e:
+            return self._stale_schema(entry, e)
+        return self._schema_from_response(response, url, entry)
+
+    def _stored_schema(self, url):
+        if self.schema_cache is None:
+            return None
+        return self.schema_cache.get(url)
+
+    def _schema_validators(self, entry):
+        if entry is None:
+            return None
+        return self.schema_cache.validators(entry)
+
+    def _stale_schema(self, entry, error):
+        if entry is None:
+            raise error
+        warnings.warn("Using the cached schema, solr is unavailable: %s" % (
+            error,))
+        return entry['schema']
+
+    def _schema_from_response(self, response, url=None, entry=None):
+        if response.status_code == 304 and entry is not None:
+            # unchanged, restart the max_age of the entry
+            self.schema_cache.set(url, entry['schema'], entry.get('etag'),
+                                  entry.get('last_modified'))
+            return entry['schema']
         if response.status_code != 200:
-            raise EnvironmentError(
+            error = EnvironmentError(
                 "Couldn't retrieve schema document - status code %s\n%s" % (
                     response.status_code, response.content)
             )
-        return response.json()['schema']
+            if response.status_code < 500:
+                raise error
+            return self._stale_schema(entry, error)
+        schema = response.json()['schema']
+        if self.schema_cache is not None:
+            self.schema_cache.set(url, schema, response.headers.get('ETag'),
+                                  response.headers.get('Last-Modified'))
+        return schema
 
-    def _extract_datefields(self, schema):
-        ret = [x for x in
-               schema['fields'] if x['type'] == 'date']
-        ret.extend([x for x in schema['dynamicFields']
-                    if x['type'] == 'date'])
-        if ret:
-            ret = [x['name'] for x in ret]
-            ret = [x.replace('*', '') for x in ret]
-        return ret
+    def schema_field(self, name):
+        """
+        :param name: field name
+        :type name: str
+        :returns: dict -- definition of the field or the dynamic field
+                  matching ``name`` in the schema, None if there is none
+        """
+        return self._schema_field(name)
 
-    def _prepare_docs(self, docs):
-        for doc in docs:
-            for name, value in list(doc.items()):
-                # XXX remove all None fields this is needed for adding date
-                # fields
-                if value is None:
-                    doc.pop(name)
-                    continue
-                if name in self._datefields:
-                    doc[name] = str(scorched.dates.solr_date(value))
-                elif name.endswith(self._datefields):
-                    doc[name] = str(scorched.dates.solr_date(value))
-        return docs
+    def _schema_field(self, name):
+        for field in self.schema.get('fields', ()):
+            if field['name'] == name:
+                return field
+        for field in self.schema.get('dynamicFields', ()):
+            pattern = field['name']
+            if pattern.startswith('*') and name.endswith(pattern[1:]):
+                return field
+            if pattern.endswith('*') and name.startswith(pattern[:-1]):
+                return field
+        return None
+
+    def has_docvalues(self, name):
+        """
+        :param name: field name
+        :type name: str
+        :returns: bool -- whether the field is stored in docValues, either
+                  set on the field itself or inherited from its type
+        """
+        field = self._schema_field(name)
+        if field is None:
+            return False
+        if 'docValues' in field:
+            return field['docValues']
+        for field_type in self.schema.get('fieldTypes', ()):
+            if field_type['name'] == field['type']:
+                return field_type.get('docValues', False)
+        return False
+
+    def _extract_datefields(self, schema):
+        return scorched.fields.FieldCodecs(schema).datefields()
 
-    def add(self, docs, chunk=100, **kwargs):
+    def add(self, docs, chunk=100, workers=None, max_in_flight=None,
+            stream=False, batcher=None, **kwargs):
         """
-        :param docs: documents to be added
-        :type docs: dict
+        :param docs: a document or an iterable of documents, e.g. a
+                     generator, to be added
+        :type docs: dict or iterable
         :param chunk: optional -- size of chunks in witch the add command
         schould be splitted
         :type chunk: int
+        :param workers: optional -- threads serializing chunks while others
+                        are sent, see :func:`scorched.indexing.pipeline`
+        :type workers: int
+        :param max_in_flight: optional -- update requests sent at the same
+                              time, defaults to ``workers``
+        :type max_in_flight: int
+        :param stream: optional -- send all documents in one request whose
+                       body is serialized while it is sent, ignores
+                       ``chunk``
+        :type stream: bool
+        :param batcher: optional -- forms the chunks by a byte budget
+                        adapted to the update latency instead of by
+                        ``chunk`` documents
+        :type batcher: scorched.indexing.AdaptiveBatcher
         :param kwargs: optinal -- additional arguments
         :type kwargs: dict
 
         Add a document or a list of document to solr.
+
+        Documents are taken from ``docs`` as they are needed, so a generator
+        is never held in memory completely. With ``stream`` memory use does
+        not depend on a chunk size either; solr indexes the documents as
+        they arrive. If the generator fails the request is aborted, the
+        documents received until then may be indexed already.
+
+        With ``workers`` or ``max_in_flight`` the chunks are serialized and
+        sent concurrently. Failed chunks are reported together by a
+        :class:`scorched.exc.UpdateError` once the chunks in flight are
+        done. Chunks may reach solr in any order, so a document should not
+        be added twice in one call.
+        """
+        if stream:
+            self.conn.update_stream(self._stream_message(docs), **kwargs)
+            self._invalidate_after(kwargs)
+            return
+
+        def send(message):
+            self.conn.update(message, **kwargs)
+        if batcher is None:
+            chunks = self._add_chunks(docs, chunk)
+            serialize = self._add_message
+        else:
+            # the batcher serializes the documents to measure them
+            chunks = batcher.batches(self._iter_docs(docs), self._encode_doc)
+            send = batcher.timed(send)
+
+            def serialize(batch):
+                return batch
+        if workers is None and max_in_flight is None:
+            for doc_chunk in chunks:
+                send(serialize(doc_chunk))
+        else:
+            errors = scorched.indexing.pipeline(
+                chunks, serialize, send,
+                workers=workers or 1,
+                max_in_flight=max_in_flight or workers)
+            if errors:
+                self._invalidate_after(kwargs)
+                raise scorched.exc.UpdateError(errors)
+        self._invalidate_after(kwargs)
+
+    def _invalidate_after(self, kwargs):
+        if kwargs.get('commit') or kwargs.get('softCommit'):
+            self.invalidate_cache()
+
+    def _add_messages(self, docs, chunk):
+        """
+        Yield the json update messages for adding ``docs`` in chunks of
+        ``chunk`` documents.
         """
-        if hasattr(docs, "items") or not is_iter(docs):
-            docs = [docs]
+        for doc_chunk in self._add_chunks(docs, chunk):
+            yield self._add_message(doc_chunk)
+
+    def _add_chunks(self, docs, chunk):
         # to avoid making messages too large, we break the message every
         # chunk docs.
-        for doc_chunk in grouper(docs, chunk):
-            update_message = json.dumps(self._prepare_docs(doc_chunk))
-            self.conn.update(update_message, **kwargs)
+        return grouper(self._iter_docs(docs), chunk)
+
+    def _iter_docs(self, docs):
+        if hasattr(docs, "items") or not hasattr(docs, "__iter__") or \
+                isinstance(docs, (str, bytes)):
+            return [docs]
+        return docs
+
+    def _add_message(self, doc_chunk):
+        prepare = self.field_codecs.prepare_doc
+        return self.json_codec.dumps([prepare(doc) for doc in doc_chunk])
+
+    def _encode_doc(self, doc):
+        return self.json_codec.dumps(self.field_codecs.prepare_doc(doc))
+
+    def _stream_message(self, docs):
+        """
+        Yield the json update message adding ``docs`` in pieces of about
+        ``stream_chunk_size`` bytes.
+        """
+        limit = self.conn.stream_chunk_size
+        pending = [b'[']
+        size = 1
+        separator = b''
+        for doc in self._iter_docs(docs):
+            encoded = self._encode_doc(doc).encode('utf-8')
+            pending.append(separator)
+            pending.append(encoded)
+            separator = b','
+            size += len(encoded) + 1
+            if size >= limit:
+                yield b''.join(pending)
+                pending = []
+                size = 0
+        pending.append(b']')
+        yield b''.join(pending)
+
+    def update_fields(self, id, set=None, inc=None, add=None,
+                      add_distinct=None, remove=None, removeregex=None,
+                      version=None, **kwargs):
+        """
+        :param id: unique key of the document
+        :type id: str
+        :param set: optional -- new values by field name, None removes the
+                    field
+        :type set: dict
+        :param inc: optional -- amounts numeric fields are incremented by
+        :type inc: dict
+        :param add: optional -- values appended to multi valued fields
+        :type add: dict
+        :param add_distinct: optional -- values appended to multi valued
+                             fields if they are not contained yet
+        :type add_distinct: dict
+        :param remove: optional -- values removed from multi valued fields
+        :type remove: dict
+        :param removeregex: optional -- patterns of values removed from
+                            multi valued fields
+        :type removeregex: dict
+        :param version: optional -- ``_version_`` the document must have,
+                        1 if it must exist, a negative number if it must not
+        :type version: int
+        :param kwargs: optional -- see :meth:`add`
+        :type kwargs: dict
+
+        Change single fields of a stored document with an atomic update
+        instead of sending the whole document again. If only ``set`` and
+        ``inc`` are used on fields that are neither indexed nor stored but
+        have docValues, solr updates them in place without reindexing the
+        document. A ``version`` mismatch raises
+        :class:`scorched.exc.VersionConflict`.
+        """
+        return self.add(self._atomic_doc(
+            self.unique_key, id, set=set, inc=inc, add=add,
+            add_distinct=add_distinct, remove=remove,
+            removeregex=removeregex, version=version), **kwargs)
+
+    def update_fields_many(self, updates, **kwargs):
+        """
+        :param updates: dicts with the ``id`` and the further arguments of
+                        :meth:`update_fields`, e.g. a generator
+        :type updates: iterable
+        :param kwargs: optional -- see :meth:`add`, e.g. ``chunk`` or
+                       ``workers``
+        :type kwargs: dict
+
+        Send the atomic updates of many documents in chunks, like
+        :meth:`add` sends documents.
+
+        ::
+
+            >>> si.update_fields_many({"id": id, "inc": {"views": n}}
+            ...                       for id, n in counts.items())
+        """
+        unique_key = self.unique_key
+        return self.add((self._atomic_doc(unique_key, **update)
+                         for update in updates), **kwargs)
+
+    def _atomic_doc(self, unique_key, id, version=None, **operations):
+        doc = {unique_key: id}
+        for operation, fields in operations.items():
+            if operation not in ATOMIC_OPERATIONS:
+                raise ValueError(
+                    "Unsupported atomic update operation %s" % operation)
+            if not fields:
+                continue
+            # solr spells add_distinct with a dash
+            operation = operation.replace('_', '-')
+            for name, value in fields.items():
+                doc.setdefault(name, {})[operation] = value
+        if len(doc) == 1:
+            raise ValueError("No fields to update for %s" % id)
+        if version is not None:
+            doc['_version_'] = version
+        return doc
 
     def delete_by_query(self, query, **kwargs):
         """
@@ -305,8 +1370,10 @@ class SolrInterface(object):
 
         Delete entries by a given query
         """
-        delete_message = json.dumps({"delete": {"query": str(query)}})
+        delete_message = self.json_codec.dumps(
+            {"delete": {"query": str(query)}})
         self.conn.update(delete_message, **kwargs)
+        self.invalidate_cache()
 
     def delete_by_ids(self, ids, **kwargs):
         """
@@ -315,8 +1382,9 @@ class SolrInterface(object):
 
         Delete entries by a given id
         """
-        delete_message = json.dumps({"delete": ids})
+        delete_message = self.json_codec.dumps({"delete": ids})
         self.conn.update(delete_message, **kwargs)
+        self.invalidate_cache()
 
     def commit(self, waitSearcher=None, expungeDeletes=None, softCommit=None):
         """
@@ -337,6 +1405,7 @@ class SolrInterface(object):
                          waitSearcher=waitSearcher,
                          expungeDeletes=expungeDeletes,
                          softCommit=softCommit)
+        self.invalidate_cache()
 
     def optimize(self, waitSearcher=None, maxSegments=None):
         """
@@ -353,6 +1422,7 @@ class SolrInterface(object):
         """
         self.conn.update('{"optimize": {}}', optimize=True,
                          waitSearcher=waitSearcher, maxSegments=maxSegments)
+        self.invalidate_cache()
 
     def rollback(self):
         """
@@ -360,6 +1430,14 @@ class SolrInterface(object):
         the last commit
         """
         self.conn.update('{"rollback": {}}')
+        self.invalidate_cache()
+
+    def invalidate_cache(self):
+        """
+        Drop all cached search responses.
+        """
+        if self.cache is not None:
+            self.cache.clear()
 
     def delete_all(self):
         """
@@ -367,17 +1445,238 @@ class SolrInterface(object):
         """
         self.delete_by_query(self.Q(**{"*": "*"}))
 
-    def search(self, **kwargs):
+    def search(self, deadline=None, stream=False, cache_ttl=None, **kwargs):
         """
+        :param deadline: optional -- seconds until the search is given up,
+                         defaults to the deadline of the interface
+        :type deadline: float
+        :param stream: optional -- parse the documents while they arrive,
+                       see :class:`scorched.response.StreamingSolrResponse`
+        :type stream: bool
+        :param cache_ttl: optional -- seconds the response is cached instead
+                          of the ``ttl`` of the cache, 0 bypasses the cache
+        :type cache_ttl: float
         :returns: SolrResponse  -- A solr response object.
 
         Search solr
         """
+        deadline, kwargs = self._deadline(deadline, kwargs)
+        if stream:
+            # the incremental parser only understands json
+            kwargs['wt'] = 'json'
+            params = scorched.search.params_from_dict(**kwargs)
+            return scorched.response.StreamingSolrResponse(
+                self.conn.select(params, deadline=deadline, stream=True),
+                self.field_codecs)
+        wt, kwargs = self._response_format(kwargs)
         params = scorched.search.params_from_dict(**kwargs)
-        ret = scorched.response.SolrResponse.from_json(
-            self.conn.select(params), self._datefields)
+        key = self._cache_key(cache_ttl, 'select', params)
+        ret, generation = self._cached(key)
+        if ret is None:
+            ret, size = self.conn.select(params, deadline=deadline,
+                                         parse=self._parser(wt))
+            self._store(key, ret, size, cache_ttl, generation)
+        return ret
+
+    def _cache_key(self, cache_ttl, handler, params, content=None):
+        if self.cache is None or cache_ttl == 0:
+            return None
+        # params_from_dict returns the parameters sorted, partial results
+        # of a short timeAllowed are never stored
+        return (handler, search_key(params), content)
+
+    def _cached(self, key):
+        """
+        :returns: tuple -- the cached response or None and the generation
+                  of the cache to store a fresh response with
+        """
+        if key is None:
+            return None, None
+        # taken before the lookup, a clear() during the request wins
+        generation = self.cache.generation
+        return self.cache.get(key), generation
+
+    def _store(self, key, response, size, cache_ttl, generation):
+        # truncated results are not worth keeping
+        if key is not None and not response.partialResults:
+            self.cache.set(key, response, size, ttl=cache_ttl,
+                           generation=generation)
+
+    def _response_format(self, kwargs):
+        wt = kwargs.get('wt', self.response_format)
+        if wt not in ('json', 'javabin'):
+            raise scorched.exc.SolrError(
+                "Unsupported response format %s" % wt)
+        return wt, dict(kwargs, wt=wt)
+
+    def _parser(self, wt):
+        # the size travels with the response so that a response served
+        # again on 304 Not Modified can still be weighed by the cache
+        def parse(body):
+            return self._parse_response(body, wt), len(body)
+        return parse
+
+    def _parse_response(self, body, wt):
+        if wt == 'javabin':
+            return scorched.response.SolrResponse.from_javabin(
+                body, self.field_codecs)
+        return scorched.response.SolrResponse.from_json(
+            body, self.field_codecs, loads=self.json_codec.loads)
+
+    def export(self, deadline=None, base_url=None, **kwargs):
+        """
+        :param deadline: optional -- seconds until the export is given up,
+                         defaults to the deadline of the interface
+        :type deadline: float
+        :param base_url: optional -- see :meth:`SolrConnection.export`
+        :type base_url: str
+        :returns: ExportSolrResponse -- the documents are parsed while they
+                  arrive
+
+        Export the complete sorted result set with the export handler. The
+        fields in ``fl`` and ``sort`` must use docValues.
+        """
+        if deadline is None:
+            deadline = self.deadline
+        if deadline is not None:
+            # solr does not time limit exports
+            deadline = time.time() + deadline
+        params = scorched.search.params_from_dict(**dict(kwargs, wt='json'))
+        return scorched.response.ExportSolrResponse(
+            self.conn.export(params, deadline=deadline, base_url=base_url),
+            self.field_codecs)
+
+    def _deadline(self, deadline, kwargs):
+        """
+        Turn the relative deadline of a search into a point in time and ask
+        solr to stop in time as well.
+        """
+        if deadline is None:
+            deadline = self.deadline
+        if deadline is None:
+            return None, kwargs
+        # solr refuses timeAllowed together with cursorMark
+        if 'timeAllowed' not in kwargs and 'cursorMark' not in kwargs:
+            time_limiter = scorched.search.DeadlineOptions()
+            time_limiter.update(deadline)
+            kwargs = dict(kwargs, **time_limiter.options())
+        return time.time() + deadline, kwargs
+
+    def search_many(self, searches, max_concurrency=8, deadline=None,
+                    return_exceptions=True):
+        """
+        :param searches: searches built with :meth:`query` or
+                         :meth:`mlt_query`
+        :type searches: list
+        :param max_concurrency: optional -- searches running at the same time
+        :type max_concurrency: int
+        :param deadline: optional -- seconds until all searches must be done,
+                         shortens the deadlines of the single searches
+        :type deadline: float
+        :param return_exceptions: optional -- return the exception of a
+                                  failed search in its place instead of
+                                  raising it
+        :type return_exceptions: bool
+        :returns: list -- the responses in the order of ``searches``
+
+        Execute independent searches concurrently over the shared connection
+        pool, so the time taken is that of the slowest search rather than the
+        sum of all. Running more searches at once than ``pool_maxsize``
+        opens connections which are not kept.
+        """
+        deadline_at = None
+        if deadline is not None:
+            deadline_at = time.time() + deadline
+        results = concurrently(
+            lambda search: self._execute_before(search, deadline_at),
+            searches, max_concurrency, name="scorched-search")
+        if not return_exceptions:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
+
+    def get(self, ids, fields=None, chunk=100, max_concurrency=4,
+            deadline=None):
+        """
+        :param ids: unique key or unique keys of the documents
+        :type ids: str or list
+        :param fields: optional -- fields returned, all by default
+        :type fields: list
+        :param chunk: optional -- ids fetched by one request
+        :type chunk: int
+        :param max_concurrency: optional -- requests running at the same
+                                time
+        :type max_concurrency: int
+        :param deadline: optional -- seconds until all requests must be
+                         done, defaults to the deadline of the interface
+        :type deadline: float
+        :returns: dict -- the documents by unique key, ids not found are
+                  missing
+
+        Fetch documents with the real-time get handler, which sees
+        documents not committed yet and needs no search. Larger lists of
+        ids are fetched in chunks by concurrent requests.
+        """
+        if deadline is None:
+            deadline = self.deadline
+        if deadline is not None:
+            deadline = time.time() + deadline
+        results = concurrently(
+            lambda params: self.conn.get(params, deadline=deadline),
+            self._get_params(ids, fields, chunk), max_concurrency,
+            name="scorched-get")
+        return self._got_docs(results)
+
+    def _get_params(self, ids, fields, chunk):
+        """
+        :returns: list -- the parameters of the get request of each chunk
+        """
+        if isinstance(ids, scorched.compat.basestring) or \
+                not hasattr(ids, '__iter__'):
+            ids = [ids]
+        # the handler splits ids at unescaped commas
+        ids = [("%s" % id).replace('\\', '\\\\').replace(',', '\\,')
+               for id in ids]
+        fl = []
+        if fields is not None:
+            fields = list(fields)
+            if self.unique_key not in fields:
+                fields.append(self.unique_key)
+            fl = [('fl', ','.join(fields))]
+        return [[('ids', ','.join(ids[i:i + chunk]))] + fl
+                for i in range(0, len(ids), chunk)]
+
+    def _got_docs(self, bodies):
+        """
+        :returns: dict -- the documents of the get responses ``bodies`` by
+                  unique key, raises the first failed request
+        """
+        ret = {}
+        unique_key = self.unique_key
+        for body in bodies:
+            if isinstance(body, Exception):
+                raise body
+            docs = self.json_codec.loads(body)['response']['docs']
+            for doc in self.field_codecs.decode_docs(docs):
+                ret[doc[unique_key]] = doc
         return ret
 
+    def _execute_before(self, search, deadline_at):
+        """
+        Execute ``search`` within its own deadline and the point in time
+        ``deadline_at``.
+        """
+        if deadline_at is not None:
+            remaining = deadline_at - time.time()
+            if remaining <= 0:
+                raise scorched.exc.DeadlineExceeded("Deadline exceeded")
+            limiter = search.time_limiter
+            if limiter.seconds is None or limiter.seconds > remaining:
+                search = search.deadline(remaining,
+                                         limiter.segment_terminate_early)
+        return search.execute()
+
     def query(self, *args, **kwargs):
         """
         :returns: SolrSearch -- A solrsearch.
@@ -390,13 +1689,21 @@ class SolrInterface(object):
         else:
             return q
 
-    def mlt_search(self, content=None, **kwargs):
+    def mlt_search(self, content=None, deadline=None, cache_ttl=None,
+                   **kwargs):
         """
         Mlt search solr
         """
+        deadline, kwargs = self._deadline(deadline, kwargs)
+        wt, kwargs = self._response_format(kwargs)
         params = scorched.search.params_from_dict(**kwargs)
-        ret = scorched.response.SolrResponse.from_json(
-            self.conn.mlt(params, content=content), self._datefields)
+        key = self._cache_key(cache_ttl, 'mlt', params, content)
+        ret, generation = self._cached(key)
+        if ret is None:
+            body = self.conn.mlt(params, content=content, deadline=deadline,
+                                 raw=True)
+            ret = self._parse_response(body, wt)
+            self._store(key, ret, len(body), cache_ttl, generation)
         return ret
 
     def mlt_query(self, fields, content=None, content_charset=None,
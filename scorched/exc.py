@@ -1,5 +1,52 @@
 from __future__ import unicode_literals
+import requests
 
 
 class SolrError(Exception):
     pass
+
+
+class CircuitOpenError(SolrError, requests.exceptions.ConnectionError):
+    """
+    Raised without contacting solr while the circuit breaker of a node is
+    open. It is a ``ConnectionError`` so it is handled like an unreachable
+    node.
+    """
+    pass
+
+
+class DeadlineExceeded(SolrError, requests.exceptions.Timeout):
+    """
+    Raised when the deadline of a request passed before solr answered.
+    """
+    pass
+
+
+class VersionConflict(SolrError):
+    """
+    Raised when solr rejected an update because the ``_version_`` of a
+    document did not match (``409 Conflict``).
+    """
+    pass
+
+
+class NotSupportedError(SolrError, NotImplementedError):
+    """
+    Raised by methods of the asyncio interface which only the synchronous
+    interface offers.
+    """
+    pass
+
+
+class UpdateError(SolrError):
+    """
+    Raised when chunks of a pipelined update failed. ``errors`` lists
+    ``(number, exception)`` of the failed chunks ordered by chunk number.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        number, error = errors[0]
+        super(UpdateError, self).__init__(
+            "%s chunk(s) failed, first chunk %s: %s" % (
+                len(errors), number, error))
@@ -0,0 +1,284 @@
+"""
+Conversion of field values between python and solr, compiled from the
+schema.
+
+The field type of every field name is resolved once, through the explicit
+fields and the dynamic field patterns of the schema, and the resulting
+decoder and encoder are memoized per field name. Converting a document
+then costs one dict lookup per field.
+
+Update messages are written by :class:`UpdateEncoder`, which encodes the
+python values by their type while it serializes. Before, the encoders only
+bring date strings of date fields into the format solr expects.
+"""
+from __future__ import unicode_literals
+import datetime
+import decimal
+import functools
+import json
+import pytz
+import scorched.dates
+
+from scorched.compat import basestring, str
+
+
+# only dates need converting, numbers and booleans arrive as native json (or
+# javabin) values and are written by their python type
+DATE = 'date'
+
+# field type classes (without their package) by kind
+TYPE_CLASSES = {
+    'DateField': DATE, 'TrieDateField': DATE, 'DatePointField': DATE,
+}
+
+# kind and multiValued flag of the field type names of the example schemas,
+# used for schemas without field type definitions
+TYPE_NAMES = {}
+for _name in ('date', 'tdate', 'pdate'):
+    TYPE_NAMES[_name] = (DATE, False)
+    # the multi valued variants of the default configset
+    TYPE_NAMES[_name + 's'] = (DATE, True)
+del _name
+
+
+def decode_date(value):
+    return scorched.dates.solr_date(value)._dt_obj
+
+
+DECODERS = {DATE: decode_date}
+
+
+def encode_date(value):
+    # datetimes are left to UpdateEncoder
+    if not isinstance(value, basestring):
+        return value
+    try:
+        return format_datetime(
+            scorched.dates.datetime_from_w3_datestring(value))
+    except ValueError:
+        # e.g. date math like NOW/DAY, solr decides
+        return value
+
+
+ENCODERS = {DATE: encode_date}
+
+
+def encode_value(encode, value):
+    """
+    Encode single values, lists of values and the values of atomic update
+    operations (e.g. ``{"set": value}``).
+    """
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [encode_value(encode, v) for v in value]
+    if isinstance(value, dict):
+        # patterns of removeregex are no values of the field
+        return dict((k, v if k == 'removeregex' else encode_value(encode, v))
+                    for k, v in value.items())
+    if value is None:
+        return value
+    return encode(value)
+
+
+def decode_many(decode, value):
+    if isinstance(value, list):
+        return [decode(v) for v in value]
+    return decode(value)
+
+
+class FieldCodecs(object):
+    """
+    Decoders of the fields of a schema.
+    """
+
+    def __init__(self, schema):
+        """
+        :param schema: schema as returned by the schema api
+        :type schema: dict
+        """
+        field_types = dict(
+            (field_type['name'], field_type)
+            for field_type in schema.get('fieldTypes', ()))
+        self.fields = {}
+        for field in schema.get('fields', ()):
+            self.fields[field['name']] = self._resolve(field, field_types)
+        # solr tries longer patterns first, equally long ones in schema order
+        dynamic = sorted(schema.get('dynamicFields', ()),
+                         key=lambda field: -len(field['name']))
+        self.dynamic_fields = [
+            (field['name'], self._resolve(field, field_types))
+            for field in dynamic]
+        self._decoders = {}
+        self._encoders = {}
+
+    def _resolve(self, field, field_types):
+        """
+        :returns: tuple -- kind and multiValued flag of ``field``
+        """
+        field_type = field_types.get(field.get('type'), {})
+        kind, multi = None, False
+        if 'class' in field_type:
+            kind = TYPE_CLASSES.get(field_type['class'].rsplit('.', 1)[-1])
+        elif field.get('type') in TYPE_NAMES:
+            kind, multi = TYPE_NAMES[field['type']]
+        multi = field.get('multiValued', field_type.get('multiValued', multi))
+        return kind, bool(multi)
+
+    def lookup(self, name):
+        """
+        :param name: field name
+        :type name: str
+        :returns: tuple -- kind (``date`` or None) and multiValued flag of
+                  the field
+        """
+        try:
+            return self.fields[name]
+        except KeyError:
+            pass
+        for pattern, resolved in self.dynamic_fields:
+            if pattern.startswith('*') and name.endswith(pattern[1:]):
+                return resolved
+            if pattern.endswith('*') and name.startswith(pattern[:-1]):
+                return resolved
+        return None, False
+
+    def kind(self, name):
+        return self.lookup(name)[0]
+
+    def decoder(self, name):
+        """
+        :returns: callable -- converts a value of the field as returned by
+                  solr, None if it needs no conversion
+        """
+        try:
+            return self._decoders[name]
+        except KeyError:
+            pass
+        kind, multi = self.lookup(name)
+        decode = DECODERS.get(kind)
+        if decode is not None and multi:
+            decode = functools.partial(decode_many, decode)
+        self._decoders[name] = decode
+        return decode
+
+    def encoder(self, name):
+        """
+        :returns: callable -- converts a python value of the field for an
+                  update, None if it needs no conversion
+        """
+        try:
+            return self._encoders[name]
+        except KeyError:
+            pass
+        encode = ENCODERS.get(self.kind(name))
+        if encode is not None:
+            encode = functools.partial(encode_value, encode)
+        self._encoders[name] = encode
+        return encode
+
+    def prepare_doc(self, doc):
+        """
+        :returns: dict -- ``doc`` without the fields set to None and with
+                  converted values, a (shallow) copy if anything changed
+
+        The document itself is never changed.
+        """
+        ret = doc
+        encoders = self._encoders
+        for name, value in doc.items():
+            if value is None:
+                if ret is doc:
+                    ret = dict(doc)
+                del ret[name]
+                continue
+            try:
+                encode = encoders[name]
+            except KeyError:
+                encode = self.encoder(name)
+            if encode is not None:
+                if ret is doc:
+                    ret = dict(doc)
+                ret[name] = encode(value)
+        return ret
+
+    def decode_docs(self, docs):
+        """
+        Convert the fields of the documents of a response in place.
+        """
+        decoders = self._decoders
+        for doc in docs:
+            # only values change, the keys can be iterated directly
+            for name, value in doc.items():
+                try:
+                    decode = decoders[name]
+                except KeyError:
+                    decode = self.decoder(name)
+                if decode is not None:
+                    doc[name] = decode(value)
+        return docs
+
+    def datefields(self):
+        """
+        :returns: list -- names of the date fields and the fixed part of
+                  the dynamic date field patterns
+        """
+        ret = [name for name, (kind, multi) in self.fields.items()
+               if kind == DATE]
+        ret.extend(pattern.replace('*', '')
+                   for pattern, (kind, multi) in self.dynamic_fields
+                   if kind == DATE)
+        return ret
+
+
+def format_datetime(value):
+    """
+    :returns: str -- ``value`` in UTC, formatted like
+              :class:`scorched.dates.solr_date`
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(pytz.utc).replace(tzinfo=None)
+    return "%sZ" % value.isoformat()
+
+
+def encode_update_value(value):
+    """
+    Encode a value json has no type for, raises a ``TypeError`` for values
+    that can't be encoded.
+    """
+    if isinstance(value, datetime.datetime):
+        return format_datetime(value)
+    if isinstance(value, datetime.date):
+        return "%sT00:00:00Z" % value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        if value == value.to_integral_value():
+            return int(value)
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, scorched.dates.solr_date):
+        return str(value)
+    raise TypeError("%r is not JSON serializable" % (value, ))
+
+
+def drop_none(doc):
+    """
+    :returns: dict -- ``doc`` itself or, if it has fields set to None, a
+              copy without them
+    """
+    for value in doc.values():
+        if value is None:
+            return dict((name, value) for name, value in doc.items()
+                        if value is not None)
+    return doc
+
+
+class UpdateEncoder(json.JSONEncoder):
+    """
+    Serialize documents for update messages in a single pass.
+
+    Datetimes, dates, decimals and sets are encoded as they are reached.
+    Fields set to None are left out by passing the documents through
+    :meth:`FieldCodecs.prepare_doc` or :func:`drop_none` first.
+    """
+
+    def default(self, value):
+        return encode_update_value(value)
@@ -0,0 +1,523 @@
+"""
+Pipelined sending of update requests.
+
+Chunks of documents pass through two stages connected by bounded queues:
+``workers`` threads serialize them and ``max_in_flight`` threads send the
+serialized messages. Serializing the next chunks overlaps with the round
+trips of the previous ones, and solr receives several update requests at
+once. The queues provide back-pressure, chunks are only taken from the
+input as fast as they are sent.
+
+:class:`AdaptiveBatcher` forms the chunks by a byte budget instead of a
+document count, :class:`BulkIndexer` batches single operations made by many
+threads in the background.
+"""
+from __future__ import unicode_literals
+import collections
+import threading
+import time
+import traceback
+import warnings
+import scorched.exc
+
+from scorched.compat import queue
+from scorched.parallel import put_unless_stopped
+
+
+# queued to end the background thread of a BulkIndexer
+_STOP = object()
+
+
+def is_list(value):
+    return isinstance(value, (list, tuple, set, frozenset))
+
+
+def _remaining(deadline):
+    # seconds left until ``deadline``, None waits without limit
+    if deadline is None:
+        return None
+    return max(0, deadline - time.time())
+
+
+def pipeline(chunks, serialize, send, workers=2, max_in_flight=2):
+    """
+    :param chunks: chunks of documents, e.g. from
+                   :func:`scorched.connection.grouper`
+    :type chunks: iterable
+    :param serialize: callable turning a chunk into an update message
+    :type serialize: callable
+    :param send: callable sending an update message
+    :type send: callable
+    :param workers: optional -- threads serializing chunks
+    :type workers: int
+    :param max_in_flight: optional -- update requests sent at the same time
+    :type max_in_flight: int
+    :returns: list -- ``(number, exception)`` of the failed chunks, ordered
+              by chunk number
+
+    No new chunks are started after the first failure, the chunks already
+    taken are completed. Chunks can reach solr in any order.
+    """
+    workers = max(1, workers)
+    max_in_flight = max(1, max_in_flight)
+    stop = threading.Event()
+    serialize_queue = queue.Queue(workers)
+    send_queue = queue.Queue(max_in_flight)
+    errors = []
+    lock = threading.Lock()
+    serializing = [workers]
+
+    def fail(number, error):
+        with lock:
+            errors.append((number, error))
+        stop.set()
+
+    def serializer():
+        try:
+            while True:
+                item = serialize_queue.get()
+                if item is None:
+                    return
+                number, chunk = item
+                if stop.is_set():
+                    continue
+                try:
+                    message = serialize(chunk)
+                except Exception as e:
+                    fail(number, e)
+                    continue
+                send_queue.put((number, message))
+        finally:
+            with lock:
+                serializing[0] -= 1
+                last = serializing[0] == 0
+            if last:
+                for _ in range(max_in_flight):
+                    send_queue.put(None)
+
+    def sender():
+        while True:
+            item = send_queue.get()
+            if item is None:
+                return
+            number, message = item
+            if stop.is_set():
+                continue
+            try:
+                send(message)
+            except Exception as e:
+                fail(number, e)
+
+    threads = [threading.Thread(target=serializer, name="scorched-serialize")
+               for _ in range(workers)]
+    threads.extend(threading.Thread(target=sender, name="scorched-update")
+                   for _ in range(max_in_flight))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        for number, chunk in enumerate(chunks):
+            if not put_unless_stopped(serialize_queue, (number, chunk), stop):
+                break
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        # the threads consume everything, so these puts can't block forever
+        for _ in range(workers):
+            serialize_queue.put(None)
+        for thread in threads:
+            thread.join()
+    return sorted(errors, key=lambda error: error[0])
+
+
+class AdaptiveBatcher(object):
+    """
+    Batches documents by a byte budget per update request which adapts to
+    the observed update latency, like tcp congestion control.
+
+    The budget doubles after every batch solr indexed within
+    ``target_latency`` (slow start). After the first batch which took
+    longer or failed it is cut to ``decrease`` of its size and grows by
+    ``increase`` bytes per fast batch from then on. The budget stays between
+    ``min_bytes`` and ``max_bytes``; a document larger than the budget is
+    sent alone. The same batcher can be passed to several ``add`` calls and
+    keeps what it learned.
+    """
+
+    def __init__(self, initial_bytes=256 * 1024, min_bytes=16 * 1024,
+                 max_bytes=16 * 1024 * 1024, target_latency=1.0,
+                 increase=256 * 1024, decrease=0.5, history=100):
+        """
+        :param initial_bytes: optional -- budget of the first batch
+        :type initial_bytes: int
+        :param min_bytes: optional -- smallest budget
+        :type min_bytes: int
+        :param max_bytes: optional -- largest budget
+        :type max_bytes: int
+        :param target_latency: optional -- seconds an update request may
+                               take before the budget is decreased
+        :type target_latency: float
+        :param increase: optional -- bytes added to the budget per fast
+                         batch after slow start
+        :type increase: int
+        :param decrease: optional -- factor applied to the budget after a
+                         slow or failed batch
+        :type decrease: float
+        :param history: optional -- number of batches kept for
+                        :meth:`stats`
+        :type history: int
+        """
+        self.budget = initial_bytes
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.target_latency = target_latency
+        self.increase = increase
+        self.decrease = decrease
+        # slow start ends at the first congestion
+        self.threshold = max_bytes
+        self.history = collections.deque(maxlen=history)
+        self.batches_sent = 0
+        self.docs_sent = 0
+        self.bytes_sent = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def batches(self, docs, encode):
+        """
+        :param docs: documents to be added
+        :type docs: iterable
+        :param encode: callable returning the json of one document
+        :type encode: callable
+        :returns: iterator over ``(message, count)`` -- json update messages
+                  (utf-8 bytes) within the current budget and their number
+                  of documents
+        """
+        pending = []
+        size = 0
+        for doc in docs:
+            encoded = encode(doc)
+            # the budget is in bytes on the wire, not characters
+            if not isinstance(encoded, bytes):
+                encoded = encoded.encode('utf-8')
+            if pending and size + len(encoded) + 1 > self.budget:
+                yield self._message(pending)
+                pending = []
+                size = 0
+            pending.append(encoded)
+            size += len(encoded) + 1
+        if pending:
+            yield self._message(pending)
+
+    def _message(self, encoded):
+        return b"[" + b",".join(encoded) + b"]", len(encoded)
+
+    def timed(self, send):
+        """
+        :param send: callable sending an update message
+        :type send: callable
+        :returns: callable -- sends a batch from :meth:`batches` with
+                  ``send`` and adapts the budget to its latency
+        """
+        def send_batch(batch):
+            message, count = batch
+            start = time.time()
+            try:
+                send(message)
+            except Exception:
+                self.record(len(message), count, time.time() - start,
+                            failed=True)
+                raise
+            self.record(len(message), count, time.time() - start)
+        return send_batch
+
+    def record(self, size, count, seconds, failed=False):
+        """
+        :param size: bytes of the update message
+        :type size: int
+        :param count: number of documents
+        :type count: int
+        :param seconds: time the update request took
+        :type seconds: float
+        :param failed: optional -- whether the request failed
+        :type failed: bool
+        """
+        with self._lock:
+            self.history.append((count, size, seconds, failed))
+            if not failed:
+                self.batches_sent += 1
+                self.docs_sent += count
+                self.bytes_sent += size
+                self.seconds += seconds
+            if failed or seconds > self.target_latency:
+                self.threshold = max(self.min_bytes,
+                                     int(self.budget * self.decrease))
+                self.budget = self.threshold
+            elif self.budget < self.threshold:
+                self.budget = min(self.budget * 2, self.threshold)
+            else:
+                self.budget = min(self.budget + self.increase,
+                                  self.max_bytes)
+
+    def stats(self):
+        """
+        :returns: dict -- current ``budget``, totals of the sent
+                  ``batches``, ``docs`` and ``bytes``, throughput in
+                  ``docs_per_second`` and ``bytes_per_second`` of the time
+                  spent in update requests and the ``recent`` batches as
+                  ``(docs, bytes, seconds, failed)``
+        """
+        with self._lock:
+            seconds = self.seconds or None
+            return {
+                'budget': self.budget,
+                'batches': self.batches_sent,
+                'docs': self.docs_sent,
+                'bytes': self.bytes_sent,
+                'docs_per_second': seconds and self.docs_sent / seconds,
+                'bytes_per_second': seconds and self.bytes_sent / seconds,
+                'recent': list(self.history),
+            }
+
+    def __repr__(self):
+        return "AdaptiveBatcher(budget=%s, batches=%s, docs=%s)" % (
+            self.budget, self.batches_sent, self.docs_sent)
+
+
+class BulkIndexer(object):
+    """
+    Collects single adds and deletes from any number of threads and sends
+    them in batches from a background thread.
+
+    A batch is sent once it holds ``max_docs`` operations or ``max_bytes``
+    bytes of json, or when its first operation waited ``max_delay``
+    seconds. Operations are queued in a bounded queue, ``add`` and
+    ``delete`` block while ``queue_size`` operations are waiting. Adds and
+    deletes are sent in the order they were made. The result cache of the
+    interface is cleared after every batch.
+
+    ::
+
+        >>> with BulkIndexer(si, commit_within=5000) as indexer:
+        ...     indexer.add({"id": "1", "name": "one"})
+        ...     indexer.delete("2")
+    """
+
+    def __init__(self, interface, max_docs=500, max_bytes=5 * 1024 * 1024,
+                 max_delay=1.0, commit_within=None, queue_size=10000,
+                 on_success=None, on_error=None):
+        """
+        :param interface: interface the batches are sent with
+        :type interface: scorched.SolrInterface
+        :param max_docs: optional -- operations per batch
+        :type max_docs: int
+        :param max_bytes: optional -- bytes of json per batch
+        :type max_bytes: int
+        :param max_delay: optional -- seconds an operation waits for its
+                          batch to fill up
+        :type max_delay: float
+        :param commit_within: optional -- milliseconds until solr commits
+                              the changes of a batch
+        :type commit_within: int
+        :param queue_size: optional -- operations waiting to be batched
+        :type queue_size: int
+        :param on_success: optional -- called from the background thread
+                           with the operations of each batch sent, as
+                           ``("add", doc)``, ``("delete", id)`` or
+                           ``("delete_query", query)`` tuples
+        :type on_success: callable
+        :param on_error: optional -- called with the operations and the
+                         exception of each failed batch, without it the
+                         errors are raised by :meth:`flush`
+        :type on_error: callable
+        """
+        self.interface = interface
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.commit_within = commit_within
+        self.on_success = on_success
+        self.on_error = on_error
+        self.batches_sent = 0
+        self.errors = []
+        self.closed = False
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run,
+                                        name="scorched-bulk-indexer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, doc, timeout=None):
+        """
+        :param doc: document to be added, it is serialized right away and
+                    can be reused afterwards
+        :type doc: dict
+        :param timeout: optional -- seconds to wait for room in the queue
+        :type timeout: float
+        """
+        encoded = self.interface._encode_doc(doc)
+        self._put(('add', doc), '"add": {"doc": %s}' % encoded, timeout)
+
+    def delete(self, ids, timeout=None):
+        """
+        :param ids: id or ids of documents to be deleted
+        :type ids: str or list
+        :param timeout: optional -- seconds to wait for room in the queue
+        :type timeout: float
+        """
+        if not is_list(ids):
+            ids = [ids]
+        dumps = self.interface.json_codec.dumps
+        for id in ids:
+            self._put(('delete', id), '"delete": %s' % dumps({"id": id}),
+                      timeout)
+
+    def delete_by_query(self, query, timeout=None):
+        """
+        :param query: criteria which documents should be deleted
+        :type query: LuceneQuery
+        :param timeout: optional -- seconds to wait for room in the queue
+        :type timeout: float
+        """
+        self._put(('delete_query', query), '"delete": %s' % (
+            self.interface.json_codec.dumps({"query": "%s" % query})),
+            timeout)
+
+    def _put(self, operation, command, timeout):
+        if self.closed:
+            raise ValueError("BulkIndexer is closed")
+        # max_bytes counts bytes on the wire, not characters
+        command = command.encode('utf-8')
+        try:
+            self._queue.put((operation, command), timeout=timeout)
+        except queue.Full:
+            raise scorched.exc.SolrError(
+                "BulkIndexer queue is full, solr does not keep up")
+
+    def flush(self, timeout=None):
+        """
+        :param timeout: optional -- seconds to wait for the batches
+        :type timeout: float
+        :returns: bool -- False if the timeout passed first
+
+        Send everything added so far and wait until it is done. Errors of
+        batches without an ``on_error`` callback are raised as
+        :class:`scorched.exc.UpdateError`.
+        """
+        if self.closed:
+            raise ValueError("BulkIndexer is closed")
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        done = threading.Event()
+        try:
+            self._queue.put((done, None), timeout=timeout)
+        except queue.Full:
+            return False
+        if not done.wait(_remaining(deadline)):
+            return False
+        with self._lock:
+            errors, self.errors = self.errors, []
+        if errors:
+            raise scorched.exc.UpdateError(errors)
+        return True
+
+    def close(self, timeout=None):
+        """
+        :param timeout: optional -- seconds to wait for the batches and the
+                        background thread
+        :type timeout: float
+
+        Flush and stop the background thread. Further operations raise a
+        ``ValueError``.
+        """
+        if self.closed:
+            return
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        try:
+            self.flush(timeout)
+        finally:
+            self.closed = True
+            try:
+                self._queue.put((_STOP, None), timeout=_remaining(deadline))
+            except queue.Full:
+                # the daemon thread is left behind, blocked on solr
+                pass
+            else:
+                self._thread.join(_remaining(deadline))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+            return
+        try:
+            self.close()
+        except Exception:
+            # the exception of the with block is the one to surface
+            warnings.warn("BulkIndexer failed while closing:\n%s" % (
+                traceback.format_exc(), ))
+
+    def _run(self):
+        batch = []
+        size = 0
+        started = None
+        while True:
+            timeout = None
+            if batch:
+                timeout = max(0, started + self.max_delay - time.time())
+            try:
+                operation, command = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                # the oldest operation waited max_delay
+                operation = command = None
+            if command is not None:
+                if not batch:
+                    started = time.time()
+                batch.append((operation, command))
+                size += len(command)
+                if len(batch) < self.max_docs and size < self.max_bytes:
+                    continue
+            if batch:
+                self._send(batch)
+                batch = []
+                size = 0
+            if operation is _STOP:
+                return
+            if isinstance(operation, threading.Event):
+                operation.set()
+
+    def _send(self, batch):
+        message = b"{" + b", ".join(
+            command for operation, command in batch) + b"}"
+        operations = [operation for operation, command in batch]
+        number = self.batches_sent
+        self.batches_sent += 1
+        try:
+            self.interface.conn.update(message,
+                                       commitWithin=self.commit_within)
+        except Exception as e:
+            # a failed batch may have been applied partly
+            self.interface.invalidate_cache()
+            if self.on_error is None:
+                with self._lock:
+                    self.errors.append((number, e))
+            else:
+                self._callback(self.on_error, operations, e)
+            return
+        self.interface.invalidate_cache()
+        if self.on_success is not None:
+            self._callback(self.on_success, operations)
+
+    def _callback(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            # the background thread has to survive broken callbacks
+            warnings.warn("BulkIndexer callback %r failed:\n%s" % (
+                callback, traceback.format_exc()))
@@ -0,0 +1,438 @@
+"""
+Decoder for solr's binary response format (``wt=javabin``).
+
+Decoding javabin is cheaper than decoding json: numbers and strings need no
+tokenizing and dates arrive as milliseconds instead of strings that must be
+parsed again. :func:`loads` returns the same structure as the json response
+writer with its default ``json.nl=flat``: maps become dicts, named lists
+become flat ``[name, value, ...]`` lists and document lists become dicts with
+``numFound``, ``start`` and ``docs``. Dates are returned as timezone aware
+(UTC) datetimes.
+
+:func:`dumps` writes the subset of the format needed for fixtures and
+benchmarks.
+"""
+from __future__ import unicode_literals
+import datetime
+import pytz
+import struct
+
+from scorched.compat import str
+from scorched.compat import is_py2
+
+VERSION = 2
+
+NULL = 0
+BOOL_TRUE = 1
+BOOL_FALSE = 2
+BYTE = 3
+SHORT = 4
+DOUBLE = 5
+INT = 6
+LONG = 7
+FLOAT = 8
+DATE = 9
+MAP = 10
+SOLRDOC = 11
+SOLRDOCLST = 12
+BYTEARR = 13
+ITERATOR = 14
+END = 15
+MAP_ENTRY_ITER = 17
+ENUM_FIELD_VALUE = 18
+MAP_ENTRY = 19
+# types with the length or a small value stored in the lower 5 bits
+STR = 1 << 5
+SINT = 2 << 5
+SLONG = 3 << 5
+ARR = 4 << 5
+ORDERED_MAP = 5 << 5
+NAMED_LST = 6 << 5
+EXTERN_STRING = 7 << 5
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+_byte = struct.Struct('>b')
+_short = struct.Struct('>h')
+_int = struct.Struct('>i')
+_long = struct.Struct('>q')
+_float = struct.Struct('>f')
+_double = struct.Struct('>d')
+
+if is_py2:  # pragma: no cover
+    integer_types = (int, long)
+else:
+    integer_types = (int,)
+
+
+class JavaBinError(ValueError):
+    pass
+
+
+class NamedList(list):
+    """
+    List of ``(name, value)`` pairs written as a solr ``NamedList``.
+    """
+    pass
+
+
+class DocumentList(object):
+    """
+    A solr ``SolrDocumentList`` for :func:`dumps`.
+    """
+
+    def __init__(self, docs, numFound=None, start=0, maxScore=None):
+        self.docs = docs
+        self.numFound = len(docs) if numFound is None else numFound
+        self.start = start
+        self.maxScore = maxScore
+
+
+class _End(object):
+    pass
+
+
+class _Document(dict):
+    pass
+
+
+class Decoder(object):
+
+    def __init__(self, data):
+        self.buf = bytearray(data)
+        self.pos = 0
+        self.strings = []
+        shifted = {
+            STR >> 5: self.read_str,
+            SINT >> 5: self.read_small_int,
+            SLONG >> 5: self.read_small_long,
+            ARR >> 5: self.read_array,
+            ORDERED_MAP >> 5: self.read_ordered_map,
+            NAMED_LST >> 5: self.read_named_list,
+            EXTERN_STRING >> 5: self.read_extern_string,
+        }
+        plain = {
+            NULL: lambda tag: None,
+            BOOL_TRUE: lambda tag: True,
+            BOOL_FALSE: lambda tag: False,
+            BYTE: lambda tag: self.unpack(_byte),
+            SHORT: lambda tag: self.unpack(_short),
+            DOUBLE: lambda tag: self.unpack(_double),
+            INT: lambda tag: self.unpack(_int),
+            LONG: lambda tag: self.unpack(_long),
+            FLOAT: lambda tag: self.unpack(_float),
+            DATE: self.read_date,
+            MAP: self.read_map,
+            SOLRDOC: self.read_document,
+            SOLRDOCLST: self.read_document_list,
+            BYTEARR: self.read_byte_array,
+            ITERATOR: self.read_iterator,
+            END: lambda tag: _End,
+            MAP_ENTRY_ITER: self.read_map_entry_iter,
+            ENUM_FIELD_VALUE: self.read_enum,
+            MAP_ENTRY: self.read_map_entry,
+        }
+        # one lookup per value, this is the hot path
+        self.readers = [shifted.get(tag >> 5) or plain.get(tag, self.unknown)
+                        for tag in range(256)]
+
+    def decode(self):
+        if not self.buf or self.buf[0] != VERSION:
+            raise JavaBinError("Unsupported javabin version")
+        self.pos = 1
+        value = self.read_val()
+        if self.buf[1] >> 5 == NAMED_LST >> 5:
+            # the response itself is a named list, json always writes it as
+            # a map
+            value = dict(zip(value[::2], value[1::2]))
+        return value
+
+    def read_byte(self):
+        try:
+            tag = self.buf[self.pos]
+        except IndexError:
+            raise JavaBinError("Unexpected end of javabin data")
+        self.pos += 1
+        return tag
+
+    def unpack(self, fmt):
+        if self.pos + fmt.size > len(self.buf):
+            raise JavaBinError("Unexpected end of javabin data")
+        value, = fmt.unpack_from(self.buf, self.pos)
+        self.pos += fmt.size
+        return value
+
+    def read_vint(self):
+        value = 0
+        shift = 0
+        while True:
+            b = self.read_byte()
+            value |= (b & 0x7f) << shift
+            if not b & 0x80:
+                return value
+            shift += 7
+
+    def read_size(self, tag):
+        size = tag & 0x1f
+        if size == 0x1f:
+            size += self.read_vint()
+        return size
+
+    def read_val(self):
+        pos = self.pos
+        if pos >= len(self.buf):
+            raise JavaBinError("Unexpected end of javabin data")
+        tag = self.buf[pos]
+        self.pos = pos + 1
+        return self.readers[tag](tag)
+
+    def unknown(self, tag):
+        raise JavaBinError("Unknown javabin type %s" % tag)
+
+    def read_str(self, tag):
+        size = tag & 0x1f
+        if size == 0x1f:
+            size += self.read_vint()
+        start = self.pos
+        end = self.pos = start + size
+        if end > len(self.buf):
+            raise JavaBinError("Unexpected end of javabin data")
+        return self.buf[start:end].decode('utf-8')
+
+    def read_small_int(self, tag):
+        value = tag & 0x0f
+        if tag & 0x10:
+            value |= self.read_vint() << 4
+        return value
+
+    read_small_long = read_small_int
+
+    def read_extern_string(self, tag):
+        index = tag & 0x1f
+        if index == 0x1f:
+            index += self.read_vint()
+        if index:
+            return self.strings[index - 1]
+        value = self.read_val()
+        self.strings.append(value)
+        return value
+
+    def read_array(self, tag):
+        return [self.read_val() for _ in range(self.read_size(tag))]
+
+    def read_ordered_map(self, tag):
+        ret = {}
+        for _ in range(self.read_size(tag)):
+            name = self.read_val()
+            ret[name] = self.read_val()
+        return ret
+
+    def read_named_list(self, tag):
+        ret = []
+        for _ in range(self.read_size(tag)):
+            ret.append(self.read_val())
+            ret.append(self.read_val())
+        return ret
+
+    def read_map(self, tag):
+        ret = {}
+        for _ in range(self.read_vint()):
+            key = self.read_val()
+            ret[key] = self.read_val()
+        return ret
+
+    def read_map_entry_iter(self, tag):
+        ret = {}
+        while True:
+            key = self.read_val()
+            if key is _End:
+                return ret
+            ret[key] = self.read_val()
+
+    def read_map_entry(self, tag):
+        key = self.read_val()
+        return {key: self.read_val()}
+
+    def read_iterator(self, tag):
+        ret = []
+        while True:
+            value = self.read_val()
+            if value is _End:
+                return ret
+            ret.append(value)
+
+    def read_date(self, tag):
+        millis = self.unpack(_long)
+        return EPOCH + datetime.timedelta(milliseconds=millis)
+
+    def read_byte_array(self, tag):
+        size = self.read_vint()
+        start = self.pos
+        self.pos += size
+        return bytes(self.buf[start:self.pos])
+
+    def read_enum(self, tag):
+        self.read_val()  # the ordinal
+        return self.read_val()
+
+    def read_document(self, tag):
+        doc = _Document()
+        buf = self.buf
+        strings = self.strings
+        read_val = self.read_val
+        for _ in range(self.read_size(self.read_byte())):
+            pos = self.pos
+            if (pos < len(buf) and buf[pos] >> 5 == EXTERN_STRING >> 5 and
+                    0 < buf[pos] & 0x1f < 0x1f):
+                # shortcut for a field name seen in a previous document
+                self.pos = pos + 1
+                name = strings[(buf[pos] & 0x1f) - 1]
+            else:
+                name = read_val()
+            if isinstance(name, _Document):
+                # anonymous child documents are written in place of a name
+                doc.setdefault('_childDocuments_', []).append(dict(name))
+                continue
+            doc[name] = read_val()
+        return doc
+
+    def read_document_list(self, tag):
+        header = self.read_val()
+        docs = [dict(doc) for doc in self.read_val()]
+        ret = {'numFound': header[0], 'start': header[1], 'docs': docs}
+        if len(header) > 2 and header[2] is not None:
+            ret['maxScore'] = header[2]
+        if len(header) > 3 and header[3] is not None:
+            ret['numFoundExact'] = header[3]
+        return ret
+
+
+def loads(data):
+    """
+    :param data: javabin encoded response
+    :type data: bytes
+    :returns: the decoded value, the response of a search is a dict like the
+              one of the json response writer
+    """
+    return Decoder(data).decode()
+
+
+class Encoder(object):
+
+    def __init__(self):
+        self.out = bytearray()
+        self.strings = {}
+
+    def encode(self, value):
+        self.out.append(VERSION)
+        self.write_val(value)
+        return bytes(self.out)
+
+    def write_tag(self, tag, size):
+        if size < 0x1f:
+            self.out.append(tag | size)
+        else:
+            self.out.append(tag | 0x1f)
+            self.write_vint(size - 0x1f)
+
+    def write_vint(self, value):
+        while value & ~0x7f:
+            self.out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        self.out.append(value)
+
+    def write_small(self, tag, value):
+        if value & ~0x0f:
+            self.out.append(tag | 0x10 | (value & 0x0f))
+            self.write_vint(value >> 4)
+        else:
+            self.out.append(tag | value)
+
+    def write_str(self, value):
+        data = value.encode('utf-8')
+        self.write_tag(STR, len(data))
+        self.out.extend(data)
+
+    def write_extern_string(self, value):
+        index = self.strings.get(value)
+        if index is not None:
+            self.write_tag(EXTERN_STRING, index)
+            return
+        self.write_tag(EXTERN_STRING, 0)
+        self.write_str(value)
+        self.strings[value] = len(self.strings) + 1
+
+    def write_val(self, value):
+        if value is None:
+            self.out.append(NULL)
+        elif value is True:
+            self.out.append(BOOL_TRUE)
+        elif value is False:
+            self.out.append(BOOL_FALSE)
+        elif isinstance(value, integer_types):
+            if 0 <= value < 2 ** 31:
+                self.write_small(SINT, value)
+            elif -2 ** 31 <= value < 2 ** 31:
+                self.out.append(INT)
+                self.out.extend(_int.pack(value))
+            elif value >= 0:
+                self.write_small(SLONG, value)
+            else:
+                self.out.append(LONG)
+                self.out.extend(_long.pack(value))
+        elif isinstance(value, float):
+            self.out.append(DOUBLE)
+            self.out.extend(_double.pack(value))
+        elif isinstance(value, str):
+            self.write_str(value)
+        elif isinstance(value, bytes):
+            self.out.append(BYTEARR)
+            self.write_vint(len(value))
+            self.out.extend(value)
+        elif isinstance(value, datetime.datetime):
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=pytz.utc)
+            delta = value - EPOCH
+            millis = (delta.days * 86400 + delta.seconds) * 1000 + \
+                delta.microseconds // 1000
+            self.out.append(DATE)
+            self.out.extend(_long.pack(millis))
+        elif isinstance(value, NamedList):
+            self.write_tag(NAMED_LST, len(value))
+            for name, item in value:
+                self.write_str(name)
+                self.write_val(item)
+        elif isinstance(value, DocumentList):
+            self.out.append(SOLRDOCLST)
+            self.write_val([value.numFound, value.start, value.maxScore])
+            self.write_tag(ARR, len(value.docs))
+            for doc in value.docs:
+                self.write_document(doc)
+        elif isinstance(value, dict):
+            self.write_tag(ORDERED_MAP, len(value))
+            for name, item in value.items():
+                self.write_str(name)
+                self.write_val(item)
+        elif isinstance(value, (list, tuple)):
+            self.write_tag(ARR, len(value))
+            for item in value:
+                self.write_val(item)
+        else:
+            raise JavaBinError("Cannot encode %s object" % type(value))
+
+    def write_document(self, doc):
+        self.out.append(SOLRDOC)
+        self.write_tag(ORDERED_MAP, len(doc))
+        for name, item in doc.items():
+            # field names repeat in every document
+            self.write_extern_string(name)
+            self.write_val(item)
+
+
+def dumps(value):
+    """
+    :param value: value to encode, use :class:`NamedList` and
+                  :class:`DocumentList` for the solr specific types
+    :returns: bytes -- javabin encoded ``value``
+    """
+    return Encoder().encode(value)
@@ -0,0 +1,104 @@
+"""
+JSON codecs writing update messages and reading json responses.
+
+A codec has a ``loads`` method taking the body of a response as bytes (or
+text) and a ``dumps`` method returning the json text of an update message.
+``dumps`` encodes datetimes, dates, decimals and sets like
+:class:`scorched.fields.UpdateEncoder`.
+
+:class:`StdlibCodec` uses the ``json`` module of the standard library,
+:class:`OrjsonCodec` and :class:`UjsonCodec` the faster ``orjson`` and
+``ujson`` packages if they are installed. :func:`get_codec` returns a codec
+by name, ``auto`` picks the fastest one installed.
+"""
+from __future__ import unicode_literals
+import json
+import scorched.exc
+import scorched.fields
+
+from scorched.compat import basestring
+
+
+class StdlibCodec(object):
+    name = 'json'
+
+    def __init__(self):
+        self._encoder = scorched.fields.UpdateEncoder()
+
+    def loads(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+    def dumps(self, obj):
+        return self._encoder.encode(obj)
+
+
+class OrjsonCodec(object):
+    name = 'orjson'
+
+    def __init__(self):
+        try:
+            import orjson
+        except ImportError:
+            raise ImportError(
+                "OrjsonCodec needs orjson, install it or use another "
+                "json_codec")
+        self._orjson = orjson
+        self.loads = orjson.loads
+        # orjson writes datetimes without converting them to UTC, hand
+        # them to encode_update_value like the other unsupported types
+        self._option = orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(self, obj):
+        return self._orjson.dumps(
+            obj, default=scorched.fields.encode_update_value,
+            option=self._option).decode('utf-8')
+
+
+class UjsonCodec(StdlibCodec):
+    """
+    Parses with ujson. Update messages are written by the standard library,
+    ujson has no hook to encode datetimes as solr expects them.
+    """
+    name = 'ujson'
+
+    def __init__(self):
+        super(UjsonCodec, self).__init__()
+        try:
+            import ujson
+        except ImportError:
+            raise ImportError(
+                "UjsonCodec needs ujson, install it or use another "
+                "json_codec")
+        self.loads = ujson.loads
+
+
+CODECS = {'json': StdlibCodec, 'orjson': OrjsonCodec, 'ujson': UjsonCodec}
+
+# tried by ``auto``, fastest first
+PREFERENCE = ('orjson', 'ujson', 'json')
+
+
+def get_codec(codec='json'):
+    """
+    :param codec: optional -- ``json``, ``orjson``, ``ujson``, ``auto`` or
+                  a codec
+    :type codec: str or object
+    :returns: object -- the codec
+
+    ``auto`` returns the first codec of :data:`PREFERENCE` whose library is
+    installed.
+    """
+    if not isinstance(codec, basestring):
+        return codec
+    if codec == 'auto':
+        for name in PREFERENCE:
+            try:
+                return CODECS[name]()
+            except ImportError:
+                pass
+    try:
+        return CODECS[codec]()
+    except KeyError:
+        raise scorched.exc.SolrError("Unsupported json codec %s" % codec)
@@ -0,0 +1,245 @@
+"""
+Parallel export of a result set split into disjoint partitions.
+
+Every partition is exported by a worker thread or process which parses the
+response and hands the documents over in batches through a bounded queue.
+The queue provides back-pressure: workers block once ``queue_size`` batches
+are waiting, so memory use is bounded however large the result set is.
+"""
+from __future__ import unicode_literals
+import heapq
+import multiprocessing
+import requests
+import threading
+import scorched.exc
+import scorched.response
+
+from scorched.compat import queue
+
+
+# seconds a blocked thread waits before checking whether it was cancelled
+POLL_INTERVAL = 0.1
+
+
+def fetch_export(url, params, codecs=(), timeout=None, headers=None,
+                 chunk_size=64 * 1024):
+    """
+    Export without a :class:`scorched.connection.SolrConnection`, used by
+    worker processes which cannot share the connection of the parent.
+    """
+    response = requests.get(url, params=params, timeout=timeout,
+                            headers=headers, stream=True)
+    if response.status_code != 200:
+        raise scorched.exc.SolrError(response)
+    try:
+        for doc in scorched.response.ExportSolrResponse(
+                response.iter_content(chunk_size), codecs):
+            yield doc
+    finally:
+        response.close()
+
+
+def put_unless_stopped(out, item, stop):
+    """
+    Put ``item`` on the bounded queue ``out``, waiting for room until the
+    event ``stop`` is set.
+
+    :returns: bool -- whether ``item`` was put
+    """
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _work(indexes, partitions, outs, stop, batch_size, in_process):
+    """
+    Export the partitions at ``indexes`` one after the other. Batches of
+    documents are put on the output queue of the partition, followed by
+    ``None`` when it is complete or the exception that ended it.
+    """
+    for index in indexes:
+        if stop.is_set():
+            return
+        out = outs[index]
+        try:
+            batch = []
+            for doc in partitions[index]():
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    if not put_unless_stopped(out, (index, batch), stop):
+                        return
+                    batch = []
+            if batch and not put_unless_stopped(out, (index, batch), stop):
+                return
+            put_unless_stopped(out, (index, None), stop)
+        except Exception as e:
+            if in_process:
+                # the original exception may not survive pickling
+                e = scorched.exc.SolrError("Export of partition %s failed: "
+                                           "%s" % (index, e))
+            put_unless_stopped(out, (index, e), stop)
+            return
+
+
+class _Descending(object):
+    """
+    Sort key wrapper reversing the order of a value.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def sort_key(sort_fields):
+    """
+    :param sort_fields: ``[order, field]`` pairs as in
+                        :class:`scorched.search.SortOptions`
+    :type sort_fields: list
+    :returns: callable -- key function ordering documents like solr, missing
+              values last
+    """
+    def key(doc):
+        ret = []
+        for order, field in sort_fields:
+            value = doc.get(field)
+            if isinstance(value, list):
+                value = value[0] if value else None
+            if value is None:
+                ret.append((1, None))
+            elif order == 'desc':
+                ret.append((0, _Descending(value)))
+            else:
+                ret.append((0, value))
+        return ret
+    return key
+
+
+class ParallelExport(object):
+    """
+    Run the exports of ``partitions`` in a pool of ``workers`` and yield
+    their documents.
+
+    Without ``key`` documents are yielded in the order they arrive. With a
+    ``key`` the already sorted partitions are merged; all partitions must be
+    consumed at the same time then, so there are at least as many workers
+    as partitions.
+    """
+
+    def __init__(self, partitions, workers=None, key=None, processes=False,
+                 batch_size=500, queue_size=4):
+        """
+        :param partitions: callables returning an iterable of documents
+        :type partitions: list
+        :param workers: optional -- number of threads or processes, defaults
+                        to one per partition
+        :type workers: int
+        :param key: optional -- sort key to merge the partitions by
+        :type key: callable
+        :param processes: optional -- use processes instead of threads, the
+                          partitions must be picklable then
+        :type processes: bool
+        :param batch_size: optional -- documents handed over at once
+        :type batch_size: int
+        :param queue_size: optional -- batches waiting per queue before the
+                           workers block
+        :type queue_size: int
+        """
+        self.partitions = list(partitions)
+        self.workers = min(workers or len(self.partitions),
+                           len(self.partitions))
+        self.key = key
+        if key is not None:
+            self.workers = len(self.partitions)
+        self.processes = processes
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+
+    def __iter__(self):
+        if not self.partitions:
+            return
+        if self.processes:
+            Queue, Event = multiprocessing.Queue, multiprocessing.Event
+            Worker = multiprocessing.Process
+        else:
+            Queue, Event, Worker = queue.Queue, threading.Event, \
+                threading.Thread
+        stop = Event()
+        if self.key is None:
+            shared = Queue(self.queue_size * self.workers)
+            outs = [shared] * len(self.partitions)
+        else:
+            outs = [Queue(self.queue_size) for _ in self.partitions]
+        workers = []
+        indexes = list(range(len(self.partitions)))
+        for number in range(self.workers):
+            worker = Worker(target=_work, args=(
+                indexes[number::self.workers], self.partitions, outs, stop,
+                self.batch_size, self.processes))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        try:
+            if self.key is None:
+                for doc in self._unordered(outs[0]):
+                    yield doc
+            else:
+                for doc in self._merged(outs):
+                    yield doc
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join(1)
+                if self.processes and worker.is_alive():
+                    worker.terminate()
+
+    def _unordered(self, out):
+        pending = len(self.partitions)
+        while pending:
+            index, item = out.get()
+            if item is None:
+                pending -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                for doc in item:
+                    yield doc
+
+    def _partition(self, out):
+        while True:
+            index, item = out.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            for doc in item:
+                yield doc
+
+    def _merged(self, outs):
+        key = self.key
+        heap = []
+        streams = [self._partition(out) for out in outs]
+        for index, stream in enumerate(streams):
+            for doc in stream:
+                heap.append((key(doc), index, doc))
+                break
+        heapq.heapify(heap)
+        while heap:
+            _, index, doc = heap[0]
+            yield doc
+            for doc in streams[index]:
+                heapq.heapreplace(heap, (key(doc), index, doc))
+                break
+            else:
+                heapq.heappop(heap)
+
@@ -0,0 +1,192 @@
+from __future__ import unicode_literals
+import random
+import threading
+import time
+
+
+class Node(object):
+    """
+    A single solr replica together with the statistics used to pick it.
+    """
+
+    def __init__(self, url):
+        self.url = url.rstrip("/") + "/"
+        # exponentially weighted moving average of the latency in seconds,
+        # None until the first request finished
+        self.latency = None
+        self.in_flight = 0
+        self.failures = 0
+        self.healthy = True
+        self.ejected_at = None
+
+    def score(self, unmeasured=1.0):
+        """
+        :param unmeasured: optional -- latency assumed until the node was
+                           measured
+        :type unmeasured: float
+        :returns: float -- expected latency of the next request, lower is
+                  better
+        """
+        latency = self.latency
+        if latency is None:
+            latency = unmeasured
+        return latency * (self.in_flight + 1)
+
+    def __repr__(self):
+        return "Node(%r, latency=%r, healthy=%r)" % (
+            self.url, self.latency, self.healthy)
+
+
+class ReplicaSet(object):
+    """
+    A set of replicas serving the same index.
+
+    Reads are spread over the healthy nodes with the "power of two choices"
+    strategy: two random nodes are compared and the one with the lower
+    EWMA latency (weighted by its in-flight requests) wins. A node failing
+    ``max_failures`` times in a row is ejected; a background thread probes
+    ejected nodes every ``check_interval`` seconds and re-admits them as
+    soon as the probe succeeds.
+    """
+
+    def __init__(self, urls, decay=0.3, max_failures=3, check_interval=10,
+                 probe=None):
+        """
+        :param urls: base urls of the replicas
+        :type urls: list
+        :param decay: optional -- weight of a new latency sample in the EWMA
+        :type decay: float
+        :param max_failures: optional -- consecutive failures until a node is
+                             ejected
+        :type max_failures: int
+        :param check_interval: optional -- seconds between health probes of
+                               ejected nodes, ``None`` disables the probes
+        :type check_interval: float
+        :param probe: optional -- callable taking a node and returning
+                      ``True`` if it is healthy
+        :type probe: callable
+        """
+        if not urls:
+            raise ValueError("At least one replica url is needed")
+        self.nodes = [Node(url) for url in urls]
+        self.decay = decay
+        self.max_failures = max_failures
+        self.check_interval = check_interval
+        self.probe = probe
+        self._lock = threading.Lock()
+        self._checker = None
+        self._stopped = threading.Event()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def select(self, exclude=()):
+        """
+        :param exclude: optional -- nodes that should not be picked
+        :type exclude: list
+        :returns: Node
+
+        Pick the node for the next read request and count it as in flight.
+        """
+        with self._lock:
+            candidates = [n for n in self.nodes
+                          if n.healthy and n not in exclude]
+            if not candidates:
+                # every node is ejected, fail open on the longest ejected
+                candidates = sorted(
+                    [n for n in self.nodes if n not in exclude] or self.nodes,
+                    key=lambda n: n.ejected_at or 0)[:1]
+            if len(candidates) > 2:
+                candidates = random.sample(candidates, 2)
+            unmeasured = self._unmeasured_latency()
+            # on a tie the unknown node wins so that it gets measured
+            node = min(candidates, key=lambda n: (
+                n.score(unmeasured), n.latency is not None))
+            node.in_flight += 1
+            return node
+
+    def _unmeasured_latency(self):
+        # nodes not measured yet (e.g. just readmitted) are assumed to be
+        # as fast as the average node, so their requests in flight count
+        # and concurrent requests are not all sent to them
+        measured = [n.latency for n in self.nodes if n.latency is not None]
+        if not measured:
+            return 1.0
+        return sum(measured) / len(measured)
+
+    def release(self, node, elapsed=None, failed=False):
+        """
+        :param node: node returned by :meth:`select`
+        :type node: Node
+        :param elapsed: optional -- duration of the request in seconds
+        :type elapsed: float
+        :param failed: optional -- whether the request failed
+        :type failed: bool
+
+        Report the outcome of a request sent to ``node``.
+        """
+        with self._lock:
+            node.in_flight -= 1
+            # a timed out request counts with the time it was waited for
+            if elapsed is not None:
+                if node.latency is None:
+                    node.latency = elapsed
+                else:
+                    node.latency = (self.decay * elapsed +
+                                    (1 - self.decay) * node.latency)
+            if failed:
+                node.failures += 1
+                if node.healthy and node.failures >= self.max_failures:
+                    node.healthy = False
+                    node.ejected_at = time.time()
+                    self._start_checker()
+                return
+            node.failures = 0
+
+    def readmit(self, node):
+        with self._lock:
+            node.healthy = True
+            node.failures = 0
+            node.ejected_at = None
+            # start measuring again from scratch
+            node.latency = None
+
+    def check(self):
+        """
+        Probe all ejected nodes once and re-admit the healthy ones.
+        """
+        for node in [n for n in self.nodes if not n.healthy]:
+            try:
+                ok = self.probe(node)
+            except Exception:
+                ok = False
+            if ok:
+                self.readmit(node)
+
+    def _start_checker(self):
+        if (self.probe is None or self.check_interval is None or
+                self._stopped.is_set()):
+            return
+        if self._checker is not None:
+            return
+        self._checker = threading.Thread(target=self._run_checker,
+                                         name="scorched-health-check")
+        self._checker.daemon = True
+        self._checker.start()
+
+    def _run_checker(self):
+        while not self._stopped.wait(self.check_interval):
+            self.check()
+            with self._lock:
+                if all(n.healthy for n in self.nodes):
+                    self._checker = None
+                    return
+
+    def stop(self):
+        """
+        Stop the background health probes.
+        """
+        self._stopped.set()
@@ -1,7 +1,10 @@
 from __future__ import unicode_literals
+import codecs
 import collections
 import json
 import scorched.dates
+import scorched.fields
+import scorched.javabin
 
 from scorched.compat import str
 
@@ -53,24 +56,21 @@ class SolrFacetCounts(object):
         return SolrFacetCounts(**facet_counts)
 
 
-class SolrResponse(collections.Sequence):
+class BaseSolrResponse(object):
+    """
+    Parsing of the parts shared by complete and streamed responses.
+    """
 
-    @classmethod
-    def from_json(cls, jsonmsg, datefields=()):
-        self = cls()
-        self.original_json = jsonmsg
-        doc = json.loads(jsonmsg)
+    def _parse_header(self, doc):
         details = doc['responseHeader']
         for attr in ["QTime", "params", "status"]:
             setattr(self, attr, details.get(attr))
+        # set if solr stopped early because of timeAllowed
+        self.partialResults = bool(details.get("partialResults", False))
         if self.status != 0:
             raise ValueError("Response indicates an error")
-        self.result = SolrResult()
-        if doc.get('response'):
-            self.result = SolrResult.from_json(doc['response'], datefields)
-        # TODO mlt/ returns match what should we do with it ?
-        # if doc.get('match'):
-        #    self.result = SolrResult.from_json(doc['match'], datefields)
+
+    def _parse_components(self, doc, datefields):
         self.facet_counts = SolrFacetCounts.from_json(doc)
         self.highlighting = doc.get("highlighting", {})
         self.spellcheck = doc.get("spellcheck", {})
@@ -81,8 +81,63 @@ class SolrResponse(collections.Sequence):
             for (k, v) in list(doc.get('moreLikeThis', {}).items()))
         # can be computed by MoreLikeThisHandler
         self.interesting_terms = doc.get('interestingTerms', None)
+        # set if the search was sent with a cursorMark
+        self.nextCursorMark = doc.get('nextCursorMark', None)
+
+
+class SolrResponse(BaseSolrResponse, collections.Sequence):
+    # body of a json response, decoded on first access
+    _original_json = None
+
+    @classmethod
+    def from_json(cls, jsonmsg, datefields=(), loads=json.loads):
+        """
+        :param jsonmsg: body of a json response, text or bytes
+        :type jsonmsg: str or bytes
+        :param datefields: optional -- field codecs or names of date fields
+        :type datefields: scorched.fields.FieldCodecs or tuple
+        :param loads: optional -- parses ``jsonmsg``, e.g. ``loads`` of a
+                      :mod:`scorched.jsoncodec` codec
+        :type loads: callable
+        """
+        self = cls()
+        self._original_json = jsonmsg
+        self._parse(loads(jsonmsg), datefields)
         return self
 
+    @classmethod
+    def from_javabin(cls, data, datefields=()):
+        """
+        :param data: body of a ``wt=javabin`` response
+        :type data: bytes
+        :param datefields: optional -- ignored, javabin dates are decoded to
+                           datetimes already
+        :type datefields: tuple
+        """
+        self = cls()
+        self._parse(scorched.javabin.loads(data), ())
+        return self
+
+    @property
+    def original_json(self):
+        """
+        :returns: str -- body of a json response as text, None for a
+                  javabin response
+        """
+        if isinstance(self._original_json, bytes):
+            self._original_json = self._original_json.decode('utf-8')
+        return self._original_json
+
+    def _parse(self, doc, datefields):
+        self._parse_header(doc)
+        self.result = SolrResult()
+        if doc.get('response'):
+            self.result = SolrResult.from_json(doc['response'], datefields)
+        # TODO mlt/ returns match what should we do with it ?
+        # if doc.get('match'):
+        #    self.result = SolrResult.from_json(doc['match'], datefields)
+        self._parse_components(doc, datefields)
+
     def __str__(self):
         return str(self.result)
 
@@ -106,6 +161,13 @@ class SolrResult(object):
         return self
 
     def _prepare_docs(self, docs, datefields):
+        """
+        :param datefields: :class:`scorched.fields.FieldCodecs` of the schema
+                           or names and suffixes of date fields
+        :type datefields: FieldCodecs or tuple
+        """
+        if isinstance(datefields, scorched.fields.FieldCodecs):
+            return datefields.decode_docs(docs)
         for doc in docs:
             for name, value in list(doc.items()):
                 if name in datefields:
@@ -117,3 +179,210 @@ class SolrResult(object):
     def __str__(self):
         return "{numFound} results found, starting at #{start}".format(
             numFound=self.numFound, start=self.start)
+
+
+class JSONStreamReader(object):
+    """
+    Pull parser over a json document arriving in chunks of bytes.
+
+    Only the structure that is walked explicitly (``start_object``,
+    ``next_key``, ...) is parsed incrementally; every other value is decoded
+    as a whole with ``raw_decode``. The buffer therefore holds at most the
+    largest single value plus one chunk.
+    """
+    whitespace = ' \t\n\r'
+
+    def __init__(self, chunks, encoding='utf-8'):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.json_decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        if self.eof:
+            return False
+        # drop everything consumed so far
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        for chunk in self.chunks:
+            text = self.decoder.decode(chunk)
+            if text:
+                self.buf += text
+                return True
+        self.buf += self.decoder.decode(b'', True)
+        self.eof = True
+        return False
+
+    def _grow(self):
+        # read until the unconsumed part at least doubled, so that decoding
+        # a value spread over many chunks stays linear
+        target = 2 * (len(self.buf) - self.pos) + 1
+        while len(self.buf) - self.pos < target:
+            if not self._fill():
+                return
+
+    def peek(self):
+        """
+        :returns: the next non whitespace character or '' at the end
+        """
+        while True:
+            while (self.pos < len(self.buf) and
+                   self.buf[self.pos] in self.whitespace):
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError("Expected %r at %s, got %r" % (
+                chars, self.pos, c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        """
+        :returns: the next json value decoded completely
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self.eof:
+                    raise
+                self._grow()
+                continue
+            if end == len(self.buf) and not self.eof:
+                # a number might continue in the next chunk
+                self._grow()
+                continue
+            self.pos = end
+            return value
+
+    def keys(self):
+        """
+        Iterate over the keys of the object starting at the current
+        position. The caller has to consume the value of each key.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def items(self):
+        """
+        Iterate over the elements of the array starting at the current
+        position.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+class StreamingSolrResponse(BaseSolrResponse):
+    """
+    A select response parsed while it is read from the socket.
+
+    Iterating yields the documents of ``response.docs`` one by one, so that
+    only a single document is held in memory at a time. The response header
+    (``status``, ``QTime``, ``params``, ``partialResults``) as well as
+    ``numFound`` and ``start`` are available right away. Everything solr
+    writes after the documents (``facet_counts``, ``highlighting``, ...) is
+    available once the documents are consumed; accessing it earlier skips
+    the remaining documents.
+    """
+    component_attrs = ("facet_counts", "highlighting", "spellcheck",
+                       "groups", "debug", "more_like_these",
+                       "interesting_terms")
+
+    def __init__(self, chunks, datefields=(), constructor=None,
+                 result_key='response'):
+        self.reader = JSONStreamReader(chunks)
+        self.datefields = datefields
+        self.constructor = constructor
+        self.result_key = result_key
+        self.result = SolrResult()
+        self._components = {}
+        self._finished = False
+        self._events = self._parse()
+        # parse up to the first document
+        next(self._events, None)
+
+    def _parse(self):
+        reader = self.reader
+        for key in reader.keys():
+            if key == 'responseHeader':
+                self._parse_header({key: reader.value()})
+            elif key == self.result_key:
+                for result_key in reader.keys():
+                    if result_key == 'docs':
+                        # pause before the first document
+                        yield
+                        for doc in reader.items():
+                            yield doc
+                    else:
+                        setattr(self.result, result_key, reader.value())
+            else:
+                self._components[key] = reader.value()
+        self._finished = True
+        self._parse_components(self._components, self.datefields)
+        self._components = None
+
+    @property
+    def numFound(self):
+        return getattr(self.result, 'numFound', None)
+
+    @property
+    def start(self):
+        return getattr(self.result, 'start', None)
+
+    def __iter__(self):
+        for doc in self._events:
+            if doc is None:
+                continue
+            doc = self.result._prepare_docs([doc], self.datefields)[0]
+            if self.constructor is not None:
+                doc = self.constructor(**doc)
+            yield doc
+
+    def __getattr__(self, name):
+        if name in self.component_attrs and not self.__dict__.get(
+                '_finished', True):
+            for _ in self._events:
+                pass
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def __str__(self):
+        return "{numFound} results found, starting at #{start}".format(
+            numFound=self.numFound, start=self.start)
+
+
+class ExportSolrResponse(StreamingSolrResponse):
+    """
+    A response of the export handler. Errors found by solr after the export
+    started are reported as a document with an ``EXCEPTION`` field, they are
+    raised instead.
+    """
+
+    def _parse(self):
+        for event in super(ExportSolrResponse, self)._parse():
+            if isinstance(event, dict) and 'EXCEPTION' in event:
+                raise ValueError(event['EXCEPTION'])
+            yield event
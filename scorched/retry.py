@@ -0,0 +1,251 @@
+from __future__ import unicode_literals
+import email.utils
+import random
+import requests
+import threading
+import time
+import scorched.exc
+
+try:
+    from requests.packages.urllib3.exceptions import NewConnectionError
+except ImportError:  # pragma: no cover
+    NewConnectionError = ()
+
+
+def request_not_sent(exc):
+    """
+    :param exc: exception raised by requests
+    :type exc: Exception
+    :returns: bool -- whether the request surely never reached solr
+
+    Only such requests can be repeated safely if they are not idempotent.
+    """
+    if isinstance(exc, (requests.exceptions.ConnectTimeout,
+                        scorched.exc.CircuitOpenError)):
+        return True
+    reason = getattr(exc.args[0] if exc.args else None, 'reason', None)
+    return isinstance(reason, NewConnectionError)
+
+
+class RetryPolicy(object):
+    """
+    Decides whether and when a failed request is repeated.
+
+    Connection errors and timeouts are retried for idempotent requests
+    (searches). Updates are only retried if the request never left the
+    client (e.g. connection refused) or solr rejected it with one of
+    ``retry_statuses``, unless ``retry_non_idempotent`` is set. Backoff is
+    exponential with "full jitter" so that waiting clients do not stampede
+    at the same moment; a ``Retry-After`` header overrides the computed
+    delay.
+    """
+    retry_exceptions = (requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout)
+
+    def __init__(self, max_attempts=3, backoff=0.1, multiplier=2,
+                 max_backoff=10, jitter=True, retry_statuses=(429, 503),
+                 respect_retry_after=True, retry_non_idempotent=False):
+        """
+        :param max_attempts: optional -- attempts including the first one
+        :type max_attempts: int
+        :param backoff: optional -- delay before the first retry in seconds
+        :type backoff: float
+        :param multiplier: optional -- growth of the delay per attempt
+        :type multiplier: float
+        :param max_backoff: optional -- upper bound of a delay, a longer
+                            ``Retry-After`` gives up instead of waiting
+        :type max_backoff: float
+        :param jitter: optional -- randomize the delay between 0 and the
+                       computed backoff
+        :type jitter: bool
+        :param retry_statuses: optional -- http status codes worth retrying
+        :type retry_statuses: tuple
+        :param respect_retry_after: optional -- honor ``Retry-After``
+        :type respect_retry_after: bool
+        :param retry_non_idempotent: optional -- retry updates on any
+                                     connection error
+        :type retry_non_idempotent: bool
+        """
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be 1 or greater")
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.multiplier = multiplier
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_statuses = tuple(retry_statuses)
+        self.respect_retry_after = respect_retry_after
+        self.retry_non_idempotent = retry_non_idempotent
+
+    @classmethod
+    def from_retry_timeout(cls, retry_timeout):
+        """
+        The policy of the ``retry_timeout`` argument: one retry after a
+        fixed delay on connection errors, a negative value disables retries.
+        """
+        if retry_timeout < 0:
+            return cls(max_attempts=1)
+        policy = cls(max_attempts=2, backoff=retry_timeout, multiplier=1,
+                     max_backoff=retry_timeout, jitter=False,
+                     retry_statuses=(), retry_non_idempotent=True)
+        policy.retry_exceptions = (requests.exceptions.ConnectionError,)
+        return policy
+
+    def delay(self, attempt):
+        """
+        :param attempt: number of the failed attempt, starting with 1
+        :type attempt: int
+        :returns: float -- seconds to wait before the next attempt
+        """
+        delay = min(self.max_backoff,
+                    self.backoff * self.multiplier ** (attempt - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def retry_after(self, response):
+        """
+        :returns: float -- seconds requested by a ``Retry-After`` header or
+                  None
+        """
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        parsed = email.utils.parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(0.0, email.utils.mktime_tz(parsed) - time.time())
+
+    def backoff_for(self, attempt, idempotent, exception=None, response=None):
+        """
+        :param attempt: number of the failed attempt, starting with 1
+        :type attempt: int
+        :param idempotent: whether the request may be repeated
+        :type idempotent: bool
+        :param exception: optional -- exception raised by the attempt
+        :type exception: Exception
+        :param response: optional -- response of the attempt
+        :type response: requests.Response
+        :returns: float -- seconds to wait before retrying, None to give up
+        """
+        if attempt >= self.max_attempts:
+            return None
+        if exception is not None:
+            if isinstance(exception, scorched.exc.CircuitOpenError):
+                return None
+            if not isinstance(exception, self.retry_exceptions):
+                return None
+            if not (idempotent or self.retry_non_idempotent or
+                    request_not_sent(exception)):
+                return None
+            return self.delay(attempt)
+        if response.status_code not in self.retry_statuses:
+            return None
+        # 429 and 503 are rejected before solr processes the request, so
+        # they are retried for updates as well
+        delay = self.delay(attempt)
+        if self.respect_retry_after:
+            retry_after = self.retry_after(response)
+            if retry_after is not None:
+                if retry_after > self.max_backoff:
+                    return None
+                delay = retry_after
+        return delay
+
+
+class CircuitBreaker(object):
+    """
+    Per node circuit breaker.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    requests fail immediately with :class:`scorched.exc.CircuitOpenError`
+    instead of blocking on a struggling node. After ``reset_timeout``
+    seconds a single trial request is let through (half open); its outcome
+    closes or reopens the circuit.
+
+    The instance passed to ``SolrInterface`` is a template, every node gets
+    its own clone.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, original=None):
+        """
+        :param failure_threshold: optional -- consecutive failures until the
+                                  circuit opens
+        :type failure_threshold: int
+        :param reset_timeout: optional -- seconds until a trial request is
+                              allowed on an open circuit
+        :type reset_timeout: float
+        """
+        if original is not None:
+            failure_threshold = original.failure_threshold
+            reset_timeout = original.reset_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        # number of the trial request in flight
+        self._trial = None
+        self._trials = 0
+        self._lock = threading.Lock()
+
+    def clone(self):
+        return self.__class__(original=self)
+
+    def before_request(self):
+        """
+        :returns: int -- number of the trial request if the request is the
+                  trial of a half open circuit, else None
+
+        Raise :class:`scorched.exc.CircuitOpenError` if the request must not
+        be sent.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return None
+            if self.state == self.OPEN:
+                if time.time() - self.opened_at < self.reset_timeout:
+                    raise scorched.exc.CircuitOpenError(
+                        "Circuit open since %s failures" % self.failures)
+                self.state = self.HALF_OPEN
+                self._trial = None
+            if self._trial is not None:
+                raise scorched.exc.CircuitOpenError(
+                    "Circuit half open, trial request in flight")
+            self._trials += 1
+            self._trial = self._trials
+            return self._trial
+
+    def release_trial(self, trial):
+        """
+        :param trial: number returned by :meth:`before_request`
+        :type trial: int
+
+        Let the next request be the trial if ``trial`` ended without a
+        recorded outcome, e.g. because it was interrupted.
+        """
+        with self._lock:
+            if trial is not None and self._trial == trial:
+                self._trial = None
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = None
+            if (self.state == self.HALF_OPEN or
+                    self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = time.time()
@@ -2,6 +2,7 @@ from __future__ import unicode_literals
 import collections
 import copy
 import datetime
+import functools
 import numbers
 import operator
 import re
@@ -382,7 +383,8 @@ class BaseSearch(object):
                       'more_like_this', 'highlighter', 'postings_highlighter',
                       'faceter', 'grouper', 'sorter', 'facet_querier',
                       'debugger', 'spellchecker', 'requesthandler',
-                      'field_limiter', 'parser', 'pivoter', 'facet_ranger')
+                      'field_limiter', 'parser', 'pivoter', 'facet_ranger',
+                      'time_limiter', 'response_formatter', 'cacher')
 
     def _init_common_modules(self):
         self.query_obj = LuceneQuery(u'q')
@@ -401,6 +403,9 @@ class BaseSearch(object):
         self.field_limiter = FieldLimitOptions()
         self.facet_ranger = FacetRangeOptions()
         self.facet_querier = FacetQueryOptions()
+        self.time_limiter = DeadlineOptions()
+        self.response_formatter = ResponseFormatOption()
+        self.cacher = CacheOptions()
 
     def clone(self):
         return self.__class__(interface=self.interface, original=self)
@@ -522,6 +527,16 @@ class BaseSearch(object):
         newself.requesthandler.update(handler)
         return newself
 
+    def cache(self, ttl):
+        newself = self.clone()
+        newself.cacher.update(ttl)
+        return newself
+
+    def response_format(self, wt):
+        newself = self.clone()
+        newself.response_formatter.update(wt)
+        return newself
+
     def sort_by(self, field):
         newself = self.clone()
         newself.sorter.update(field)
@@ -532,6 +547,11 @@ class BaseSearch(object):
         newself.field_limiter.update(fields, score, all_fields)
         return newself
 
+    def deadline(self, seconds, segment_terminate_early=False):
+        newself = self.clone()
+        newself.time_limiter.update(seconds, segment_terminate_early)
+        return newself
+
     def options(self):
         options = {}
         for option_module in self.option_modules:
@@ -548,11 +568,16 @@ class BaseSearch(object):
         return params_from_dict(**self.options())
 
     def constructor(self, result, constructor):
-        construct_docs = lambda docs: [constructor(**d) for d in docs]
-        result.result.docs = construct_docs(result.result.docs)
-        for key in result.more_like_these:
-            result.more_like_these[key].docs = construct_docs(
-                result.more_like_these[key].docs)
+        # build a new response, the parsed one may be shared by a cache
+        def construct(res):
+            res = copy.copy(res)
+            res.docs = [constructor(**d) for d in res.docs]
+            return res
+        result = copy.copy(result)
+        result.result = construct(result.result)
+        result.more_like_these = dict(
+            (key, construct(value))
+            for key, value in result.more_like_these.items())
         return result
 
 
@@ -576,11 +601,217 @@ class SolrSearch(BaseSearch):
         return options
 
     def execute(self, constructor=None):
-        ret = self.interface.search(**self.options())
+        ret = self.interface.search(deadline=self.time_limiter.seconds,
+                                    cache_ttl=self.cacher.ttl,
+                                    **self.options())
         if constructor:
             ret = self.constructor(ret, constructor)
         return ret
 
+    def stream(self, constructor=None):
+        """
+        :returns: StreamingSolrResponse -- documents are parsed one by one
+                  while they are read from the socket
+        """
+        ret = self.interface.search(deadline=self.time_limiter.seconds,
+                                    stream=True, **self.options())
+        ret.constructor = constructor
+        return ret
+
+    def cursor_pages(self, page_size=100, constructor=None):
+        """
+        :param page_size: optional -- documents per request
+        :type page_size: int
+        :param constructor: optional -- see :meth:`execute`
+        :type constructor: callable
+        :returns: generator of SolrResponse -- one response per page
+
+        Walk through all results with solr's ``cursorMark`` instead of
+        growing ``start`` offsets. Each page costs solr the same, however
+        deep it is, and only one page is held in memory at a time.
+        """
+        search = self._cursor_search(page_size)
+        options = search._cursor_options()
+        cursor = '*'
+        while True:
+            ret = self.interface.search(deadline=search.time_limiter.seconds,
+                                        cursorMark=cursor, cache_ttl=0,
+                                        **options)
+            if constructor:
+                ret = self.constructor(ret, constructor)
+            yield ret
+            # the cursor stops moving after the last page
+            if ret.nextCursorMark in (None, cursor):
+                return
+            cursor = ret.nextCursorMark
+
+    def iter_cursor(self, page_size=100, constructor=None):
+        """
+        :returns: generator -- all documents of the result set, see
+                  :meth:`cursor_pages`
+        """
+        for page in self.cursor_pages(page_size, constructor):
+            for doc in page.result.docs:
+                yield doc
+
+    def export(self, fields=None, sort=None, constructor=None):
+        """
+        :param fields: optional -- fields to export, added to those of
+                       :meth:`field_limit`
+        :type fields: list
+        :param sort: optional -- sort fields like for :meth:`sort_by`,
+                     added to those of :meth:`sort_by`, defaults to the
+                     unique key
+        :type sort: list
+        :param constructor: optional -- see :meth:`execute`
+        :type constructor: callable
+        :returns: ExportSolrResponse -- iterating yields every matching
+                  document
+
+        Dump the whole result set with solr's export handler. Unlike
+        paging through select it neither scores nor fills the query result
+        cache. All exported and sort fields must use docValues, this is
+        checked against the schema before sending the request.
+        """
+        newself = self._export_search(fields, sort)
+        options = newself.options()
+        # the export handler always returns all documents
+        for name in ('start', 'rows', 'wt'):
+            options.pop(name, None)
+        ret = self.interface.export(deadline=newself.time_limiter.seconds,
+                                    **options)
+        ret.constructor = constructor
+        return ret
+
+    def parallel_export(self, fields=None, sort=None, partitions=4,
+                        workers=None, shards=None, ordered=False,
+                        processes=False, batch_size=500, queue_size=4,
+                        constructor=None):
+        """
+        :param fields: optional -- see :meth:`export`
+        :type fields: list
+        :param sort: optional -- see :meth:`export`
+        :type sort: list
+        :param partitions: optional -- number of slices of the result set
+        :type partitions: int
+        :param workers: optional -- slices exported at the same time,
+                        defaults to ``partitions``
+        :type workers: int
+        :param shards: optional -- urls of the cores holding the shards of
+                       the index, each shard is one slice then
+        :type shards: list
+        :param ordered: optional -- merge the slices in sort order, all
+                        slices are exported at the same time then
+        :type ordered: bool
+        :param processes: optional -- export and parse in worker processes
+                          instead of threads
+        :type processes: bool
+        :param batch_size: optional -- documents handed over at once
+        :type batch_size: int
+        :param queue_size: optional -- batches buffered per worker before
+                           it waits for the consumer
+        :type queue_size: int
+        :param constructor: optional -- see :meth:`execute`
+        :type constructor: callable
+        :returns: generator -- every matching document
+
+        Like :meth:`export` but the result set is split into disjoint slices
+        exported concurrently, see :class:`scorched.parallel.ParallelExport`.
+        Slices are built with a hash filter on the unique key or from the
+        shards. Worker processes use plain requests without the retry and
+        balancing of the connection.
+        """
+        import scorched.parallel
+        newself = self._export_search(fields, sort)
+        if shards:
+            slices = [(newself, shard.rstrip("/") + "/") for shard in shards]
+        else:
+            slices = []
+            for worker in range(partitions):
+                search = newself.clone()
+                # solr's hash query parser selects the documents whose
+                # partition key hashes to this worker
+                search.filter_obj.add([scorched.strings.DismaxString(
+                    "{!hash workers=%s worker=%s partitionKeys=%s}" % (
+                        partitions, worker, self.interface.unique_key))], {})
+                slices.append((search, None))
+        exports = []
+        for search, base_url in slices:
+            options = search.options()
+            for name in ('start', 'rows', 'wt'):
+                options.pop(name, None)
+            if base_url is not None:
+                options['distrib'] = False
+            deadline = search.time_limiter.seconds
+            if processes:
+                conn = self.interface.conn
+                exports.append(functools.partial(
+                    scorched.parallel.fetch_export,
+                    (base_url or conn.url) + "export",
+                    params_from_dict(**dict(options, wt='json')),
+                    self.interface.field_codecs,
+                    deadline or conn.timeout,
+                    conn._accept_encoding({}).get('headers')))
+            else:
+                exports.append(functools.partial(
+                    self.interface.export, deadline=deadline,
+                    base_url=base_url, **options))
+        key = None
+        if ordered:
+            key = scorched.parallel.sort_key(newself.sorter.fields)
+        for doc in scorched.parallel.ParallelExport(
+                exports, workers=workers, key=key, processes=processes,
+                batch_size=batch_size, queue_size=queue_size):
+            if constructor:
+                doc = constructor(**doc)
+            yield doc
+
+    def _export_search(self, fields, sort):
+        newself = self.clone()
+        if fields is not None:
+            newself.field_limiter.update(fields)
+        if sort is not None:
+            if not is_iter(sort):
+                sort = [sort]
+            for field in sort:
+                newself.sorter.update(field)
+        if not newself.sorter.fields:
+            newself.sorter.update(self.interface.unique_key)
+        limiter = newself.field_limiter
+        if not limiter.fields or limiter.score or limiter.all_fields:
+            raise scorched.exc.SolrError(
+                "export needs explicit fields, score and * are not allowed")
+        names = set(limiter.fields)
+        names.update(field for order, field in newself.sorter.fields)
+        missing = sorted(name for name in names
+                         if not self.interface.has_docvalues(name))
+        if missing:
+            raise scorched.exc.SolrError(
+                "export needs docValues fields, not: %s" % ", ".join(missing))
+        return newself
+
+    def _cursor_search(self, page_size):
+        if self.paginator.start:
+            raise scorched.exc.SolrError(
+                "start cannot be used together with a cursor")
+        newself = self.paginate(rows=page_size)
+        # a cursor needs a total order, the unique key breaks ties
+        unique_key = self.interface.unique_key
+        sorter = newself.sorter
+        if not sorter.fields:
+            # keep solr's default order
+            sorter.update('-score')
+        if unique_key not in [field for order, field in sorter.fields]:
+            sorter.update(unique_key)
+        return newself
+
+    def _cursor_options(self):
+        options = self.options()
+        # solr refuses timeAllowed together with cursorMark, the deadline
+        # is only enforced by the client
+        options.pop('timeAllowed', None)
+        return options
+
 
 class MltSolrSearch(BaseSearch):
 
@@ -654,7 +885,10 @@ class MltSolrSearch(BaseSearch):
         return options
 
     def execute(self, constructor=None):
-        ret = self.interface.mlt_search(content=self.content, **self.options())
+        ret = self.interface.mlt_search(content=self.content,
+                                        deadline=self.time_limiter.seconds,
+                                        cache_ttl=self.cacher.ttl,
+                                        **self.options())
         if constructor:
             ret = self.constructor(ret, constructor)
         return ret
@@ -1183,6 +1417,51 @@ class RequestHandlerOption(Options):
         return ret
 
 
+class CacheOptions(Options):
+    """
+    How long the response of a query is cached by the result cache of the
+    interface. It is not sent to solr.
+    """
+
+    def __init__(self, original=None):
+        if original is None:
+            # the ttl of the cache applies
+            self.ttl = None
+        else:
+            self.ttl = original.ttl
+
+    def update(self, ttl):
+        if ttl is not None and ttl < 0:
+            raise scorched.exc.SolrError("cache ttl must be 0 or greater")
+        self.ttl = ttl
+
+    def options(self):
+        return {}
+
+
+class ResponseFormatOption(Options):
+    option_name = "wt"
+
+    def __init__(self, original=None):
+        if original is None:
+            # the default of the interface applies
+            self.wt = None
+        else:
+            self.wt = original.wt
+
+    def update(self, wt):
+        if wt not in ('json', 'javabin'):
+            raise scorched.exc.SolrError(
+                "Unsupported response format %s" % wt)
+        self.wt = wt
+
+    def options(self):
+        ret = {}
+        if self.wt:
+            ret = {"wt": self.wt}
+        return ret
+
+
 class FieldLimitOptions(Options):
     option_name = "fl"
 
@@ -1218,6 +1497,42 @@ class FieldLimitOptions(Options):
         return opts
 
 
+class DeadlineOptions(Options):
+    """
+    End-to-end deadline of a query. The client gives up after ``seconds``
+    and solr is asked to stop collecting hits a bit earlier (timeAllowed),
+    so a truncated answer still arrives in time and is flagged by
+    ``SolrResponse.partialResults``.
+    """
+    option_name = "timeAllowed"
+    # share of the deadline solr may spend searching, the rest is left for
+    # writing and transferring the response
+    time_allowed_ratio = 0.9
+
+    def __init__(self, original=None):
+        if original is None:
+            self.seconds = None
+            self.segment_terminate_early = False
+        else:
+            self.seconds = original.seconds
+            self.segment_terminate_early = original.segment_terminate_early
+
+    def update(self, seconds, segment_terminate_early=False):
+        if seconds is not None and seconds <= 0:
+            raise scorched.exc.SolrError("deadline must be greater than 0")
+        self.seconds = seconds
+        self.segment_terminate_early = segment_terminate_early
+
+    def options(self):
+        opts = {}
+        if self.seconds is not None:
+            opts['timeAllowed'] = max(
+                1, int(self.seconds * 1000 * self.time_allowed_ratio))
+        if self.segment_terminate_early:
+            opts['segmentTerminateEarly'] = True
+        return opts
+
+
 class FacetQueryOptions(Options):
 
     def __init__(self, original=None):
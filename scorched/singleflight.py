@@ -0,0 +1,103 @@
+from __future__ import unicode_literals
+import threading
+import time
+import scorched.exc
+
+
+class Call(object):
+    """
+    A request in flight and the outcome it is shared with its followers.
+    """
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesce identical requests running at the same time.
+
+    The first caller with a key (the leader) runs the request, callers with
+    the same key arriving before it finished (the followers) wait for it and
+    receive the same result. If the leader fails the followers receive its
+    exception, unless the leader ran out of its own deadline: then the
+    followers run the request again, one of them becoming the new leader.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.leader_failures = 0
+
+    def do(self, key, func, deadline=None):
+        """
+        :param key: identifies identical requests
+        :type key: hashable
+        :param func: callable running the request
+        :type func: callable
+        :param deadline: optional -- point in time (``time.time()``) after
+                         which a follower stops waiting
+        :type deadline: float
+        :returns: the result of ``func`` of this or of the leading caller
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = Call()
+                    self.leaders += 1
+            if leader:
+                return self._lead(key, call, func)
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.time()
+            if ((timeout is not None and timeout <= 0) or
+                    not call.done.wait(timeout)):
+                raise scorched.exc.DeadlineExceeded("Deadline exceeded")
+            if call.error is None:
+                with self._lock:
+                    self.coalesced += 1
+                return call.result
+            if not self.retriable(call.error):
+                raise call.error
+
+    def _lead(self, key, call, func):
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self.leader_failures += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def retriable(self, error):
+        """
+        :returns: bool -- whether followers repeat the request instead of
+                  sharing the exception of the leader
+        """
+        # the deadline of the leader is not the deadline of its followers
+        return isinstance(error, scorched.exc.DeadlineExceeded)
+
+    def stats(self):
+        """
+        :returns: dict -- leaders, coalesced, leader_failures and in_flight
+        """
+        with self._lock:
+            return {'leaders': self.leaders, 'coalesced': self.coalesced,
+                    'leader_failures': self.leader_failures,
+                    'in_flight': len(self._calls)}
+
+    def __repr__(self):
+        return "SingleFlight(leaders=%s, coalesced=%s, leader_failures=%s)" % (
+            self.leaders, self.coalesced, self.leader_failures)
@@ -0,0 +1,346 @@
+from __future__ import unicode_literals
+import asyncio
+import datetime
+import json
+import os
+import pytz
+import requests
+import threading
+import unittest
+import scorched.cache
+import scorched.exc
+import scorched.indexing
+import scorched.javabin
+
+from scorched.aio import AsyncSolrInterface, TransportResponse
+from scorched.compat import urlsplit, parse_qsl
+
+
+SCHEMA = {"schema": {
+    "fields": [{"name": "id", "type": "string"},
+               {"name": "modified", "type": "date"}],
+    "dynamicFields": [{"name": "*_dt", "type": "date"}],
+}}
+
+
+class FakeTransport(object):
+    """
+    In-process stand-in for solr answering select/update/get/schema
+    requests.
+    """
+
+    def __init__(self, select_body, fail_connect=0, fail_hosts=()):
+        self.select_body = select_body
+        self.fail_connect = fail_connect
+        self.fail_hosts = fail_hosts
+        self.etag = None
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def request(self, method, url, data=None, headers=None, **kwargs):
+        if self.fail_connect:
+            self.fail_connect -= 1
+            raise requests.exceptions.ConnectionError("refused")
+        self.requests.append((method, url, data))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # give other coroutines a chance to run
+            await asyncio.sleep(0.01)
+        finally:
+            self.in_flight -= 1
+        path = urlsplit(url).path
+        if urlsplit(url).netloc in self.fail_hosts:
+            return TransportResponse(503, b'unavailable')
+        if path.endswith('/schema'):
+            body = json.dumps(SCHEMA)
+        elif path.endswith('/select/') or path.endswith('/mlt/'):
+            if self.etag is not None:
+                if (headers or {}).get('If-None-Match') == self.etag:
+                    return TransportResponse(304, b'')
+                return TransportResponse(200, self.select_body.encode(
+                    'utf-8'), {'ETag': self.etag})
+            body = self.select_body
+        elif path.endswith('/admin/ping'):
+            body = '{"status": "OK"}'
+        elif path.endswith('/update/json'):
+            body = '{"responseHeader": {"status": 0}}'
+        elif path.endswith('/get'):
+            ids = dict(parse_qsl(urlsplit(url).query))['ids'].split(',')
+            body = json.dumps({"response": {"numFound": len(ids), "docs": [
+                {"id": id, "modified": "2014-01-01T00:00:00Z"}
+                for id in ids]}})
+        else:
+            return TransportResponse(404, b'not found')
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        return TransportResponse(200, body)
+
+
+def run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+class TestAsyncSolrInterface(unittest.TestCase):
+
+    def setUp(self):
+        file = os.path.join(os.path.dirname(__file__), "dumps",
+                            "request_w_facets.json")
+        with open(file) as f:
+            self.data = f.read()
+        self.transport = FakeTransport(self.data)
+        self.si = AsyncSolrInterface("http://localhost:8983/solr",
+                                     transport=self.transport)
+
+    def test_search(self):
+        res = run(self.si.query(genre_s="fantasy").execute())
+        self.assertEqual(res.result.numFound, 3)
+        self.assertEqual(
+            [x['modified'] for x in res.result.docs if 'modified' in x],
+            [datetime.datetime(2009, 7, 23, 3, 24, 34, 376,
+                               tzinfo=pytz.utc)])
+        # schema is fetched once, lazily
+        methods = [(m, urlsplit(u).path) for m, u, d in
+                   self.transport.requests]
+        self.assertEqual(methods, [('GET', '/solr/schema'),
+                                   ('GET', '/solr/select/')])
+        params = dict(parse_qsl(urlsplit(self.transport.requests[1][1]).query))
+        self.assertEqual(params, {'q': 'genre_s:fantasy', 'wt': 'json'})
+
+    def test_concurrent_search(self):
+        async def many():
+            return await asyncio.gather(
+                *[self.si.query(id=i).execute() for i in range(50)])
+        responses = run(many())
+        self.assertEqual(len(responses), 50)
+        self.assertTrue(self.transport.max_in_flight > 1)
+
+    def test_constructor(self):
+        res = run(self.si.query().execute(constructor=dict))
+        self.assertEqual(len(res), 3)
+
+    def test_mlt_search(self):
+        res = run(self.si.mlt_query("name", content="dream").execute())
+        self.assertEqual(res.result.numFound, 3)
+        self.assertEqual(self.transport.requests[-1][0], 'GET')
+
+    def test_updates(self):
+        async def update():
+            await self.si.add([{"id": "1", "modified": datetime.datetime(
+                2014, 1, 1), "start_dt": "2014-01-01T10:00",
+                "foo": None}])
+            await self.si.delete_by_ids(["2"])
+            await self.si.commit()
+        run(update())
+        bodies = [(urlsplit(u).path, urlsplit(u).query, d)
+                  for m, u, d in self.transport.requests]
+        # the schema is needed to convert date strings
+        self.assertEqual(bodies[0][0], '/solr/schema')
+        self.assertEqual(json.loads(bodies[1][2]), [
+            {"id": "1", "modified": "2014-01-01T00:00:00Z",
+             "start_dt": "2014-01-01T10:00:00Z"}])
+        self.assertEqual(bodies[2:], [
+            ('/solr/update/json', '', '{"delete": ["2"]}'),
+            ('/solr/update/json', 'commit=true', '{"commit": {}}'),
+        ])
+
+    def test_schema_field(self):
+        self.assertEqual(run(self.si.schema_field("start_dt")),
+                         {"name": "*_dt", "type": "date"})
+        self.assertEqual(run(self.si.has_docvalues("modified")), False)
+
+    def test_not_supported(self):
+        search = self.si.query(genre_s="fantasy")
+        for call in (search.stream, lambda: search.export(["id"]),
+                     lambda: search.parallel_export(["id"]),
+                     lambda: self.si.export(q="*:*")):
+            self.assertRaises(scorched.exc.NotSupportedError, call)
+        for kwargs in ({"stream": True}, {"workers": 2},
+                       {"max_in_flight": 2},
+                       {"batcher": scorched.indexing.AdaptiveBatcher()}):
+            self.assertRaises(scorched.exc.NotSupportedError, run,
+                              self.si.add([{"id": "1"}], **kwargs))
+        self.assertEqual(self.transport.requests, [])
+
+    def test_update_fields(self):
+        run(self.si.update_fields("1", inc={"views_i": 1}))
+        run(self.si.update_fields_many([{"id": "2", "set": {"name": "x"}}]))
+        bodies = [json.loads(d) for m, u, d in self.transport.requests
+                  if '/update' in u]
+        self.assertEqual(bodies, [[{"id": "1", "views_i": {"inc": 1}}],
+                                  [{"id": "2", "name": {"set": "x"}}]])
+
+    def test_get(self):
+        docs = run(self.si.get(["1", "2", "3"], chunk=2))
+        self.assertEqual(sorted(docs), ["1", "2", "3"])
+        # converted with the schema loaded first
+        self.assertEqual(docs["3"]["modified"].year, 2014)
+        self.assertEqual(len([u for m, u, d in self.transport.requests
+                              if '/get?' in u]), 2)
+
+    def test_get_writer(self):
+        si = AsyncSolrInterface("http://localhost:8983/solr", mode="w",
+                                transport=self.transport,
+                                schema=SCHEMA['schema'])
+        self.assertEqual(sorted(run(si.get(["1"]))), ["1"])
+
+    def test_errors(self):
+        self.transport.select_body = None
+
+        async def failing(method, url, **kwargs):
+            return TransportResponse(500, b'error')
+        self.si.schema = SCHEMA['schema']
+        self.transport.request = failing
+        self.assertRaises(scorched.exc.SolrError, run,
+                          self.si.query().execute())
+        self.assertRaises(scorched.exc.SolrError, run,
+                          self.si.commit())
+
+    def test_retry(self):
+        transport = FakeTransport(self.data, fail_connect=1)
+        si = AsyncSolrInterface("http://localhost:8983/solr",
+                                transport=transport, retry_timeout=0,
+                                schema=SCHEMA['schema'])
+        res = run(si.query().execute())
+        self.assertEqual(res.result.numFound, 3)
+        transport = FakeTransport(self.data, fail_connect=1)
+        si = AsyncSolrInterface("http://localhost:8983/solr",
+                                transport=transport,
+                                schema=SCHEMA['schema'])
+        self.assertRaises(requests.exceptions.ConnectionError, run,
+                          si.query().execute())
+
+    def test_deadline(self):
+        async def slow(method, url, **kwargs):
+            await asyncio.sleep(1)
+        self.si.schema = SCHEMA['schema']
+        self.transport.request = slow
+        self.assertRaises(scorched.exc.DeadlineExceeded, run,
+                          self.si.query().deadline(0.05).execute())
+
+    def test_javabin(self):
+        self.transport.select_body = scorched.javabin.dumps(
+            scorched.javabin.NamedList([
+                ('responseHeader', {'status': 0, 'QTime': 1}),
+                ('response', scorched.javabin.DocumentList(
+                    [{'id': '1', 'modified': datetime.datetime(
+                        2014, 1, 1, tzinfo=pytz.utc)}]))]))
+        si = AsyncSolrInterface("http://localhost:8983/solr",
+                                transport=self.transport,
+                                schema=SCHEMA['schema'],
+                                response_format='javabin')
+        res = run(si.query(id=1).execute())
+        self.assertEqual(res.result.docs, [
+            {'id': '1', 'modified': datetime.datetime(2014, 1, 1,
+                                                      tzinfo=pytz.utc)}])
+        params = dict(parse_qsl(urlsplit(self.transport.requests[0][1]).query))
+        self.assertEqual(params['wt'], 'javabin')
+        # the format can be chosen per query as well
+        self.transport.select_body = self.data
+        res = run(si.query(id=1).response_format('json').execute())
+        self.assertEqual(res.result.numFound, 3)
+
+    def test_iter_cursor(self):
+        async def collect():
+            return [doc['id'] async for doc in
+                    self.si.query().iter_cursor(page_size=2)]
+        self.assertEqual(len(run(collect())), 3)
+        params = dict(parse_qsl(urlsplit(self.transport.requests[1][1]).query))
+        self.assertEqual(params['cursorMark'], '*')
+        self.assertEqual(params['sort'], 'score desc, id asc')
+
+    def test_iter_cursor_deadline(self):
+        si = AsyncSolrInterface("http://localhost:8983/solr",
+                                transport=self.transport, deadline=2)
+
+        async def collect():
+            return [doc['id'] async for doc in
+                    si.query().deadline(1).iter_cursor(page_size=2)]
+        self.assertEqual(len(run(collect())), 3)
+        params = dict(parse_qsl(urlsplit(self.transport.requests[1][1]).query))
+        self.assertFalse('timeAllowed' in params)
+
+    def test_schema_fetched_once(self):
+        async def search():
+            return await asyncio.gather(
+                *[self.si.query(id=i).execute() for i in range(20)])
+        self.assertEqual(len(run(search())), 20)
+        schema_requests = [u for m, u, d in self.transport.requests
+                           if urlsplit(u).path.endswith('/schema')]
+        self.assertEqual(len(schema_requests), 1)
+
+    def test_search_many(self):
+        searches = [self.si.query(id=i) for i in range(10)]
+        results = run(self.si.search_many(searches, max_concurrency=3))
+        self.assertEqual([r.result.numFound for r in results], [3] * 10)
+        self.assertEqual(self.transport.max_in_flight, 3)
+
+    def test_not_modified(self):
+        self.transport.etag = '"1"'
+        si = AsyncSolrInterface(
+            "http://localhost:8983/solr", transport=self.transport,
+            validator_cache=scorched.cache.ValidatorCache())
+        res = run(si.query(id=1).execute())
+        self.assertTrue(run(si.query(id=1).execute()) is res)
+        self.assertEqual(si.conn.validator_cache.not_modified, 1)
+        self.transport.etag = '"2"'
+        self.assertFalse(run(si.query(id=1).execute()) is res)
+
+    def test_coalesce(self):
+        si = AsyncSolrInterface("http://localhost:8983/solr",
+                                transport=self.transport, coalesce=True)
+
+        async def search():
+            # different deadlines send different timeAllowed
+            return await asyncio.gather(
+                *[si.query(id=1).deadline(5 - i).execute()
+                  for i in range(5)])
+        results = run(search())
+        self.assertTrue(all(res is results[0] for res in results))
+        self.assertEqual(len([r for r in self.transport.requests
+                              if '/select/' in r[1]]), 1)
+        self.assertEqual(si.conn.single_flight.stats()['coalesced'], 4)
+
+
+class TestAsyncReplicas(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = FakeTransport(json.dumps({
+            "responseHeader": {"status": 0, "QTime": 1, "params": {}},
+            "response": {"numFound": 0, "start": 0, "docs": []}}))
+        self.si = AsyncSolrInterface(
+            ["http://a/solr", "http://b/solr"], transport=self.transport,
+            schema=SCHEMA['schema'], health_check_interval=None)
+
+    def test_ping(self):
+        node = self.si.conn.replicas.nodes[0]
+        # no event loop to send the probe through yet
+        self.assertFalse(self.si.conn.ping(node))
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(
+                self.si.query().execute(), loop).result(5)
+            # called from the health check thread
+            self.assertTrue(self.si.conn.ping(node))
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(5)
+            loop.close()
+        self.assertEqual(self.transport.requests[-1][:2],
+                         ('GET', 'http://a/solr/admin/ping?wt=json'))
+
+    def test_server_error(self):
+        self.transport.fail_hosts = ('a', )
+        a, b = self.si.conn.replicas.nodes
+        # the quickly failing replica looks faster and is picked first
+        b.latency = 1.0
+        for i in range(5):
+            self.assertEqual(run(self.si.query().execute()).result.numFound,
+                             0)
+        self.assertFalse(a.healthy)
+        self.transport.fail_hosts = ('a', 'b')
+        self.assertRaises(scorched.exc.SolrError, run,
+                          self.si.query().execute())
@@ -0,0 +1,51 @@
+"""
+Schema and responses shared by the tests of the interface.
+"""
+from __future__ import unicode_literals
+import io
+import json
+import requests
+
+
+SCHEMA = {
+    "uniqueKey": "id",
+    "fields": [{"name": "id", "type": "string", "docValues": True},
+               {"name": "price", "type": "pfloat"},
+               {"name": "name", "type": "text_general"}],
+    "dynamicFields": [{"name": "*_s", "type": "string", "docValues": True},
+                      {"name": "*_dt", "type": "pdate"},
+                      {"name": "attr_*", "type": "text_general"}],
+    "fieldTypes": [{"name": "string", "class": "solr.StrField"},
+                   {"name": "pfloat", "class": "solr.FloatPointField",
+                    "docValues": True},
+                   {"name": "pdate", "class": "solr.DatePointField"},
+                   {"name": "text_general", "class": "solr.TextField"}],
+}
+
+
+def response(content=b'{}', status_code=200, headers=None, stream=False):
+    """
+    :param content: optional -- body, encoded as json unless it is bytes
+    :param stream: optional -- whether the body is read from ``raw``, like
+                   the body of a request sent with ``stream=True``
+    :returns: requests.Response
+    """
+    if not isinstance(content, bytes):
+        content = json.dumps(content).encode('utf-8')
+    ret = requests.Response()
+    ret.status_code = status_code
+    ret.headers.update(headers or {})
+    if stream:
+        ret.raw = io.BytesIO(content)
+    else:
+        ret._content = content
+    return ret
+
+
+def select_response(docs):
+    """
+    :returns: requests.Response -- a search result of ``docs``
+    """
+    return response({"responseHeader": {"status": 0},
+                     "response": {"numFound": len(docs), "start": 0,
+                                  "docs": docs}})
@@ -0,0 +1,6 @@
+# the asyncio tests use ``async def``, which older interpreters can't even
+# compile, so they live in a module only imported on python 3.5 and later
+import sys
+
+if sys.version_info >= (3, 5):
+    from scorched.tests.aio_cases import *  # noqa
@@ -0,0 +1,143 @@
+from __future__ import unicode_literals
+import mock
+import requests
+import time
+import unittest
+import scorched.connection
+
+from scorched.cache import ResultCache, ValidatorCache
+from scorched.tests.fixtures import SCHEMA, response, select_response
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = ResultCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        # b was used least recently
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(), {'hits': 3, 'misses': 1,
+                                         'evictions': 1, 'entries': 2,
+                                         'bytes': 0})
+
+    def test_max_bytes(self):
+        cache = ResultCache(max_bytes=100)
+        cache.set('a', 1, size=60)
+        cache.set('b', 2, size=30)
+        cache.set('c', 3, size=30)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.size, 60)
+        # too large to be cached at all
+        cache.set('d', 4, size=101)
+        self.assertEqual(cache.get('d'), None)
+        self.assertEqual(len(cache), 2)
+        cache.set('b', 5, size=10)
+        self.assertEqual((cache.get('b'), cache.size), (5, 40))
+
+    def test_ttl(self):
+        cache = ResultCache(ttl=0.05)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=10)
+        cache.set('c', 3, ttl=0)
+        self.assertEqual(cache.get('c'), None)
+        time.sleep(0.1)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(len(cache), 1)
+        cache.clear()
+        self.assertEqual((len(cache), cache.size), (0, 0))
+
+    def test_generation(self):
+        cache = ResultCache(ttl=60)
+        generation = cache.generation
+        cache.set('a', 1, generation=generation)
+        cache.clear()
+        # a response requested before the clear is stale
+        cache.set('b', 2, generation=generation)
+        self.assertEqual((cache.get('a'), cache.get('b')), (None, None))
+        cache.set('b', 2, generation=cache.generation)
+        self.assertEqual(cache.get('b'), 2)
+
+
+class TestCachedSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.si = scorched.connection.SolrInterface(
+            "http://localhost:8983/solr", schema=SCHEMA,
+            cache=ResultCache(ttl=60))
+
+    def response(self, *args, **kwargs):
+        return select_response([{"id": "1"}])
+
+    def test_cache(self):
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.response) as request:
+            res = self.si.query(id=1).execute()
+            self.assertTrue(self.si.query(id=1).execute() is res)
+            self.assertEqual(request.call_count, 1)
+            # the constructor does not change the cached response
+            self.assertEqual(self.si.query(id=1).execute(dict).result.docs,
+                             [{"id": "1"}])
+            self.assertTrue(res.result.docs[0] is not None)
+            self.assertEqual(request.call_count, 1)
+            self.si.query(id=2).execute()
+            self.si.query(id=1).cache(0).execute()
+            self.assertEqual(request.call_count, 3)
+            self.si.commit()
+            self.si.query(id=1).execute()
+            self.assertEqual(request.call_count, 5)
+            self.si.add({"id": "3"})
+            self.si.query(id=1).execute()
+            self.assertEqual(request.call_count, 6)
+            self.si.add({"id": "3"}, commit=True)
+            self.si.delete_by_ids(["3"])
+            self.si.rollback()
+            self.si.query(id=1).execute()
+            self.assertEqual(request.call_count, 10)
+        stats = self.si.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (3, 4))
+
+    def test_deadline(self):
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.response) as request:
+            res = self.si.query(id=1).deadline(5).execute()
+            self.assertTrue('timeAllowed=' in request.call_args[0][1])
+            # the time allowed differs, the results don't
+            self.assertTrue(self.si.query(id=1).deadline(2).execute() is res)
+            self.assertTrue(self.si.query(id=1).execute() is res)
+            self.assertEqual(request.call_count, 1)
+
+    def test_cleared_during_search(self):
+        def commit_meanwhile(*args, **kwargs):
+            # the index changes while the search is on the wire
+            self.si.cache.clear()
+            return self.response()
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=commit_meanwhile) as request:
+            self.si.query(id=1).execute()
+            self.si.query(id=1).execute()
+            self.assertEqual(request.call_count, 2)
+        self.assertEqual(len(self.si.cache), 0)
+
+    def test_not_modified(self):
+        si = scorched.connection.SolrInterface(
+            "http://localhost:8983/solr", schema=SCHEMA,
+            validator_cache=ValidatorCache())
+
+        def conditional(*args, **kwargs):
+            if 'If-None-Match' in kwargs.get('headers', {}):
+                return response(b'', 304)
+            ret = self.response()
+            ret.headers['ETag'] = '"1"'
+            return ret
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=conditional) as request:
+            res = si.query(id=1).execute()
+            self.assertTrue(si.query(id=1).execute() is res)
+            self.assertEqual(request.call_count, 2)
+            self.assertEqual(res.result.numFound, 1)
@@ -1,9 +1,27 @@
 from __future__ import unicode_literals
+import datetime
+import gzip
+import io
+import json
 import os
+import pytz
+import re
+import shutil
+import tempfile
+import threading
+import time
 import mock
 import requests
 import unittest
+import warnings
+import zlib
+import scorched.cache
+import scorched.compat
 import scorched.connection
+import scorched.exc
+import scorched.retry
+
+from scorched.tests.fixtures import SCHEMA, response, select_response
 
 
 class TestConnection(unittest.TestCase):
@@ -54,6 +72,60 @@ class TestConnection(unittest.TestCase):
                                return_value=mock.Mock(status_code=500)):
             self.assertRaises(scorched.exc.SolrError, sc.select, [])
 
+    def test_select_javabin(self):
+        dsn = "http://localhost:8983/solr"
+        sc = scorched.connection.SolrConnection(
+            url=dsn, http_connection=None, mode="", retry_timeout=-1,
+            max_length_get_url=2048)
+        response = mock.Mock(status_code=200, text='{}', content=b'\x02\x00',
+                             headers={})
+        with mock.patch.object(requests.Session, 'request',
+                               return_value=response) as request:
+            self.assertEqual(sc.select([('q', b'*:*')]), '{}')
+            self.assertTrue(request.call_args[0][1].endswith('wt=json'))
+            self.assertEqual(sc.select([('q', b'*:*'), ('wt', b'javabin')]),
+                             b'\x02\x00')
+            self.assertTrue(request.call_args[0][1].endswith('wt=javabin'))
+
+    def test_select_conditional(self):
+        dsn = "http://localhost:8983/solr"
+        sc = scorched.connection.SolrConnection(
+            url=dsn, http_connection=None, mode="", retry_timeout=-1,
+            max_length_get_url=2048,
+            validator_cache=scorched.cache.ValidatorCache())
+        ok = mock.Mock(status_code=200, text='{}', content=b'{}', headers={
+            'ETag': '"abc"', 'Last-Modified': 'Mon, 01 Jan 2018 00:00:00 GMT'})
+        not_modified = mock.Mock(status_code=304, text='', headers={})
+        parse = mock.Mock(side_effect=lambda body: {"parsed": body})
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=[ok, not_modified]) as request:
+            first = sc.select([('q', b'*:*')], parse=parse)
+            # parsers receive the undecoded body
+            self.assertEqual(first, {"parsed": b"{}"})
+            self.assertFalse('headers' in request.call_args[1])
+            self.assertTrue(sc.select([('q', b'*:*')], parse=parse) is first)
+            headers = request.call_args[1]['headers']
+            self.assertEqual(headers['If-None-Match'], '"abc"')
+            self.assertEqual(headers['If-Modified-Since'],
+                             'Mon, 01 Jan 2018 00:00:00 GMT')
+        self.assertEqual(parse.call_count, 1)
+        self.assertEqual(sc.validator_cache.stats()['not_modified'], 1)
+        # other urls are not validated, neither are responses without
+        # validators remembered
+        with mock.patch.object(requests.Session, 'request',
+                               return_value=mock.Mock(
+                                   status_code=200, text='{}',
+                                   headers={})) as request:
+            sc.select([('q', b'id:1')])
+            sc.select([('q', b'id:1')])
+            self.assertFalse('headers' in request.call_args[1])
+        # a 304 without a remembered response is an error
+        sc.validator_cache.clear()
+        with mock.patch.object(requests.Session, 'request',
+                               return_value=not_modified):
+            self.assertRaises(scorched.exc.SolrError, sc.select,
+                              [('q', b'*:*')])
+
     def test_no_body_response_error(self):
         dsn = "http://localhost:8983/solr"
         sc = scorched.connection.SolrConnection(
@@ -120,3 +192,414 @@ class TestConnection(unittest.TestCase):
         self.assertRaises(ValueError, sc.url_for_update, optimize=True, maxSegments="a")
         self.assertRaises(ValueError, sc.url_for_update, optimize=True, maxSegments=-1)
         self.assertRaises(ValueError, sc.url_for_update, maxSegments=2)
+
+    def test_http_connection(self):
+        dsn = "http://localhost:8983/solr"
+        session = requests.Session()
+        sc = scorched.connection.SolrConnection(
+            url=dsn, http_connection=session, mode="", retry_timeout=-1,
+            max_length_get_url=2048)
+        self.assertTrue(sc.http_connection is session)
+        with mock.patch.object(session, 'request',
+                               return_value=mock.Mock(status_code=200,
+                                                      text='{}')) as request:
+            sc.select([])
+            self.assertEqual(request.call_count, 1)
+
+    def test_pool_settings(self):
+        dsn = "http://localhost:8983/solr"
+        sc = scorched.connection.SolrConnection(
+            url=dsn, http_connection=None, mode="", retry_timeout=-1,
+            max_length_get_url=2048, pool_connections=4, pool_maxsize=32,
+            pool_block=True, keep_alive=False)
+        adapter = sc.http_connection.get_adapter(dsn)
+        self.assertEqual(adapter._pool_connections, 4)
+        self.assertEqual(adapter._pool_maxsize, 32)
+        self.assertEqual(adapter._pool_block, True)
+        self.assertEqual(sc.http_connection.headers['Connection'], 'close')
+        session = scorched.connection.create_session()
+        self.assertEqual(session.get_adapter(dsn)._pool_maxsize, 10)
+        self.assertNotEqual(session.headers.get('Connection'), 'close')
+
+    def test_deadline(self):
+        dsn = "http://localhost:8983/solr"
+        sc = scorched.connection.SolrConnection(
+            url=dsn, http_connection=None, mode="", retry_timeout=-1,
+            max_length_get_url=2048, timeout=(1, 10))
+        response = mock.Mock(status_code=200, text='{}')
+        with mock.patch.object(requests.Session, 'request',
+                               return_value=response) as request:
+            sc.select([])
+            self.assertEqual(request.call_args[1]['timeout'], (1, 10))
+            sc.select([], deadline=time.time() + 0.5)
+            connect, read = request.call_args[1]['timeout']
+            self.assertTrue(0 < read <= 0.5)
+            self.assertTrue(0 < connect <= 0.5)
+            self.assertRaises(scorched.exc.DeadlineExceeded, sc.select, [],
+                              deadline=time.time() - 1)
+            self.assertRaises(requests.exceptions.Timeout, sc.select, [],
+                              deadline=time.time() - 1)
+
+    def test_no_retry_past_deadline(self):
+        dsn = "http://localhost:8983/solr"
+        sc = scorched.connection.SolrConnection(
+            url=dsn, http_connection=None, mode="", retry_timeout=-1,
+            max_length_get_url=2048, retry_policy=scorched.retry.RetryPolicy(
+                backoff=5, jitter=False))
+        with mock.patch.object(
+                requests.Session, 'request',
+                side_effect=requests.exceptions.ReadTimeout) as request:
+            self.assertRaises(requests.exceptions.ReadTimeout, sc.select, [],
+                              deadline=time.time() + 1)
+            self.assertEqual(request.call_count, 1)
+
+    def test_compression(self):
+        dsn = "http://localhost:8983/solr"
+        sc = scorched.connection.SolrConnection(
+            url=dsn, http_connection=None, mode="", retry_timeout=-1,
+            max_length_get_url=2048, compress_updates='gzip',
+            compression_threshold=100, accept_encoding='gzip')
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{}'
+        doc = json.dumps([{"id": i, "text": "lorem ipsum"} for i in range(50)])
+        with mock.patch.object(requests.Session, 'request',
+                               return_value=response) as request:
+            sc.update(doc)
+            kwargs = request.call_args[1]
+            self.assertEqual(kwargs['headers']['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(
+                kwargs['data'])).read().decode('utf-8'), doc)
+            # small bodies are not compressed
+            sc.update('{"commit": {}}')
+            kwargs = request.call_args[1]
+            self.assertEqual(kwargs['data'], b'{"commit": {}}')
+            self.assertFalse('Content-Encoding' in kwargs['headers'])
+            sc.select([])
+            self.assertEqual(
+                request.call_args[1]['headers']['Accept-Encoding'], 'gzip')
+        stats = sc.transfer_stats
+        self.assertEqual(stats.bytes_sent_uncompressed, len(doc) + 14)
+        self.assertTrue(stats.bytes_sent < stats.bytes_sent_uncompressed)
+        self.assertEqual(stats.bytes_received, 6)
+        self.assertTrue(stats.saved() > 0)
+        self.assertEqual(
+            zlib.decompress(scorched.connection.compress(b'abc', 'deflate')),
+            b'abc')
+        self.assertRaises(ValueError, scorched.connection.compress, b'',
+                          'br')
+
+    def test_received_wire_bytes(self):
+        stats = scorched.connection.TransferStats()
+        response = requests.Response()
+        response._content = b'x' * 1000
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Content-Length'] = '20'
+        stats.record_received(response)
+        self.assertEqual((stats.bytes_received,
+                          stats.bytes_received_uncompressed), (20, 1000))
+
+    def test_transfer_stats_lock(self):
+        stats = scorched.connection.TransferStats()
+        response = requests.Response()
+        response._content = b'x' * 10
+
+        def record():
+            stats.record_sent(1, 2)
+            stats.record_received(response)
+        # updates from other threads wait for the lock
+        with stats._lock:
+            thread = threading.Thread(target=record)
+            thread.start()
+            thread.join(0.1)
+            self.assertTrue(thread.is_alive())
+            self.assertEqual(stats.bytes_sent, 0)
+        thread.join(5)
+        self.assertEqual((stats.bytes_sent, stats.bytes_sent_uncompressed,
+                          stats.bytes_received), (1, 2, 10))
+        self.assertEqual(stats.saved(), 1)
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.si = scorched.connection.SolrInterface(
+            "http://localhost:8983/solr", schema=SCHEMA)
+
+    def test_has_docvalues(self):
+        self.assertTrue(self.si.has_docvalues('id'))
+        self.assertTrue(self.si.has_docvalues('price'))
+        self.assertTrue(self.si.has_docvalues('genre_s'))
+        self.assertFalse(self.si.has_docvalues('name'))
+        self.assertFalse(self.si.has_docvalues('attr_color'))
+        self.assertFalse(self.si.has_docvalues('unknown'))
+
+    def test_export(self):
+        body = {"responseHeader": {"status": 0},
+                "response": {"numFound": 2, "docs": [
+                    {"id": "1", "price": 1.5}, {"id": "2", "price": 2.5}]}}
+        with mock.patch.object(requests.Session, 'request',
+                               return_value=response(
+                                   body, stream=True)) as request:
+            res = self.si.query(genre_s="fantasy").paginate(rows=10).export(
+                ["id", "price"], sort="-price")
+            self.assertEqual(res.numFound, 2)
+            self.assertEqual(list(res), [{"id": "1", "price": 1.5},
+                                         {"id": "2", "price": 2.5}])
+            method, url = request.call_args[0]
+            self.assertEqual(method, 'GET')
+            self.assertTrue(url.startswith(
+                "http://localhost:8983/solr/export?"))
+            self.assertEqual(
+                sorted(scorched.compat.parse_qsl(url.split('?')[1])),
+                [('fl', 'id,price'), ('q', 'genre_s:fantasy'),
+                 ('sort', 'price desc'), ('wt', 'json')])
+            self.assertTrue(request.call_args[1]['stream'])
+
+    def test_export_validation(self):
+        q = self.si.query()
+        self.assertRaises(scorched.exc.SolrError, q.export)
+        self.assertRaises(scorched.exc.SolrError, q.export, ["id", "name"])
+        self.assertRaises(scorched.exc.SolrError, q.export, ["id"],
+                          sort="name")
+        self.assertRaises(scorched.exc.SolrError,
+                          q.field_limit(["id"], score=True).export)
+
+    def test_export_error(self):
+        body = {"responseHeader": {"status": 0},
+                "response": {"numFound": 2, "docs": [
+                    {"id": "1"}, {"EXCEPTION": "Export failed"}]}}
+        with mock.patch.object(requests.Session, 'request',
+                               return_value=response(body, stream=True)):
+            res = self.si.query().export(["id"])
+            self.assertRaises(ValueError, list, res)
+
+
+class TestSearchMany(unittest.TestCase):
+
+    def setUp(self):
+        self.si = scorched.connection.SolrInterface(
+            "http://localhost:8983/solr", schema=SCHEMA)
+        self.urls = []
+
+    def request(self, method, url, **kwargs):
+        self.urls.append(url)
+        time.sleep(0.1)
+        if 'fail' in url:
+            return response(b'', 500)
+        return select_response([{"id": url}])
+
+    def test_search_many(self):
+        searches = [self.si.query(id=i) for i in range(6)]
+        searches[2] = self.si.query(id="fail")
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            start = time.time()
+            results = self.si.search_many(searches, max_concurrency=6)
+            self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual(len(results), 6)
+        self.assertTrue(isinstance(results[2], scorched.exc.SolrError))
+        for i in (0, 1, 3, 4, 5):
+            self.assertTrue('id%%3A%s' % i in results[i].result.docs[0]['id'])
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            self.assertRaises(scorched.exc.SolrError, self.si.search_many,
+                              searches, return_exceptions=False)
+
+    def test_search_many_deadline(self):
+        searches = [self.si.query(id=i) for i in range(4)]
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            results = self.si.search_many(searches, max_concurrency=1,
+                                          deadline=0.25)
+        self.assertEqual(results[0].result.numFound, 1)
+        self.assertTrue(isinstance(results[-1],
+                                   scorched.exc.DeadlineExceeded))
+        self.assertTrue('timeAllowed=' in self.urls[0])
+
+
+class TestSchemaLoading(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "schema.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def response(self, status_code=200, headers=None):
+        return response({"schema": SCHEMA} if status_code == 200 else b'',
+                        status_code, headers)
+
+    def test_lazy(self):
+        with mock.patch.object(requests.Session, 'request',
+                               return_value=self.response()) as request:
+            si = scorched.connection.SolrInterface(
+                "http://localhost:8983/solr")
+            self.assertEqual(request.call_count, 0)
+            self.assertEqual(si.unique_key, "id")
+            self.assertEqual(si.schema["uniqueKey"], "id")
+            self.assertEqual(si._datefields, ("_dt", ))
+            self.assertEqual(request.call_count, 1)
+
+    def test_preloaded(self):
+        with mock.patch.object(requests.Session, 'request') as request:
+            si = scorched.connection.SolrInterface(
+                "http://localhost:8983/solr", schema=SCHEMA)
+            self.assertTrue(si.has_docvalues("price"))
+            self.assertEqual(request.call_count, 0)
+
+    def test_schema_cache(self):
+        url = "http://localhost:8983/solr/schema?wt=json"
+        cache = scorched.cache.SchemaCache(self.path)
+        with mock.patch.object(requests.Session, 'request',
+                               return_value=self.response(
+                                   headers={'ETag': '"v1"'})):
+            scorched.connection.SolrInterface(
+                "http://localhost:8983/solr", schema_cache=cache).schema
+        self.assertEqual(cache.get(url)['schema'], SCHEMA)
+        self.assertEqual(cache.get(url)['etag'], '"v1"')
+        # revalidated with the etag
+        with mock.patch.object(requests.Session, 'request',
+                               return_value=self.response(304)) as request:
+            si = scorched.connection.SolrInterface(
+                "http://localhost:8983/solr", schema_cache=cache)
+            self.assertEqual(si.schema, SCHEMA)
+            self.assertEqual(request.call_args[1]['headers'],
+                             {'If-None-Match': '"v1"'})
+        # used without a request while fresh
+        cache.max_age = 60
+        with mock.patch.object(requests.Session, 'request') as request:
+            si = scorched.connection.SolrInterface(
+                "http://localhost:8983/solr", schema_cache=cache)
+            self.assertEqual(si.schema, SCHEMA)
+            self.assertEqual(request.call_count, 0)
+
+    def test_schema_cache_fallback(self):
+        cache = scorched.cache.SchemaCache(self.path)
+        cache.set("http://localhost:8983/solr/schema?wt=json", SCHEMA)
+        with mock.patch.object(
+                requests.Session, 'request',
+                side_effect=requests.exceptions.ConnectionError("down")):
+            si = scorched.connection.SolrInterface(
+                "http://localhost:8983/solr", schema_cache=cache)
+            with warnings.catch_warnings(record=True):
+                warnings.simplefilter("always")
+                self.assertEqual(si.schema, SCHEMA)
+            si = scorched.connection.SolrInterface(
+                "http://localhost:8983/solr")
+            self.assertRaises(requests.exceptions.ConnectionError,
+                              lambda: si.schema)
+
+
+class TestAtomicUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.si = scorched.connection.SolrInterface(
+            "http://localhost:8983/solr", schema=SCHEMA)
+        self.sent = []
+        self.status_code = 200
+
+    def request(self, method, url, data=None, **kwargs):
+        self.sent.append((url, json.loads(data)))
+        return response(status_code=self.status_code)
+
+    def test_update_fields(self):
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            self.si.update_fields(
+                "1", set={"name": "new", "price": None,
+                          "modified_s": datetime.datetime(2018, 1, 2)},
+                inc={"views_i": 2}, add={"cat": "a"},
+                add_distinct={"tag_s": ["x"]}, remove={"cat": "b"},
+                removeregex={"tags": "^old"}, version=5, commitWithin=100)
+        url, docs = self.sent[0]
+        self.assertTrue(url.endswith('commitWithin=100'))
+        self.assertEqual(docs, [{
+            "id": "1", "name": {"set": "new"},
+            # None removes the field
+            "price": {"set": None},
+            "modified_s": {"set": "2018-01-02T00:00:00Z"},
+            "views_i": {"inc": 2}, "cat": {"add": "a", "remove": "b"},
+            "tag_s": {"add-distinct": ["x"]}, "tags": {"removeregex": "^old"},
+            "_version_": 5}])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self.si.update_fields, "1")
+        self.assertRaises(ValueError, self.si.update_fields_many,
+                          [{"id": "1", "incr": {"views_i": 1}}])
+
+    def test_version_conflict(self):
+        self.status_code = 409
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            self.assertRaises(scorched.exc.VersionConflict,
+                              self.si.update_fields, "1",
+                              set={"name": "new"}, version=3)
+
+    def test_update_fields_many(self):
+        updates = ({"id": str(i), "inc": {"views_i": i}} for i in range(5))
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            self.si.update_fields_many(updates, chunk=2, workers=2)
+        docs = sorted((doc for url, chunk in self.sent for doc in chunk),
+                      key=lambda doc: doc["id"])
+        self.assertEqual(len(self.sent), 3)
+        self.assertEqual(docs, [{"id": str(i), "views_i": {"inc": i}}
+                                for i in range(5)])
+
+
+class TestRealtimeGet(unittest.TestCase):
+
+    def setUp(self):
+        self.si = scorched.connection.SolrInterface(
+            "http://localhost:8983/solr", schema=SCHEMA)
+        self.lock = threading.Lock()
+        self.urls = []
+
+    def request(self, method, url, **kwargs):
+        query = dict(scorched.compat.parse_qsl(
+            scorched.compat.urlsplit(url).query))
+        with self.lock:
+            self.urls.append((scorched.compat.urlsplit(url).path, query))
+        ids = [id.replace('\\,', ',')
+               for id in re.split(r'(?<!\\),', query['ids'])]
+        return select_response([
+            {"id": id, "created_dt": "2018-01-02T00:00:00Z"}
+            for id in ids if id != "missing"])
+
+    def test_get(self):
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            docs = self.si.get(["1", "2", "a,b", "missing", 5], chunk=2,
+                               fields=["created_dt"])
+        self.assertEqual(sorted(docs), ["1", "2", "5", "a,b"])
+        self.assertEqual(docs["a,b"]["created_dt"], datetime.datetime(
+            2018, 1, 2, tzinfo=pytz.utc))
+        self.assertEqual(len(self.urls), 3)
+        self.assertTrue(all(path == "/solr/get" and
+                            query["fl"] == "created_dt,id"
+                            for path, query in self.urls))
+        self.assertEqual(sorted(query["ids"] for path, query in self.urls),
+                         ["1,2", "5", "a\\,b,missing"])
+
+    def test_get_single(self):
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            self.assertEqual(list(self.si.get("1")), ["1"])
+            self.assertEqual(self.si.get([]), {})
+        self.assertFalse("fl" in self.urls[0][1])
+        self.assertEqual(len(self.urls), 1)
+
+    def test_get_writer(self):
+        si = scorched.connection.SolrInterface(
+            "http://localhost:8983/solr", mode="w", schema=SCHEMA)
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            self.assertEqual(list(si.get("1")), ["1"])
+        self.assertEqual(self.urls[0][0], "/solr/get")
+
+    def test_get_error(self):
+        with mock.patch.object(requests.Session, 'request',
+                               return_value=response(b'', 500)):
+            self.assertRaises(scorched.exc.SolrError, self.si.get, ["1"])
@@ -0,0 +1,184 @@
+from __future__ import unicode_literals
+import datetime
+import decimal
+import json
+import mock
+import pickle
+import pytz
+import requests
+import unittest
+import scorched.connection
+
+from scorched.fields import FieldCodecs, UpdateEncoder, drop_none
+from scorched.tests import fixtures
+
+
+SCHEMA = {
+    "uniqueKey": "id",
+    "fields": [{"name": "id", "type": "string"},
+               {"name": "created", "type": "pdate"},
+               {"name": "modified", "type": "date"},
+               {"name": "dates", "type": "pdates"},
+               {"name": "legacy", "type": "tdate", "multiValued": True},
+               {"name": "price", "type": "pfloat"},
+               {"name": "count", "type": "plong"},
+               {"name": "flag", "type": "boolean"}],
+    "dynamicFields": [{"name": "*_dt", "type": "pdate"},
+                      {"name": "*_s", "type": "string"},
+                      {"name": "attr_*", "type": "plong"},
+                      {"name": "*_i_dt", "type": "plong"}],
+    "fieldTypes": [{"name": "string", "class": "solr.StrField"},
+                   {"name": "pdate", "class": "solr.DatePointField"},
+                   {"name": "date", "class": "solr.TrieDateField"},
+                   {"name": "pdates", "class": "solr.DatePointField",
+                    "multiValued": True},
+                   {"name": "tdate",
+                    "class": "org.apache.solr.schema.TrieDateField"},
+                   {"name": "pfloat", "class": "solr.FloatPointField"},
+                   {"name": "plong", "class": "solr.LongPointField"},
+                   {"name": "boolean", "class": "solr.BoolField"}],
+}
+
+
+class TestFieldCodecs(unittest.TestCase):
+
+    def setUp(self):
+        self.codecs = FieldCodecs(SCHEMA)
+
+    def test_lookup(self):
+        self.assertEqual(self.codecs.lookup("created"), ("date", False))
+        self.assertEqual(self.codecs.lookup("modified"), ("date", False))
+        self.assertEqual(self.codecs.lookup("dates"), ("date", True))
+        self.assertEqual(self.codecs.lookup("legacy"), ("date", True))
+        # numbers and booleans need no conversion
+        self.assertEqual(self.codecs.lookup("price"), (None, False))
+        self.assertEqual(self.codecs.lookup("count"), (None, False))
+        self.assertEqual(self.codecs.lookup("flag"), (None, False))
+        self.assertEqual(self.codecs.lookup("start_dt"), ("date", False))
+        self.assertEqual(self.codecs.lookup("attr_size"), (None, False))
+        # the longer pattern wins
+        self.assertEqual(self.codecs.lookup("x_i_dt"), (None, False))
+        self.assertEqual(self.codecs.lookup("name_s"), (None, False))
+        self.assertEqual(self.codecs.lookup("score"), (None, False))
+
+    def test_type_names(self):
+        codecs = FieldCodecs({
+            "fields": [{"name": "a", "type": "pdate"},
+                       {"name": "b", "type": "tdates"},
+                       {"name": "c", "type": "int"}],
+            "dynamicFields": [{"name": "*_dt", "type": "date"}]})
+        self.assertEqual(codecs.lookup("a"), ("date", False))
+        self.assertEqual(codecs.lookup("b"), ("date", True))
+        self.assertEqual(codecs.lookup("c"), (None, False))
+        self.assertEqual(sorted(codecs.datefields()), ["_dt", "a", "b"])
+
+    def test_decode(self):
+        docs = [{"id": "1", "created": "2018-01-02T03:04:05Z",
+                 "dates": ["2018-01-02T00:00:00Z", "2019-01-02T00:00:00Z"],
+                 "start_dt": "2018-01-02T00:00:00Z", "price": 1.5,
+                 "flag": True, "score": 1.0}]
+        docs = self.codecs.decode_docs(docs)
+        self.assertEqual(docs[0]["created"], datetime.datetime(
+            2018, 1, 2, 3, 4, 5, tzinfo=pytz.utc))
+        self.assertEqual([d.year for d in docs[0]["dates"]], [2018, 2019])
+        self.assertEqual(docs[0]["start_dt"].day, 2)
+        self.assertEqual(docs[0]["price"], 1.5)
+        self.assertEqual(docs[0]["flag"], True)
+        # memoized per field name, fields without conversion included
+        self.assertTrue("score" in self.codecs._decoders)
+        self.assertTrue(self.codecs._decoders["score"] is None)
+
+    def test_prepare_doc(self):
+        # date strings the schema free encoding used to send unchanged
+        doc = {"id": "1", "created": "2018-01-02",
+               "modified": {"set": "2018-01-02T03:04:05"},
+               "dates": ["2018-01-02T03:04", "2018-01-02T03:04:05.5Z"],
+               "legacy": {"removeregex": "2018.*"},
+               "start_dt": "NOW/DAY", "name_s": "2018-01-02",
+               "price": None}
+        original = dict(doc)
+        prepared = self.codecs.prepare_doc(doc)
+        self.assertEqual(prepared, {
+            "id": "1", "created": "2018-01-02T00:00:00Z",
+            "modified": {"set": "2018-01-02T03:04:05Z"},
+            "dates": ["2018-01-02T03:04:00Z",
+                      "2018-01-02T03:04:05.500000Z"],
+            "legacy": {"removeregex": "2018.*"},
+            "start_dt": "NOW/DAY", "name_s": "2018-01-02"})
+        self.assertEqual(doc, original)
+        # nothing to change, no copy
+        doc = {"id": "1", "name_s": "x"}
+        self.assertTrue(self.codecs.prepare_doc(doc) is doc)
+        self.assertTrue("name_s" in self.codecs._encoders)
+
+    def test_pickle(self):
+        self.codecs.decoder("dates")
+        codecs = pickle.loads(pickle.dumps(self.codecs))
+        self.assertEqual(
+            codecs.decode_docs([{"dates": ["2018-01-02T00:00:00Z"]}])[0][
+                "dates"][0].year, 2018)
+
+
+class TestUpdateEncoder(unittest.TestCase):
+
+    def test_encode(self):
+        berlin = pytz.timezone("Europe/Berlin")
+        doc = {"id": "1", "name": None,
+               "created": datetime.datetime(2018, 1, 2, 3, 4, 5, 600000),
+               "local": berlin.localize(datetime.datetime(2018, 1, 2, 3)),
+               "day": datetime.date(2018, 1, 2),
+               "modified": {"set": datetime.datetime(2018, 1, 2)},
+               "price": decimal.Decimal("1.5"),
+               "count": decimal.Decimal("3"), "tags": set(["a"])}
+        original = dict(doc)
+        encoded = UpdateEncoder().encode(drop_none(doc))
+        self.assertEqual(json.loads(encoded), {
+            "id": "1", "created": "2018-01-02T03:04:05.600000Z",
+            "local": "2018-01-02T02:00:00Z", "day": "2018-01-02T00:00:00Z",
+            "modified": {"set": "2018-01-02T00:00:00Z"},
+            "price": 1.5, "count": 3, "tags": ["a"]})
+        self.assertEqual(doc, original)
+
+    def test_drop_none(self):
+        docs = [{"id": "1"}, {"id": "2", "name": None}]
+        encoder = UpdateEncoder()
+        self.assertEqual(json.loads(encoder.encode([drop_none(doc)
+                                                    for doc in docs])),
+                         [{"id": "1"}, {"id": "2"}])
+        # documents without None values are not copied
+        self.assertTrue(drop_none(docs[0]) is docs[0])
+        self.assertEqual(docs[1], {"id": "2", "name": None})
+        self.assertRaises(TypeError, encoder.encode, {"id": object()})
+
+
+class TestAddSerialization(unittest.TestCase):
+
+    def setUp(self):
+        self.si = scorched.connection.SolrInterface(
+            "http://localhost:8983/solr", schema=fixtures.SCHEMA)
+        self.bodies = []
+
+    def request(self, method, url, data=None, **kwargs):
+        self.bodies.append(json.loads(data))
+        return fixtures.response()
+
+    def test_docs_unchanged(self):
+        modified = datetime.datetime(2014, 1, 1)
+        docs = [{'id': '1', 'modified': modified, 'name': None}]
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            self.si.add(docs)
+        self.assertEqual(self.bodies, [
+            [{'id': '1', 'modified': '2014-01-01T00:00:00Z'}]])
+        # the documents can be added again
+        self.assertEqual(docs, [
+            {'id': '1', 'modified': modified, 'name': None}])
+
+    def test_date_strings(self):
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            self.si.add([{'id': '1', 'created_dt': '2014-01-01',
+                          'start_dt': '2014-01-01T10:20:30.5'}])
+        self.assertEqual(self.bodies, [
+            [{'id': '1', 'created_dt': '2014-01-01T00:00:00Z',
+              'start_dt': '2014-01-01T10:20:30.500000Z'}]])
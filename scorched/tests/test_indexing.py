@@ -0,0 +1,390 @@
+from __future__ import unicode_literals
+import json
+import mock
+import requests
+import threading
+import time
+import unittest
+import warnings
+import zlib
+import scorched.connection
+import scorched.exc
+import scorched.jsoncodec
+import scorched.retry
+
+from scorched.indexing import AdaptiveBatcher, BulkIndexer
+from scorched.tests.fixtures import SCHEMA, response
+
+
+class TestAdaptiveBatcher(unittest.TestCase):
+
+    def test_batches(self):
+        batcher = AdaptiveBatcher(initial_bytes=30)
+        docs = [{"id": "%s" % i} for i in range(5)] + [{"id": "x" * 100}]
+        batches = list(batcher.batches(docs, json.dumps))
+        self.assertEqual([count for message, count in batches], [2, 2, 1, 1])
+        self.assertTrue(all(len(message) <= 32 for message, count
+                            in batches[:-1]))
+        # a document larger than the budget is sent alone
+        self.assertEqual(json.loads(batches[-1][0].decode('utf-8')),
+                         [{"id": "x" * 100}])
+        self.assertEqual(sum((json.loads(message.decode('utf-8'))
+                              for message, count in batches), []), docs)
+
+    def test_budget_bytes(self):
+        batcher = AdaptiveBatcher(initial_bytes=40)
+        # two documents take 38 characters but 54 bytes
+        docs = [{"id": "\u00fc" * 8} for i in range(3)]
+
+        def encode(doc):
+            return json.dumps(doc, ensure_ascii=False)
+        batches = list(batcher.batches(docs, encode))
+        self.assertEqual([count for message, count in batches], [1, 1, 1])
+        self.assertEqual(json.loads(batches[0][0].decode('utf-8')),
+                         docs[:1])
+
+    def test_budget(self):
+        batcher = AdaptiveBatcher(initial_bytes=100, min_bytes=50,
+                                  max_bytes=1000, target_latency=1.0,
+                                  increase=10, decrease=0.5)
+        # slow start
+        batcher.record(100, 1, 0.1)
+        batcher.record(200, 1, 0.1)
+        self.assertEqual(batcher.budget, 400)
+        # congestion
+        batcher.record(400, 1, 2.0)
+        self.assertEqual(batcher.budget, 200)
+        # additive increase
+        batcher.record(200, 1, 0.1)
+        batcher.record(200, 1, 0.1)
+        self.assertEqual(batcher.budget, 220)
+        batcher.record(220, 1, 0.1, failed=True)
+        batcher.record(110, 1, 0.1, failed=True)
+        self.assertEqual(batcher.budget, 55)
+        batcher.record(55, 1, 0.1, failed=True)
+        self.assertEqual(batcher.budget, 50)
+        stats = batcher.stats()
+        self.assertEqual(stats['batches'], 5)
+        self.assertEqual(stats['bytes'], 1100)
+        self.assertEqual(len(stats['recent']), 8)
+        self.assertAlmostEqual(stats['bytes_per_second'], 1100 / 2.4)
+
+    def test_timed(self):
+        batcher = AdaptiveBatcher(initial_bytes=100, min_bytes=50)
+        sent = []
+        batcher.timed(sent.append)(("[{}]", 1))
+        self.assertEqual(sent, ["[{}]"])
+        self.assertEqual(batcher.budget, 200)
+
+        def fail(message):
+            raise ValueError(message)
+        self.assertRaises(ValueError, batcher.timed(fail), ("[{}]", 1))
+        self.assertEqual(batcher.budget, 100)
+        self.assertEqual(batcher.stats()['recent'][-1][3], True)
+
+
+class FakeInterface(object):
+    json_codec = scorched.jsoncodec.StdlibCodec()
+
+    def __init__(self, fail=False):
+        self.conn = mock.Mock()
+        self.messages = []
+        self.fail = fail
+        self.invalidated = 0
+        self.conn.update.side_effect = self.update
+
+    def invalidate_cache(self):
+        self.invalidated += 1
+
+    def update(self, message, **kwargs):
+        self.messages.append((message, kwargs))
+        if self.fail:
+            raise scorched.exc.SolrError("boom")
+
+    def _encode_doc(self, doc):
+        return json.dumps(doc, sort_keys=True)
+
+
+class TestBulkIndexer(unittest.TestCase):
+
+    def test_max_docs(self):
+        si = FakeInterface()
+        results = []
+        with BulkIndexer(si, max_docs=2, max_delay=10, commit_within=500,
+                         on_success=results.append) as indexer:
+            indexer.add({"id": "1"})
+            indexer.delete(["2", "3"])
+            indexer.delete_by_query("name:x")
+        # the last batch was sent by close
+        self.assertEqual([message for message, kwargs in si.messages], [
+            b'{"add": {"doc": {"id": "1"}}, "delete": {"id": "2"}}',
+            b'{"delete": {"id": "3"}, "delete": {"query": "name:x"}}'])
+        self.assertEqual(si.messages[0][1], {"commitWithin": 500})
+        self.assertEqual(si.invalidated, 2)
+        self.assertEqual(results, [
+            [("add", {"id": "1"}), ("delete", "2")],
+            [("delete", "3"), ("delete_query", "name:x")]])
+        self.assertRaises(ValueError, indexer.add, {"id": "4"})
+
+    def test_max_bytes(self):
+        si = FakeInterface()
+        indexer = BulkIndexer(si, max_bytes=60, max_delay=10)
+        for i in range(3):
+            indexer.add({"id": "%s" % i, "name": "x" * 20})
+        self.assertTrue(indexer.flush())
+        self.assertEqual([message.count(b'"add"')
+                          for message, kwargs in si.messages], [2, 1])
+        indexer.close()
+
+    def test_max_bytes_encoded(self):
+        si = FakeInterface()
+        si._encode_doc = lambda doc: json.dumps(doc, ensure_ascii=False)
+        indexer = BulkIndexer(si, max_bytes=200, max_delay=10)
+        # 66 characters but 106 bytes per add
+        for i in range(3):
+            indexer.add({"id": "\u00fc" * 40})
+        self.assertTrue(indexer.flush())
+        self.assertEqual([message.count(b'"add"')
+                          for message, kwargs in si.messages], [2, 1])
+        indexer.close()
+
+    def test_max_delay(self):
+        si = FakeInterface()
+        sent = threading.Event()
+        indexer = BulkIndexer(si, max_delay=0.05,
+                              on_success=lambda ops: sent.set())
+        indexer.add({"id": "1"})
+        self.assertTrue(sent.wait(5))
+        self.assertEqual(len(si.messages), 1)
+        indexer.close()
+
+    def test_threads(self):
+        si = FakeInterface()
+        sent = []
+        indexer = BulkIndexer(si, max_docs=7, queue_size=5,
+                              on_success=sent.append)
+
+        def produce(n):
+            for i in range(20):
+                indexer.add({"id": "%s-%s" % (n, i)})
+        threads = [threading.Thread(target=produce, args=(n,))
+                   for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        indexer.close()
+        self.assertEqual(len(set(doc["id"] for ops in sent
+                                 for op, doc in ops)), 80)
+        self.assertTrue(all(message.count(b'"add"') <= 7
+                            for message, kwargs in si.messages))
+
+    def test_errors(self):
+        si = FakeInterface(fail=True)
+        indexer = BulkIndexer(si, max_docs=1)
+        indexer.add({"id": "1"})
+        indexer.add({"id": "2"})
+        try:
+            indexer.flush()
+        except scorched.exc.UpdateError as e:
+            self.assertEqual([number for number, error in e.errors], [0, 1])
+        else:
+            self.fail("UpdateError not raised")
+        # the errors were reported once
+        self.assertTrue(indexer.flush())
+        indexer.close()
+        self.assertEqual(si.invalidated, 2)
+
+    def test_exit_with_error(self):
+        si = FakeInterface(fail=True)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            with self.assertRaises(KeyError):
+                with BulkIndexer(si) as indexer:
+                    indexer.add({"id": "1"})
+                    raise KeyError("body")
+        # the failed flush is only reported
+        self.assertEqual(len(si.messages), 1)
+        self.assertTrue("UpdateError" in str(caught[0].message))
+        self.assertTrue(indexer.closed)
+
+    def test_on_error(self):
+        si = FakeInterface(fail=True)
+        failed = []
+        indexer = BulkIndexer(
+            si, on_error=lambda ops, error: failed.append((ops, error)))
+        indexer.add({"id": "1"})
+        self.assertTrue(indexer.flush())
+        self.assertEqual(failed[0][0], [("add", {"id": "1"})])
+        self.assertTrue(isinstance(failed[0][1], scorched.exc.SolrError))
+        indexer.close()
+
+    def test_queue_full(self):
+        si = FakeInterface()
+        release = threading.Event()
+        si.conn.update.side_effect = lambda message, **kwargs: release.wait(5)
+        indexer = BulkIndexer(si, max_docs=1, queue_size=1)
+        indexer.add({"id": "1"})
+        # the first batch blocks the thread, the queue takes one more
+        time.sleep(0.1)
+        indexer.add({"id": "2"})
+        self.assertRaises(scorched.exc.SolrError, indexer.add,
+                          {"id": "3"}, timeout=0.05)
+        release.set()
+        indexer.close()
+
+    def test_close_timeout(self):
+        si = FakeInterface()
+        release = threading.Event()
+        si.conn.update.side_effect = lambda message, **kwargs: release.wait(5)
+        indexer = BulkIndexer(si, max_docs=1, queue_size=1)
+        indexer.add({"id": "1"})
+        time.sleep(0.1)
+        indexer.add({"id": "2"})
+        # neither the flush nor the stop fit into the full queue
+        start = time.time()
+        self.assertEqual(indexer.flush(timeout=0.05), False)
+        indexer.close(timeout=0.1)
+        self.assertTrue(time.time() - start < 1)
+        self.assertTrue(indexer.closed)
+        release.set()
+
+
+class TestParallelAdd(unittest.TestCase):
+
+    def setUp(self):
+        self.si = scorched.connection.SolrInterface(
+            "http://localhost:8983/solr", schema=SCHEMA)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.bodies = []
+        self.fail = ()
+
+    def request(self, method, url, data=None, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.02)
+        docs = json.loads(data)
+        with self.lock:
+            self.in_flight -= 1
+            self.bodies.append(docs)
+        return response(
+            status_code=500 if docs[0]['id'] in self.fail else 200)
+
+    def test_add(self):
+        docs = [{'id': str(i), 'price': 1.0} for i in range(20)]
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            self.si.add(docs, chunk=2, workers=2, max_in_flight=4)
+        self.assertEqual(len(self.bodies), 10)
+        self.assertEqual(sorted(int(doc['id']) for body in self.bodies
+                                for doc in body), list(range(20)))
+        self.assertEqual(self.max_in_flight, 4)
+
+    def test_errors(self):
+        self.fail = ('4', '8')
+        docs = ({'id': str(i)} for i in range(20))
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            with self.assertRaises(scorched.exc.UpdateError) as cm:
+                self.si.add(list(docs), chunk=2, max_in_flight=4)
+        numbers = [number for number, error in cm.exception.errors]
+        self.assertTrue(numbers[0] == 2 and numbers == sorted(numbers))
+        self.assertTrue(all(isinstance(error, scorched.exc.SolrError)
+                            for number, error in cm.exception.errors))
+        # no chunks are started after a failure
+        self.assertTrue(len(self.bodies) < 10)
+
+    def test_serialization_error(self):
+        docs = [{'id': '1'}, {'id': '2', 'price': object()}]
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            with self.assertRaises(scorched.exc.UpdateError) as cm:
+                self.si.add(docs, chunk=1, workers=2)
+        self.assertEqual([number for number, error in cm.exception.errors],
+                         [1])
+        self.assertTrue(isinstance(cm.exception.errors[0][1], TypeError))
+
+    def test_batcher(self):
+        batcher = AdaptiveBatcher(initial_bytes=100)
+        docs = [{'id': str(i), 'price': 1.0} for i in range(50)]
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            self.si.add(docs, batcher=batcher)
+            self.si.add(iter(docs), batcher=batcher, max_in_flight=2)
+        counts = [len(body) for body in self.bodies]
+        self.assertEqual(sum(counts), 100)
+        # the budget doubled while the requests were fast
+        self.assertTrue(counts[0] < counts[2])
+        self.assertEqual(batcher.stats()['docs'], 100)
+
+
+class TestStreamingAdd(unittest.TestCase):
+
+    def setUp(self):
+        self.si = scorched.connection.SolrInterface(
+            "http://localhost:8983/solr", schema=SCHEMA)
+        self.sent = []
+
+    def request(self, method, url, data=None, headers=None, **kwargs):
+        if not isinstance(data, (bytes, str)):
+            chunks = list(data)
+            data = b''.join(chunks)
+        else:
+            chunks = [data]
+        if headers and headers.get('Content-Encoding') == 'gzip':
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        self.sent.append((url, chunks, json.loads(data)))
+        return response()
+
+    def docs(self, count):
+        for i in range(count):
+            yield {'id': str(i), 'price': 1.0, 'name': None}
+
+    def test_generator(self):
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            self.si.add(self.docs(5), chunk=2)
+        self.assertEqual([len(docs) for url, chunks, docs in self.sent],
+                         [2, 2, 1])
+
+    def test_stream(self):
+        self.si.conn.stream_chunk_size = 100
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            self.si.add(self.docs(20), stream=True, commitWithin=1000)
+        self.assertEqual(len(self.sent), 1)
+        url, chunks, docs = self.sent[0]
+        self.assertTrue(url.endswith('commitWithin=1000'))
+        self.assertEqual(docs, [{'id': str(i), 'price': 1.0}
+                                for i in range(20)])
+        self.assertTrue(len(chunks) > 5)
+        stats = self.si.conn.transfer_stats
+        self.assertEqual(stats.bytes_sent, len(b''.join(chunks)))
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            self.si.add([], stream=True)
+        self.assertEqual(self.sent[-1][2], [])
+
+    def test_stream_compressed(self):
+        self.si.conn.compress_updates = 'gzip'
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=self.request):
+            self.si.add(self.docs(50), stream=True)
+        self.assertEqual(len(self.sent[0][2]), 50)
+        stats = self.si.conn.transfer_stats
+        self.assertTrue(stats.bytes_sent < stats.bytes_sent_uncompressed)
+
+    def test_stream_not_retried(self):
+        self.si.conn.retry_policy = scorched.retry.RetryPolicy(
+            max_attempts=3, backoff=0, retry_non_idempotent=True)
+        with mock.patch.object(
+                requests.Session, 'request',
+                side_effect=requests.exceptions.ConnectionError) as request:
+            self.assertRaises(requests.exceptions.ConnectionError,
+                              self.si.add, self.docs(3), stream=True)
+        self.assertEqual(request.call_count, 1)
@@ -0,0 +1,74 @@
+from __future__ import unicode_literals
+import datetime
+import pytz
+import unittest
+
+from scorched import javabin
+
+
+class TestJavaBin(unittest.TestCase):
+
+    def roundtrip(self, value):
+        return javabin.loads(javabin.dumps(value))
+
+    def test_scalars(self):
+        for value in (None, True, False, 0, 15, 16, 2 ** 31 - 1, -1,
+                      -2 ** 31, 2 ** 40, -2 ** 40, 0.5, -12.25, "",
+                      "short", "x" * 31, "long " * 100, "\N{UMBRELLA}",
+                      b"\x00\xff"):
+            self.assertEqual(self.roundtrip(value), value)
+
+    def test_date(self):
+        dt = datetime.datetime(2014, 3, 11, 10, 49, 0, 747000,
+                               tzinfo=pytz.utc)
+        self.assertEqual(self.roundtrip(dt), dt)
+        # naive datetimes are treated as utc, precision is milliseconds
+        self.assertEqual(
+            self.roundtrip(datetime.datetime(1950, 1, 1, 0, 0, 0, 999)),
+            datetime.datetime(1950, 1, 1, tzinfo=pytz.utc))
+
+    def test_containers(self):
+        self.assertEqual(self.roundtrip([1, ["a", None], {"b": 2.5}]),
+                         [1, ["a", None], {"b": 2.5}])
+        # named lists are flat like json.nl=flat
+        self.assertEqual(
+            self.roundtrip({"cat": javabin.NamedList([("book", 3),
+                                                      ("paperback", 2)])}),
+            {"cat": ["book", 3, "paperback", 2]})
+
+    def test_response(self):
+        docs = [{"id": "%s" % i, "name": "doc", "tags": ["a", "b"]}
+                for i in range(40)]
+        data = javabin.dumps(javabin.NamedList([
+            ("responseHeader", {"status": 0, "QTime": 3}),
+            ("response", javabin.DocumentList(docs, numFound=100, start=10,
+                                              maxScore=1.5)),
+        ]))
+        # field names are written once and referenced afterwards
+        self.assertEqual(data.count(b"name"), 1)
+        self.assertEqual(javabin.loads(data), {
+            "responseHeader": {"status": 0, "QTime": 3},
+            "response": {"numFound": 100, "start": 10, "maxScore": 1.5,
+                         "docs": docs}})
+
+    def test_solr_types(self):
+        # bytes as written by solr's JavaBinCodec
+        data = bytearray([2, 0xa4, 0x21, 0x62, 0x00,
+                          0x21, 0x63, 0x05, 0x40, 0, 0, 0, 0, 0, 0, 0,
+                          0x21, 0x64, 0x03, 0xff,
+                          0x21, 0x65, 0x04, 0x01, 0x00])
+        self.assertEqual(javabin.loads(bytes(data)),
+                         {"b": None, "c": 2.0, "d": -1, "e": 256})
+        # iterator, map entry iterator and enum values
+        data = bytearray([2, 14, 0x21, 0x61, 17, 0x21, 0x6b, 0x41, 15,
+                          18, 0x41, 0x21, 0x7a, 15])
+        self.assertEqual(javabin.loads(bytes(data)),
+                         ["a", {"k": 1}, "z"])
+
+    def test_errors(self):
+        self.assertRaises(javabin.JavaBinError, javabin.loads, b"")
+        self.assertRaises(javabin.JavaBinError, javabin.loads, b"\x01\x00")
+        data = javabin.dumps("long string")
+        self.assertRaises(javabin.JavaBinError, javabin.loads, data[:-2])
+        self.assertRaises(javabin.JavaBinError, javabin.loads, b"\x02\x16")
+        self.assertRaises(javabin.JavaBinError, javabin.dumps, object())
@@ -0,0 +1,93 @@
+from __future__ import unicode_literals
+import datetime
+import decimal
+import json
+import mock
+import pytz
+import requests
+import sys
+import unittest
+import scorched.connection
+import scorched.exc
+
+from scorched.jsoncodec import get_codec, StdlibCodec, UjsonCodec
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+DOC = {"id": "1",
+       "created": datetime.datetime(2018, 1, 2, 3, 4, 5, 600000),
+       "local": pytz.timezone("Europe/Berlin").localize(
+           datetime.datetime(2018, 1, 2, 3)),
+       "day": datetime.date(2018, 1, 2),
+       "modified": {"set": datetime.datetime(2018, 1, 2)},
+       "price": decimal.Decimal("1.5"), "count": decimal.Decimal("3"),
+       "tags": set(["a"]), "name": "\xfcber"}
+
+ENCODED = {"id": "1", "created": "2018-01-02T03:04:05.600000Z",
+           "local": "2018-01-02T02:00:00Z", "day": "2018-01-02T00:00:00Z",
+           "modified": {"set": "2018-01-02T00:00:00Z"},
+           "price": 1.5, "count": 3, "tags": ["a"], "name": "\xfcber"}
+
+
+class TestCodecs(unittest.TestCase):
+
+    def check(self, codec):
+        self.assertEqual(json.loads(codec.dumps(DOC)), ENCODED)
+        body = '{"name": "\xfcber", "n": [1, 2.5]}'
+        self.assertEqual(codec.loads(body.encode('utf-8')),
+                         {"name": "\xfcber", "n": [1, 2.5]})
+        self.assertEqual(codec.loads(body)["name"], "\xfcber")
+        self.assertRaises(TypeError, codec.dumps, {"id": object()})
+
+    def test_stdlib(self):
+        self.check(StdlibCodec())
+
+    @unittest.skipIf(orjson is None, "orjson is not installed")
+    def test_orjson(self):
+        codec = get_codec('orjson')
+        self.assertEqual(codec.name, 'orjson')
+        self.check(codec)
+
+    def test_get_codec(self):
+        codec = StdlibCodec()
+        self.assertTrue(get_codec(codec) is codec)
+        self.assertEqual(get_codec().name, 'json')
+        self.assertRaises(scorched.exc.SolrError, get_codec, 'yaml')
+        # auto falls back to the standard library
+        with mock.patch.dict(sys.modules, {'orjson': None, 'ujson': None}):
+            self.assertEqual(get_codec('auto').name, 'json')
+            self.assertRaises(ImportError, UjsonCodec)
+        if orjson is not None:
+            self.assertEqual(get_codec('auto').name, 'orjson')
+
+
+class TestInterfaceCodec(unittest.TestCase):
+
+    def response(self, body):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = body
+        return response
+
+    def test_json_codec(self):
+        codec = mock.Mock(wraps=StdlibCodec())
+        si = scorched.connection.SolrInterface(
+            "http://localhost:8983/solr", json_codec=codec,
+            schema={"uniqueKey": "id",
+                    "fields": [{"name": "id", "type": "string"}]})
+        with mock.patch.object(requests.Session, 'request',
+                               return_value=self.response(b'{}')):
+            si.add([{'id': '1'}])
+        self.assertEqual(codec.dumps.call_args[0][0], [{'id': '1'}])
+        response = self.response(
+            b'{"responseHeader": {"status": 0, "QTime": 1}, '
+            b'"response": {"numFound": 0, "start": 0, "docs": []}}')
+        with mock.patch.object(requests.Session, 'request',
+                               return_value=response):
+            si.query("*:*").execute()
+        # the body is parsed as bytes
+        codec.loads.assert_called_once_with(response._content)
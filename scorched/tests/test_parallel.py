@@ -0,0 +1,112 @@
+from __future__ import unicode_literals
+import functools
+import threading
+import time
+import unittest
+import scorched.exc
+import scorched.search
+
+from scorched.parallel import ParallelExport, sort_key
+
+
+def numbers(start, stop, step=1):
+    return [{'id': i} for i in range(start, stop, step)]
+
+
+def failing():
+    yield {'id': 1}
+    raise ValueError("broken")
+
+
+class ExportInterface(object):
+    unique_key = 'id'
+    field_codecs = ()
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def has_docvalues(self, name):
+        return True
+
+    def export(self, deadline=None, base_url=None, **kwargs):
+        with self.lock:
+            self.calls.append((base_url, kwargs))
+        return [{'id': '%s' % len(self.calls), 'price': 1.0}]
+
+
+class TestParallelExport(unittest.TestCase):
+
+    def test_unordered(self):
+        partitions = [functools.partial(numbers, i, 1000, 4)
+                      for i in range(4)]
+        docs = list(ParallelExport(partitions, workers=2, batch_size=7))
+        self.assertEqual(sorted(d['id'] for d in docs), list(range(1000)))
+
+    def test_ordered(self):
+        partitions = [functools.partial(numbers, i, 100, 3)
+                      for i in range(3)]
+        docs = list(ParallelExport(partitions, workers=1, batch_size=5,
+                                   key=sort_key([['asc', 'id']])))
+        self.assertEqual([d['id'] for d in docs], list(range(100)))
+        partitions = [lambda: [{'id': 5, 'p': 'b'}, {'id': 3, 'p': None}],
+                      lambda: [{'id': 4, 'p': 'c'}, {'id': 2, 'p': 'a'}]]
+        docs = list(ParallelExport(partitions, key=sort_key(
+            [['desc', 'p'], ['asc', 'id']])))
+        self.assertEqual([d['id'] for d in docs], [4, 5, 2, 3])
+
+    def test_back_pressure(self):
+        produced = []
+
+        def partition():
+            for i in range(1000):
+                produced.append(i)
+                yield {'id': i}
+        docs = iter(ParallelExport([partition], batch_size=10, queue_size=2))
+        next(docs)
+        time.sleep(0.2)
+        # two queued batches, one taken by the consumer, one being filled
+        self.assertTrue(len(produced) <= 41)
+        docs.close()
+
+    def test_error(self):
+        partitions = [failing, functools.partial(numbers, 0, 10)]
+        self.assertRaises(ValueError, list, ParallelExport(partitions))
+
+    def test_processes(self):
+        partitions = [functools.partial(numbers, i, 100, 2)
+                      for i in range(2)]
+        docs = list(ParallelExport(partitions, processes=True,
+                                   key=sort_key([['asc', 'id']])))
+        self.assertEqual([d['id'] for d in docs], list(range(100)))
+        self.assertRaises(scorched.exc.SolrError, list,
+                          ParallelExport([failing], processes=True))
+
+
+class TestParallelExportSearch(unittest.TestCase):
+
+    def test_hash_partitions(self):
+        interface = ExportInterface()
+        search = scorched.search.SolrSearch(interface).filter(genre_s='x')
+        docs = list(search.parallel_export(['id', 'price'], partitions=3,
+                                           workers=2))
+        self.assertEqual(len(docs), 3)
+        fqs = sorted(tuple(kwargs['fq']) for base_url, kwargs in
+                     interface.calls)
+        self.assertEqual(fqs, [
+            ('genre_s:x', '{!hash workers=3 worker=%s partitionKeys=id}' % i)
+            for i in range(3)])
+        self.assertEqual(interface.calls[0][1]['sort'], 'id asc')
+
+    def test_shards(self):
+        interface = ExportInterface()
+        search = scorched.search.SolrSearch(interface)
+        docs = list(search.parallel_export(
+            ['id'], shards=['http://a/solr/c1', 'http://b/solr/c2'],
+            ordered=True, constructor=dict))
+        self.assertEqual(len(docs), 2)
+        self.assertEqual(sorted(base_url for base_url, kwargs in
+                                interface.calls),
+                         ['http://a/solr/c1/', 'http://b/solr/c2/'])
+        self.assertEqual(interface.calls[0][1]['distrib'], False)
+        self.assertFalse('fq' in interface.calls[0][1])
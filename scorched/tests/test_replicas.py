@@ -0,0 +1,165 @@
+from __future__ import unicode_literals
+import mock
+import requests
+import unittest
+import scorched.connection
+import scorched.exc
+
+from scorched.replicas import ReplicaSet
+
+
+class TestReplicaSet(unittest.TestCase):
+
+    def test_select_by_latency(self):
+        rs = ReplicaSet(["http://a/solr", "http://b/solr"])
+        a, b = rs.nodes
+        self.assertEqual(a.url, "http://a/solr/")
+        rs.release(rs.select(), 0.5)
+        # a measured slow, b is unknown and gets the next request
+        self.assertTrue(rs.select() is b)
+        rs.release(b, 0.1)
+        self.assertTrue(rs.select() is b)
+        rs.release(b, 1.0)
+        self.assertAlmostEqual(b.latency, 0.3 * 1.0 + 0.7 * 0.1)
+
+    def test_in_flight_weighting(self):
+        rs = ReplicaSet(["http://a/solr", "http://b/solr"])
+        a, b = rs.nodes
+        a.latency = 0.1
+        b.latency = 0.15
+        self.assertTrue(rs.select() is a)
+        # a has one request in flight now, doubling its score
+        self.assertTrue(rs.select() is b)
+
+    def test_cold_start(self):
+        rs = ReplicaSet(["http://a/solr", "http://b/solr"])
+        # concurrent requests before any of them finished
+        selected = [rs.select() for i in range(20)]
+        self.assertEqual([selected.count(n) for n in rs.nodes], [10, 10])
+
+    def test_readmitted_not_flooded(self):
+        rs = ReplicaSet(["http://a/solr", "http://b/solr"])
+        a, b = rs.nodes
+        a.latency = b.latency = 0.1
+        rs.readmit(b)
+        self.assertEqual(b.latency, None)
+        selected = [rs.select() for i in range(50)]
+        self.assertEqual([selected.count(n) for n in rs.nodes], [25, 25])
+
+    def test_eject_and_readmit(self):
+        probe = mock.Mock(return_value=False)
+        rs = ReplicaSet(["http://a/solr", "http://b/solr"], max_failures=2,
+                        check_interval=None, probe=probe)
+        a, b = rs.nodes
+        for i in range(2):
+            rs.select()
+            rs.release(a, failed=True)
+        self.assertFalse(a.healthy)
+        self.assertEqual([rs.select() for i in range(5)], [b] * 5)
+        rs.check()
+        self.assertFalse(a.healthy)
+        probe.return_value = True
+        rs.check()
+        self.assertTrue(a.healthy)
+        probe.assert_called_with(a)
+        # all nodes ejected, fail open
+        a.healthy = b.healthy = False
+        self.assertTrue(rs.select() in (a, b))
+
+
+class TestReplicatedConnection(unittest.TestCase):
+
+    def test_reads_and_writes(self):
+        sc = scorched.connection.SolrConnection(
+            url=["http://a/solr", "http://b/solr"], http_connection=None,
+            mode="", retry_timeout=-1, max_length_get_url=2048,
+            writer_url="http://w/solr", health_check_interval=None)
+        response = mock.Mock(status_code=200, text='{}')
+        with mock.patch.object(requests.Session, 'request',
+                               return_value=response) as request:
+            sc.update('{}')
+            self.assertTrue(request.call_args[0][1].startswith(
+                "http://w/solr/update/json"))
+            hosts = set()
+            for i in range(10):
+                sc.select([])
+                hosts.add(request.call_args[0][1].split("/")[2])
+            self.assertEqual(hosts, set(["a", "b"]))
+
+    def test_failover(self):
+        sc = scorched.connection.SolrConnection(
+            url=["http://a/solr", "http://b/solr"], http_connection=None,
+            mode="", retry_timeout=-1, max_length_get_url=2048,
+            health_check_interval=None)
+
+        def request(method, url, **kwargs):
+            if url.startswith("http://a/"):
+                raise requests.exceptions.ConnectionError()
+            return mock.Mock(status_code=200, text='{"b": 1}')
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=request):
+            for i in range(5):
+                self.assertEqual(sc.select([('q', 'x')]), '{"b": 1}')
+        a, b = sc.replicas.nodes
+        self.assertFalse(a.healthy)
+        self.assertEqual(b.in_flight, 0)
+        with mock.patch.object(
+                requests.Session, 'request',
+                side_effect=requests.exceptions.ConnectionError):
+            self.assertRaises(requests.exceptions.ConnectionError,
+                              sc.select, [])
+
+    def test_server_error(self):
+        sc = scorched.connection.SolrConnection(
+            url=["http://a/solr", "http://b/solr"], http_connection=None,
+            mode="", retry_timeout=-1, max_length_get_url=2048,
+            health_check_interval=None)
+        a, b = sc.replicas.nodes
+        # the quickly failing replica looks faster and is picked first
+        b.latency = 1.0
+        failed = []
+
+        def request(method, url, **kwargs):
+            if url.startswith("http://a/"):
+                failed.append(mock.Mock(status_code=503, text=''))
+                return failed[-1]
+            return mock.Mock(status_code=200, text='{"b": 1}')
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=request):
+            for i in range(5):
+                self.assertEqual(sc.select([('q', 'x')]), '{"b": 1}')
+        self.assertFalse(a.healthy)
+        self.assertEqual(len(failed), sc.replicas.max_failures)
+        self.assertEqual((a.in_flight, b.in_flight), (0, 0))
+        # the failed responses were closed before failing over
+        self.assertTrue(all(response.close.called for response in failed))
+        # the error of the last replica is raised if all of them fail
+        with mock.patch.object(requests.Session, 'request',
+                               return_value=mock.Mock(
+                                   status_code=500, text='')) as send:
+            self.assertRaises(scorched.exc.SolrError, sc.select, [])
+            self.assertEqual(send.call_count, 2)
+
+    def test_hanging_replica(self):
+        sc = scorched.connection.SolrConnection(
+            url=["http://a/solr", "http://b/solr"], http_connection=None,
+            mode="", retry_timeout=-1, max_length_get_url=2048,
+            health_check_interval=None)
+
+        def request(method, url, **kwargs):
+            if url.startswith("http://a/"):
+                raise requests.exceptions.ReadTimeout()
+            return mock.Mock(status_code=200, text='{"b": 1}')
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=request):
+            for i in range(10):
+                self.assertEqual(sc.select([('q', 'x')]), '{"b": 1}')
+        a, b = sc.replicas.nodes
+        # the timeouts failed over, ejected a and were measured
+        self.assertFalse(a.healthy)
+        self.assertTrue(a.failures >= sc.replicas.max_failures)
+        self.assertTrue(a.latency is not None)
+        self.assertEqual(a.in_flight, 0)
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=requests.exceptions.ReadTimeout):
+            self.assertRaises(requests.exceptions.Timeout, sc.select, [])
@@ -1,8 +1,10 @@
 from __future__ import unicode_literals
 import datetime
+import json
 import pytz
 import unittest
 import os.path
+import scorched.javabin
 import scorched.response
 
 
@@ -25,6 +27,11 @@ class ResultsTestCase(unittest.TestCase):
         self.assertEqual(res.status, 0)
         self.assertEqual(res.QTime, 1)
         self.assertEqual(res.result.numFound, 3)
+        self.assertEqual(res.original_json, self.data)
+        # parsed from bytes, the body is still kept as text
+        res = scorched.response.SolrResponse.from_json(
+            self.data.encode('utf-8'), datefields=('_dt', 'modified'))
+        self.assertEqual(res.original_json, self.data)
         # iterable
         self.assertEqual([x['name'] for x in res],
                          [u'The Lightning Thief',
@@ -62,3 +69,132 @@ class ResultsTestCase(unittest.TestCase):
         self.assertRaises(ValueError, res.from_json, self.data_error)
         self.assertEqual(res.__str__(), u'3 results found, starting at #0')
         self.assertEqual(len(res), 3)
+        self.assertEqual(res.partialResults, False)
+
+    def test_partial_results(self):
+        data = json.loads(self.data)
+        data['responseHeader']['partialResults'] = True
+        res = scorched.response.SolrResponse.from_json(json.dumps(data))
+        self.assertEqual(res.partialResults, True)
+
+
+def chunked(data, size):
+    data = data.encode('utf-8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class StreamingResultsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        file = os.path.join(os.path.dirname(__file__), "dumps",
+                            "request_w_facets.json")
+        with open(file) as f:
+            self.data = f.read()
+
+    def test_stream(self):
+        expected = scorched.response.SolrResponse.from_json(
+            self.data, datefields=('_dt', 'modified'))
+        for size in (1, 3, 7, 64, 100000):
+            res = scorched.response.StreamingSolrResponse(
+                chunked(self.data, size), datefields=('_dt', 'modified'))
+            self.assertEqual(res.status, 0)
+            self.assertEqual(res.QTime, 1)
+            self.assertEqual(res.numFound, 3)
+            self.assertEqual(res.start, 0)
+            self.assertEqual(list(res), expected.result.docs)
+            self.assertEqual(res.facet_counts.__dict__,
+                             expected.facet_counts.__dict__)
+            self.assertEqual(res.highlighting, expected.highlighting)
+            self.assertEqual(str(res), u'3 results found, starting at #0')
+
+    def test_stream_unicode_and_numbers(self):
+        data = json.dumps({
+            "responseHeader": {"status": 0, "QTime": 12345},
+            "response": {"numFound": 1234567, "start": 0, "docs": [
+                {"id": u"\N{UMBRELLA}" * 3, "price": 12345.678},
+                {"id": "2", "n": [1, 22, 333]}]},
+            "facet_counts": {"facet_fields": {}, "facet_ranges": {}},
+        }, ensure_ascii=False)
+        for size in (1, 2, 5):
+            res = scorched.response.StreamingSolrResponse(
+                chunked(data, size), constructor=dict)
+            self.assertEqual(res.numFound, 1234567)
+            self.assertEqual(res.QTime, 12345)
+            self.assertEqual(list(res), [
+                {"id": u"\N{UMBRELLA}" * 3, "price": 12345.678},
+                {"id": "2", "n": [1, 22, 333]}])
+
+    def test_components_before_docs(self):
+        res = scorched.response.StreamingSolrResponse(
+            chunked(self.data, 10))
+        # accessing the facets skips the documents
+        self.assertEqual(res.facet_counts.facet_fields['cat'][0], ('book', 3))
+        self.assertEqual(list(res), [])
+
+    def test_empty_and_errors(self):
+        res = scorched.response.StreamingSolrResponse(
+            [b'{"responseHeader": {"status": 0}, ',
+             b'"response": {"numFound": 0, "start": 0, "docs": []}}'])
+        self.assertEqual(list(res), [])
+        self.assertEqual(res.numFound, 0)
+        self.assertEqual(res.highlighting, {})
+        self.assertRaises(ValueError, scorched.response.StreamingSolrResponse,
+                          [b'{"responseHeader": {"status": 1}}'])
+        res = scorched.response.StreamingSolrResponse(
+            [b'{"responseHeader": {"status": 0}, "response": {"docs": [{]}}'])
+        self.assertRaises(ValueError, list, res)
+
+
+class JavaBinResultsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        file = os.path.join(os.path.dirname(__file__), "dumps",
+                            "request_w_facets.json")
+        with open(file) as f:
+            self.data = f.read()
+
+    def to_javabin(self, data, datefields):
+        # re-encode the json dump the way solr writes it in javabin
+        doc = json.loads(data)
+        docs = scorched.response.SolrResponse.from_json(
+            data, datefields).result.docs
+        for d in docs:
+            for name, value in d.items():
+                if isinstance(value, datetime.datetime):
+                    # javabin dates have millisecond precision
+                    d[name] = value.replace(microsecond=0)
+        facet_counts = doc['facet_counts']
+        for name, values in facet_counts['facet_fields'].items():
+            facet_counts['facet_fields'][name] = scorched.javabin.NamedList(
+                zip(values[::2], values[1::2]))
+        for name, ranges in facet_counts['facet_ranges'].items():
+            counts = ranges['counts']
+            ranges['counts'] = scorched.javabin.NamedList(
+                zip(counts[::2], counts[1::2]))
+        response = scorched.javabin.NamedList([
+            ('responseHeader', doc['responseHeader']),
+            ('response', scorched.javabin.DocumentList(
+                docs, doc['response']['numFound'],
+                doc['response']['start'])),
+            ('facet_counts', facet_counts),
+        ])
+        return scorched.javabin.dumps(response), docs
+
+    def test_response(self):
+        datefields = ('_dt', 'modified')
+        data, docs = self.to_javabin(self.data, datefields)
+        res = scorched.response.SolrResponse.from_javabin(data, datefields)
+        expected = scorched.response.SolrResponse.from_json(
+            self.data, datefields)
+        self.assertEqual(res.status, 0)
+        self.assertEqual(res.QTime, 1)
+        self.assertEqual(res.params, expected.params)
+        self.assertEqual(res.original_json, None)
+        self.assertEqual(res.result.numFound, 3)
+        self.assertEqual(res.result.docs, docs)
+        self.assertEqual(
+            [x['modified'] for x in res.result.docs if 'modified' in x],
+            [datetime.datetime(2009, 7, 23, 3, 24, 34, tzinfo=pytz.utc)])
+        self.assertEqual(res.facet_counts.__dict__,
+                         expected.facet_counts.__dict__)
+        self.assertEqual(len(res), 3)
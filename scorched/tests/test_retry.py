@@ -0,0 +1,189 @@
+from __future__ import unicode_literals
+import mock
+import requests
+import unittest
+import scorched.connection
+import scorched.exc
+
+from requests.packages.urllib3.exceptions import (MaxRetryError,
+                                                  NewConnectionError)
+from scorched.retry import CircuitBreaker, RetryPolicy, request_not_sent
+
+
+def refused():
+    reason = NewConnectionError(None, "refused")
+    return requests.exceptions.ConnectionError(
+        MaxRetryError(None, "/", reason))
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_backoff(self):
+        policy = RetryPolicy(max_attempts=4, backoff=0.1, jitter=False)
+        e = requests.exceptions.ReadTimeout()
+        self.assertEqual(policy.backoff_for(1, True, exception=e), 0.1)
+        self.assertEqual(policy.backoff_for(2, True, exception=e), 0.2)
+        self.assertEqual(policy.backoff_for(3, True, exception=e), 0.4)
+        self.assertEqual(policy.backoff_for(4, True, exception=e), None)
+        policy = RetryPolicy(max_attempts=10, backoff=1, max_backoff=3)
+        for attempt in range(1, 10):
+            delay = policy.delay(attempt)
+            self.assertTrue(0 <= delay <= min(3, 2 ** (attempt - 1)))
+
+    def test_idempotency(self):
+        policy = RetryPolicy(jitter=False)
+        e = requests.exceptions.ConnectionError("reset")
+        self.assertEqual(policy.backoff_for(1, True, exception=e), 0.1)
+        self.assertEqual(policy.backoff_for(1, False, exception=e), None)
+        self.assertTrue(request_not_sent(refused()))
+        self.assertFalse(request_not_sent(e))
+        self.assertEqual(policy.backoff_for(1, False, exception=refused()),
+                         0.1)
+        self.assertEqual(policy.backoff_for(
+            1, False, exception=requests.exceptions.ConnectTimeout()), 0.1)
+        self.assertEqual(policy.backoff_for(
+            1, True, exception=scorched.exc.CircuitOpenError()), None)
+        self.assertEqual(policy.backoff_for(1, True, exception=ValueError()),
+                         None)
+
+    def test_status(self):
+        policy = RetryPolicy(jitter=False, max_backoff=5)
+        response = mock.Mock(status_code=503, headers={})
+        self.assertEqual(policy.backoff_for(1, False, response=response), 0.1)
+        response.headers = {'Retry-After': '2'}
+        self.assertEqual(policy.backoff_for(1, True, response=response), 2.0)
+        response.headers = {'Retry-After': '120'}
+        self.assertEqual(policy.backoff_for(1, True, response=response), None)
+        response.headers = {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+        self.assertEqual(policy.backoff_for(1, True, response=response), 0)
+        response = mock.Mock(status_code=500, headers={})
+        self.assertEqual(policy.backoff_for(1, True, response=response), None)
+
+    def test_from_retry_timeout(self):
+        policy = RetryPolicy.from_retry_timeout(-1)
+        self.assertEqual(policy.max_attempts, 1)
+        policy = RetryPolicy.from_retry_timeout(2)
+        e = requests.exceptions.ConnectionError("reset")
+        self.assertEqual(policy.backoff_for(1, False, exception=e), 2)
+        self.assertEqual(policy.backoff_for(2, False, exception=e), None)
+        self.assertEqual(policy.backoff_for(
+            1, True, exception=requests.exceptions.ReadTimeout()), None)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_states(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+        breaker.before_request()
+        breaker.record_failure()
+        breaker.before_request()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertRaises(scorched.exc.CircuitOpenError,
+                          breaker.before_request)
+        breaker.opened_at -= 10
+        # one trial request in half open state
+        breaker.before_request()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertRaises(scorched.exc.CircuitOpenError,
+                          breaker.before_request)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        breaker.opened_at -= 10
+        breaker.before_request()
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        clone = breaker.clone()
+        self.assertEqual(clone.failure_threshold, 2)
+        self.assertEqual(clone.failures, 0)
+
+    def test_release_trial(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        self.assertEqual(breaker.before_request(), None)
+        breaker.record_failure()
+        breaker.opened_at -= 10
+        trial = breaker.before_request()
+        breaker.release_trial(trial)
+        # the trial ended without an outcome, the next request takes over
+        second = breaker.before_request()
+        self.assertNotEqual(second, trial)
+        # releasing a stale trial does not affect the one in flight
+        breaker.release_trial(trial)
+        self.assertRaises(scorched.exc.CircuitOpenError,
+                          breaker.before_request)
+
+
+class TestConnectionRetries(unittest.TestCase):
+
+    def connection(self, **kwargs):
+        return scorched.connection.SolrConnection(
+            url="http://localhost:8983/solr", http_connection=None, mode="",
+            retry_timeout=-1, max_length_get_url=2048, **kwargs)
+
+    def test_retry_select(self):
+        sc = self.connection(retry_policy=RetryPolicy(backoff=0))
+        responses = [mock.Mock(status_code=503, headers={}),
+                     requests.exceptions.ReadTimeout(),
+                     mock.Mock(status_code=200, text='{}')]
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=responses) as request:
+            self.assertEqual(sc.select([]), '{}')
+            self.assertEqual(request.call_count, 3)
+        # the retried response gave its connection back
+        responses[0].close.assert_called_once_with()
+        responses[2].close.assert_not_called()
+
+    def test_no_blind_update_replay(self):
+        sc = self.connection(retry_policy=RetryPolicy(backoff=0))
+        with mock.patch.object(
+                requests.Session, 'request',
+                side_effect=requests.exceptions.ConnectionError) as request:
+            self.assertRaises(requests.exceptions.ConnectionError,
+                              sc.update, '{}')
+            self.assertEqual(request.call_count, 1)
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=[refused(), mock.Mock(
+                                   status_code=200)]) as request:
+            sc.update('{}')
+            self.assertEqual(request.call_count, 2)
+
+    def test_legacy_retry_timeout(self):
+        sc = scorched.connection.SolrConnection(
+            url="http://localhost:8983/solr", http_connection=None, mode="",
+            retry_timeout=0, max_length_get_url=2048)
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=[
+                                   requests.exceptions.ConnectionError,
+                                   mock.Mock(status_code=200)]) as request:
+            sc.update('{}')
+            self.assertEqual(request.call_count, 2)
+
+    def test_circuit_breaker(self):
+        sc = self.connection(
+            circuit_breaker=CircuitBreaker(failure_threshold=2))
+        with mock.patch.object(
+                requests.Session, 'request',
+                return_value=mock.Mock(status_code=500)) as request:
+            for i in range(2):
+                self.assertRaises(scorched.exc.SolrError, sc.select, [])
+            self.assertRaises(scorched.exc.CircuitOpenError, sc.select, [])
+            self.assertEqual(request.call_count, 2)
+        self.assertEqual(list(sc.circuit_breakers), ["localhost:8983"])
+
+    def test_interrupted_trial(self):
+        sc = self.connection(
+            circuit_breaker=CircuitBreaker(failure_threshold=1))
+        with mock.patch.object(requests.Session, 'request',
+                               return_value=mock.Mock(status_code=500)):
+            self.assertRaises(scorched.exc.SolrError, sc.select, [])
+        breaker = sc.circuit_breakers["localhost:8983"]
+        breaker.opened_at -= breaker.reset_timeout
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=KeyboardInterrupt):
+            self.assertRaises(KeyboardInterrupt, sc.select, [])
+        # the half open circuit still lets a trial request through
+        with mock.patch.object(
+                requests.Session, 'request',
+                return_value=mock.Mock(status_code=200, text='{}')):
+            self.assertEqual(sc.select([]), '{}')
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
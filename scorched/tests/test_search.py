@@ -1,6 +1,11 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 import datetime
+import json
+import mock
+import requests
+import scorched.connection
+from scorched.compat import parse_qsl, urlsplit
 from scorched.exc import SolrError
 from scorched.search import (SolrSearch, MltSolrSearch, PaginateOptions,
                              SortOptions, FieldLimitOptions, FacetOptions,
@@ -10,7 +15,8 @@ from scorched.search import (SolrSearch, MltSolrSearch, PaginateOptions,
                              RequestHandlerOption, DebugOptions,
                              params_from_dict, FacetRangeOptions)
 from scorched.strings import WildcardString
-from nose.tools import assert_equal
+from scorched.response import SolrResponse
+from nose.tools import assert_equal, assert_raises
 
 
 debug = False
@@ -500,6 +506,15 @@ complex_boolean_queries = (
     # debug
     (lambda q: q.query("hello").debug(),
      [('debugQuery', b'true'), ('q', b'hello')]),
+    # deadline
+    (lambda q: q.query("hello").deadline(0.25),
+     [('q', b'hello'), ('timeAllowed', b'225')]),
+    (lambda q: q.query("hello").deadline(1, segment_terminate_early=True),
+     [('q', b'hello'), ('segmentTerminateEarly', b'true'),
+      ('timeAllowed', b'900')]),
+    # response format
+    (lambda q: q.query("hello").response_format('javabin'),
+     [('q', b'hello'), ('wt', b'javabin')]),
 )
 
 
@@ -586,3 +601,76 @@ def test_url_encode_data():
 def test_mlt_query_options():
     for (fields, query_fields, kwargs, output) in mlt_query_options_data:
         yield check_mlt_query_options, fields, query_fields, kwargs, output
+
+
+class CursorInterface(object):
+    """
+    Serves ``total`` documents page by page like solr does for cursorMark.
+    """
+    unique_key = 'id'
+
+    def __init__(self, total):
+        self.total = total
+        self.calls = []
+
+    def search(self, deadline=None, **kwargs):
+        self.calls.append(kwargs)
+        rows = kwargs['rows']
+        cursor = kwargs['cursorMark']
+        start = 0 if cursor == '*' else int(cursor)
+        stop = min(start + rows, self.total)
+        docs = [{'id': '%s' % i} for i in range(start, stop)]
+        return SolrResponse.from_json(json.dumps({
+            'responseHeader': {'status': 0},
+            'response': {'numFound': self.total, 'start': 0, 'docs': docs},
+            'nextCursorMark': '%s' % stop}))
+
+
+def test_iter_cursor():
+    interface = CursorInterface(25)
+    docs = list(SolrSearch(interface).query("hello").iter_cursor(
+        page_size=10))
+    assert_equal([d['id'] for d in docs], ['%s' % i for i in range(25)])
+    # the last request returns no documents and the same cursor
+    assert_equal([c['cursorMark'] for c in interface.calls],
+                 ['*', '10', '20', '25'])
+    assert_equal(interface.calls[0]['sort'], 'score desc, id asc')
+    assert_equal(interface.calls[0]['rows'], 10)
+
+
+def test_cursor_pages():
+    interface = CursorInterface(20)
+    search = SolrSearch(interface).sort_by('-price')
+    pages = list(search.cursor_pages(page_size=10, constructor=dict))
+    assert_equal([len(p) for p in pages], [10, 10, 0])
+    assert_equal(interface.calls[0]['sort'], 'price desc, id asc')
+    interface = CursorInterface(5)
+    list(SolrSearch(interface).sort_by('id').iter_cursor())
+    assert_equal(interface.calls[0]['sort'], 'id asc')
+    # the search itself is not changed
+    assert_equal(search.options(), {'q': '*:*', 'sort': 'price desc'})
+    assert_raises(SolrError, list, SolrSearch(interface).paginate(
+        start=10).iter_cursor())
+
+
+def test_cursor_deadline():
+    # solr answers 400 to cursorMark with timeAllowed
+    si = scorched.connection.SolrInterface(
+        "http://localhost:8983/solr", deadline=2,
+        schema={"uniqueKey": "id", "fields": []})
+    response = requests.Response()
+    response.status_code = 200
+    response._content = json.dumps({
+        'responseHeader': {'status': 0},
+        'response': {'numFound': 0, 'start': 0, 'docs': []},
+        'nextCursorMark': '*'}).encode('utf-8')
+    with mock.patch.object(requests.Session, 'request',
+                           return_value=response) as request:
+        list(si.query("hello").iter_cursor())
+        list(si.query("hello").deadline(1).iter_cursor())
+        si.query("hello").execute()
+    params = [dict(parse_qsl(urlsplit(call[0][1]).query))
+              for call in request.call_args_list]
+    assert_equal(['timeAllowed' in p for p in params], [False, False, True])
+    # the client side deadline still applies
+    assert_equal(request.call_args_list[0][1]['timeout'] is not None, True)
@@ -0,0 +1,153 @@
+from __future__ import unicode_literals
+import mock
+import requests
+import threading
+import time
+import unittest
+import scorched.connection
+import scorched.exc
+
+from scorched.singleflight import SingleFlight
+from scorched.tests.fixtures import SCHEMA, select_response
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def run_followers(self, flight, func, count=5, deadline=None):
+        results = [None] * count
+
+        def follow(i):
+            try:
+                results[i] = flight.do('key', func, deadline=deadline)
+            except Exception as e:
+                results[i] = e
+        threads = [threading.Thread(target=follow, args=(i,))
+                   for i in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def lead(self, flight, func):
+        started = threading.Event()
+        release = threading.Event()
+
+        def leading():
+            started.set()
+            release.wait(5)
+            return func()
+        leader = threading.Thread(target=lambda: self.outcome.append(
+            self.call(flight, leading)))
+        leader.start()
+        started.wait(5)
+        return leader, release
+
+    def call(self, flight, func):
+        try:
+            return flight.do('key', func)
+        except Exception as e:
+            return e
+
+    def setUp(self):
+        self.outcome = []
+
+    def wait_for_followers(self):
+        # give the followers time to find the call of the leader
+        time.sleep(0.1)
+
+    def test_coalesce(self):
+        flight = SingleFlight()
+        calls = []
+        leader, release = self.lead(flight, lambda: calls.append(1) or "res")
+        threads, results = self.run_followers(
+            flight, lambda: calls.append(1) or "other")
+        self.wait_for_followers()
+        release.set()
+        leader.join(5)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(self.outcome, ["res"])
+        self.assertEqual(results, ["res"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats(), {
+            'leaders': 1, 'coalesced': 5, 'leader_failures': 0,
+            'in_flight': 0})
+        # the next call is not coalesced with the finished one
+        self.assertEqual(flight.do('key', lambda: "new"), "new")
+
+    def test_leader_failure(self):
+        flight = SingleFlight()
+        error = scorched.exc.SolrError("boom")
+
+        def fail():
+            raise error
+        leader, release = self.lead(flight, fail)
+        threads, results = self.run_followers(flight, lambda: "other")
+        self.wait_for_followers()
+        release.set()
+        leader.join(5)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(self.outcome, [error])
+        self.assertEqual(results, [error] * 5)
+        self.assertEqual(flight.leader_failures, 1)
+        self.assertEqual(flight.stats()['in_flight'], 0)
+
+    def test_leader_deadline(self):
+        flight = SingleFlight()
+
+        def timeout():
+            raise scorched.exc.DeadlineExceeded("Deadline exceeded")
+        leader, release = self.lead(flight, timeout)
+        threads, results = self.run_followers(flight, lambda: "retried")
+        self.wait_for_followers()
+        release.set()
+        leader.join(5)
+        for thread in threads:
+            thread.join(5)
+        self.assertTrue(isinstance(self.outcome[0],
+                                   scorched.exc.DeadlineExceeded))
+        # the followers repeated the request instead of failing
+        self.assertEqual(results, ["retried"] * 5)
+        self.assertEqual(flight.leader_failures, 1)
+        self.assertTrue(flight.leaders >= 2)
+
+    def test_follower_deadline(self):
+        flight = SingleFlight()
+        leader, release = self.lead(flight, lambda: "res")
+        threads, results = self.run_followers(
+            flight, lambda: "other", count=1, deadline=time.time() + 0.05)
+        threads[0].join(5)
+        self.assertTrue(isinstance(results[0],
+                                   scorched.exc.DeadlineExceeded))
+        release.set()
+        leader.join(5)
+        self.assertEqual(self.outcome, ["res"])
+
+
+class TestCoalescedSearch(unittest.TestCase):
+
+    def test_coalesce(self):
+        si = scorched.connection.SolrInterface(
+            "http://localhost:8983/solr", schema=SCHEMA, coalesce=True)
+        release = threading.Event()
+
+        def response(*args, **kwargs):
+            release.wait(5)
+            return select_response([{"id": "1"}])
+        results = []
+        with mock.patch.object(requests.Session, 'request',
+                               side_effect=response) as request:
+            # different deadlines send different timeAllowed
+            threads = [threading.Thread(target=lambda i=i: results.append(
+                si.query(id=1).deadline(5 - i).execute()))
+                for i in range(4)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.1)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+            self.assertEqual(request.call_count, 1)
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(res is results[0] for res in results))
+        self.assertEqual(si.conn.single_flight.coalesced, 3)
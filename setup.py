@@ -30,6 +30,9 @@ setup(name='scorched',
           "mock",
           "pytz",
       ],
+      extras_require={
+          "async": ["aiohttp"],
+      },
       test_suite='scorched.tests',
       setup_requires=["setuptools_git"],
       )